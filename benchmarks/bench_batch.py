@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+compares sweeping a program over every input value with the scalar simulator against shenasm.batch
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+import shenasm.batch
+
+
+# reads an XBus value, branches on it and writes a derived value out every time unit
+PROGRAM = """
+  mov x0 acc
+  tlt acc 0
++ mul -1
+  tgt acc 500
++ sub 500
+- dgt 1
+  mov acc x1
+  slp 1
+"""
+
+
+def build_program(text, chip):
+    """
+    :return: the decoded program for some source text, which synthetic.py can't generate as it has to read x0
+    """
+    issues = shenasm.errors.IssueLog()
+    lines = [
+        shenasm.source.LineOfSource(shenasm.source.SourcePosition("<benchmark>", number), line)
+        for number, line in enumerate(text.splitlines(), start=1)
+    ]
+    assembled, _ = shenasm.assemble.assemble(issues, lines, chip)
+    if len(issues.errors) > 0:
+        for issue in issues.issues:
+            print(issue)
+        raise SystemExit("benchmark program failed to assemble")
+    return shenasm.sim.decode_program(assembled, chip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark batch simulation against the scalar simulator")
+    parser.add_argument('-t', '--time-units', type=int, default=200, help='time units to simulate per input')
+    args = parser.parse_args()
+
+    chip_info = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+    program = build_program(PROGRAM, chip_info)
+    values = range(-999, 1000)
+
+    start = time.perf_counter()
+    executed = 0
+    for value in values:
+        io = shenasm.sim.PinIO(xbus_inputs={'x0': [value] * args.time_units})
+        chip = shenasm.sim.Chip(program, io)
+        chip.run_for(args.time_units)
+        executed += chip.power
+    scalar = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = shenasm.batch.sweep(program, 'x0', values, args.time_units)
+    vectorised = time.perf_counter() - start
+
+    if int(batch.power.sum()) != executed:
+        raise SystemExit("batch and scalar simulations disagree on instructions executed")
+
+    print("{} inputs x {} time units ({} instructions)".format(len(values), args.time_units, executed))
+    print("  scalar: {:.3f}s".format(scalar))
+    print("  batch:  {:.3f}s ({:.1f}x)".format(vectorised, scalar / vectorised))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+times build_ir_graph over synthetic programs of increasing size, the time per line should stay flat
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+
+from synthetic import ProgramShape, source_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark building the intermediate representation graph")
+    parser.add_argument('sizes', type=int, nargs='*', default=[2500, 5000, 10000, 20000, 40000], help='program sizes in lines')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        issues = shenasm.errors.IssueLog()
+        instructions = shenasm.parse.Parser(issues).parse_lines(source_lines(ProgramShape(size)))
+        start = time.perf_counter()
+        graph = shenasm.intermediate.build_ir_graph(issues, instructions)
+        elapsed = time.perf_counter() - start
+        print("{:>7} lines {:>7} regions {:8.3f}s {:8.2f}us/line".format(
+            size, len(graph), elapsed, elapsed / size * 1e6
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+measures how many bytes each parsed line of source costs to keep in memory, against reference records that hold the
+same values the way they were held before the records were slotted: in a __dict__ per object and with a separate copy
+of every string
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+
+from synthetic import ProgramShape, source_lines
+
+
+class ReferencePosition(object):
+    def __init__(self, file, line):
+        self.file = file
+        self.line = line
+
+
+class ReferenceLine(object):
+    def __init__(self, pos, text):
+        self.pos = pos
+        self.text = text
+
+
+class ReferenceInstruction(object):
+    def __init__(self, source_pos, label, condition, mnemonic, args):
+        self.source_pos = source_pos
+        self.label = label
+        self.condition = condition
+        self.mnemonic = mnemonic
+        self.args = args
+
+
+def _copy(text):
+    """:return: a string equal to text that isn't the same object, as splitting a line used to give"""
+    return None if text is None else (text + " ")[:-1]
+
+
+def reference_lines(lines):
+    return [ReferenceLine(ReferencePosition(_copy(line.pos.file), line.pos.line), line.text) for line in lines]
+
+
+def reference_instructions(instructions):
+    return [
+        ReferenceInstruction(
+            ReferencePosition(_copy(instruction.source_pos.file), instruction.source_pos.line), instruction.label,
+            _copy(instruction.condition), _copy(instruction.mnemonic),
+            [_copy(arg) for arg in instruction.args] if instruction.args is not None else None
+        )
+        for instruction in instructions
+    ]
+
+
+def measure(build, *args):
+    """:return: what build returned and the bytes it allocated and kept"""
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(*args)
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark memory used by parsed source")
+    parser.add_argument('-n', '--lines', type=int, default=100000, help='size of the synthetic program')
+    args = parser.parse_args()
+
+    text = [line.text for line in source_lines(ProgramShape(args.lines))]
+
+    tracemalloc.start()
+    lines, line_bytes = measure(
+        lambda: list(shenasm.source.preprocess_lines(shenasm.errors.IssueLog(), text, "<synthetic>"))
+    )
+    instructions, instruction_bytes = measure(shenasm.parse.Parser(shenasm.errors.IssueLog()).parse_lines, lines)
+    _, reference_line_bytes = measure(reference_lines, lines)
+    _, reference_instruction_bytes = measure(reference_instructions, instructions)
+    tracemalloc.stop()
+
+    print("{} lines, {} instructions".format(len(lines), len(instructions)))
+    print("                slotted    reference (bytes/line)")
+    for name, slotted, reference in (
+        ("LineOfSource", line_bytes, reference_line_bytes),
+        ("Instruction", instruction_bytes, reference_instruction_bytes),
+        ("total", line_bytes + instruction_bytes, reference_line_bytes + reference_instruction_bytes),
+    ):
+        print("  {:<12} {:9.1f} {:12.1f}".format(name, slotted / len(lines), reference / len(lines)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+measures how many lines per second Parser can turn into instructions
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+
+from synthetic import ProgramShape, source_lines
+
+
+def decorate(lines, seed=0):
+    """adds the comments, blank lines and mixed indentation real sources have to synthetic lines"""
+    rng = random.Random(seed)
+    result = []
+    for line in lines:
+        text = line.text
+        choice = rng.random()
+        if choice < 0.2:
+            text = "{}  # {}".format(text, "explain what this line is for")
+        elif choice < 0.25:
+            text = "# a comment on its own line"
+        elif choice < 0.3:
+            text = ""
+        elif choice < 0.4:
+            text = text.replace(" ", "\t")
+        result.append(shenasm.source.LineOfSource(line.pos, text))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark parsing throughput")
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='size of the synthetic program')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of runs, the best is reported')
+    args = parser.parse_args()
+
+    lines = decorate(source_lines(ProgramShape(args.lines)))
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        shenasm.parse.Parser(shenasm.errors.IssueLog()).parse_lines(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("{} lines in {:.3f}s: {:.0f} lines/s".format(len(lines), best, len(lines) / best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+times every stage of the pipeline over generated programs of various shapes and writes the results as JSON,
+which can be kept and compared with a later run to catch performance regressions:
+
+    benchmarks/bench_pipeline.py -o baseline.json
+    ... change things ...
+    benchmarks/bench_pipeline.py --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+
+from synthetic import ProgramShape, generate_program
+
+
+# bump this whenever the layout of the results changes
+RESULTS_FORMAT = 1
+
+# the programs measured by default, each varies one thing from the medium program
+SCENARIOS = {
+    "small": ProgramShape(lines=1000),
+    "medium": ProgramShape(lines=10000),
+    "large": ProgramShape(lines=50000),
+    "label_heavy": ProgramShape(lines=10000, label_density=0.3),
+    "deep_conditionals": ProgramShape(lines=10000, conditional_depth=8),
+    "many_includes": ProgramShape(lines=10000, include_fanout=32),
+}
+
+STAGES = ("read_lines", "parse_lines", "symbol_pass", "build_ir_graph", "assemble", "write_out")
+
+# stages quicker than this in the baseline are too noisy to flag as regressions
+NOISE_FLOOR_SECONDS = 0.001
+
+
+def time_stage(repeat, function):
+    """
+    :return: the times of each of repeat calls of function, and the result of the last call
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def measure(shape: ProgramShape, repeat: int) -> dict:
+    """
+    generates a program and times each stage on it, each stage is given the output of the one before
+    :return: the scenario's configuration, what each stage produced and the best and median time of each stage
+    """
+    chip = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+    with tempfile.TemporaryDirectory() as directory:
+        root_path = generate_program(directory, shape)
+
+        def read():
+            with open(root_path) as handle:
+                included_files = {root_path: shenasm.source.SourcePosition("<benchmark>", None)}
+                return shenasm.source.read_lines(shenasm.errors.IssueLog(), handle, root_path, included_files)
+
+        def parse():
+            return shenasm.parse.Parser(shenasm.errors.IssueLog()).parse_lines(lines)
+
+        def symbols():
+            return shenasm.assemble.symbol_pass(shenasm.errors.IssueLog(), instructions, chip)
+
+        def ir_graph():
+            return shenasm.intermediate.build_ir_graph(shenasm.errors.IssueLog(), instructions)
+
+        def assemble():
+            return shenasm.assemble.assemble(shenasm.errors.IssueLog(), lines, chip)
+
+        output_path = os.path.join(directory, "out.asm")
+
+        def write():
+            shenasm.serialise.write_out(assembled, output_path)
+
+        timings = {}
+        timings["read_lines"], lines = time_stage(repeat, read)
+        timings["parse_lines"], instructions = time_stage(repeat, parse)
+        timings["symbol_pass"], symbol_table = time_stage(repeat, symbols)
+        timings["build_ir_graph"], graph = time_stage(repeat, ir_graph)
+        timings["assemble"], (assembled, _) = time_stage(repeat, assemble)
+        timings["write_out"], _ = time_stage(repeat, write)
+
+    return {
+        "shape": shape.to_dict(),
+        "counts": {
+            "lines": len(lines),
+            "instructions": len(instructions),
+            "symbols": len(symbol_table),
+            "regions": len(graph),
+            "output": len(assembled),
+        },
+        "seconds": {
+            stage: {"best": round(min(times), 6), "median": round(statistics.median(times), 6)}
+            for stage, times in timings.items()
+        },
+    }
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> [str]:
+    """
+    :return: a description of every stage whose best time grew by more than threshold (a fraction) over the baseline
+    """
+    regressions = []
+    for name, scenario in sorted(results["scenarios"].items()):
+        old_scenario = baseline.get("scenarios", {}).get(name, None)
+        if old_scenario is None:
+            continue
+        if old_scenario["shape"] != scenario["shape"]:
+            print("{}: program shape changed, not comparing".format(name), file=sys.stderr)
+            continue
+        for stage in STAGES:
+            old = old_scenario["seconds"].get(stage, {}).get("best", None)
+            new = scenario["seconds"][stage]["best"]
+            if old is None:
+                continue
+            ratio = new / old if old > 0 else 1.0
+            print("{:<18} {:<15} {:9.3f}ms -> {:9.3f}ms  {:+6.1f}%".format(
+                name, stage, old * 1000, new * 1000, (ratio - 1) * 100
+            ), file=sys.stderr)
+            if old >= NOISE_FLOOR_SECONDS and ratio > 1 + threshold:
+                regressions.append("{} {} is {:.0f}% slower".format(name, stage, (ratio - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark each stage of the assembler over synthetic programs")
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, may be given more than once, defaults to all of them')
+    parser.add_argument('--lines', type=int, help='run a custom scenario of this many lines instead')
+    parser.add_argument('--label-density', type=float, default=0.05, help='fraction of lines that are labels')
+    parser.add_argument('--depth', type=int, default=2, help='how deeply conditional blocks nest')
+    parser.add_argument('--fanout', type=int, default=4, help='how many files the root file includes')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the program generator')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='how many times to run each stage')
+    parser.add_argument('-o', '--output', type=str, default=None, help='write the results here instead of stdout')
+    parser.add_argument('--compare', type=str, default=None, help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction a stage may slow down by before --compare reports a regression')
+    args = parser.parse_args()
+
+    if args.lines is not None:
+        scenarios = {"custom": ProgramShape(args.lines, args.label_density, args.depth, args.fanout, args.seed)}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in (args.scenario or sorted(SCENARIOS))}
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "scenarios": {},
+    }
+    for name, shape in scenarios.items():
+        print("running {}...".format(name), file=sys.stderr)
+        results["scenarios"][name] = measure(shape, args.repeat)
+
+    # sorted keys and a fixed layout keep the output diffable between runs
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            handle.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare is not None:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        regressions = compare(baseline, results, args.threshold)
+        for regression in regressions:
+            print("regression: {}".format(regression), file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
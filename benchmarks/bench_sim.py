@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+measures how many instructions per second the shenasm.sim engine sustains on a single chip running a synthetic
+program, both interpreted and compiled by shenasm.compiled
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+
+from synthetic import ProgramShape, source_lines
+
+
+def build_program(shape, chip):
+    issues = shenasm.errors.IssueLog()
+    assembled, _ = shenasm.assemble.assemble(issues, source_lines(shape, "<benchmark>"), chip)
+    if len(issues.errors) > 0:
+        for issue in issues.issues:
+            print(issue)
+        raise SystemExit("benchmark program failed to assemble")
+    return shenasm.sim.decode_program(assembled, chip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the single chip simulator")
+    parser.add_argument('-t', '--time-units', type=int, default=200000, help='time units to simulate')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of runs, the best is reported')
+    parser.add_argument('-n', '--lines', type=int, default=100, help='size of the synthetic program')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the program generator')
+    parser.add_argument('--min-speedup', type=float, default=None,
+                        help='fail if the compiled engine is not at least this many times faster')
+    args = parser.parse_args()
+
+    chip_info = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+    # every loop in the program sleeps, as a controller chip's would, so that it can be simulated
+    program = build_program(ProgramShape(args.lines, seed=args.seed, sleeping_loops=True), chip_info)
+
+    rates = []
+    for name, chip_class in (("interpreted", shenasm.sim.Chip), ("compiled", shenasm.compiled.CompiledChip)):
+        best = None
+        executed = 0
+        for _ in range(args.repeat):
+            chip = chip_class(program)
+            start = time.perf_counter()
+            chip.run_for(args.time_units)
+            elapsed = time.perf_counter() - start
+            executed = chip.power
+            best = elapsed if best is None else min(best, elapsed)
+
+        print("{}: {} instructions over {} time units in {:.3f}s: {:.2f}M instructions/s".format(
+            name, executed, args.time_units, best, executed / best / 1e6
+        ))
+        rates.append(executed / best)
+
+    speedup = rates[1] / rates[0]
+    print("speedup: {:.2f}x".format(speedup))
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        raise SystemExit("the compiled engine is only {:.2f}x faster, expected at least {:.2f}x".format(
+            speedup, args.min_speedup
+        ))
+
+
+if __name__ == "__main__":
+    main()
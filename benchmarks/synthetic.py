@@ -0,0 +1,155 @@
+"""
+generates synthetic programs, spread over a root file and the files it includes, for benchmarking the whole pipeline,
+or as a list of lines for benchmarking a single stage
+"""
+
+import os
+import random
+
+import shenasm
+
+
+class ProgramShape(object):
+    """the knobs that control what a synthetic program looks like"""
+
+    def __init__(self, lines=10000, label_density=0.05, conditional_depth=2, include_fanout=4, seed=0,
+                 sleeping_loops=False):
+        """
+        :param lines: roughly how many lines of source to generate across all files
+        :param label_density: the fraction of lines that are labels
+        :param conditional_depth: how deeply blocks skipped by conditional jumps may nest
+        :param include_fanout: how many files the root file includes, its lines are shared out between them
+        :param seed: the same seed and shape always generate the same program
+        :param sleeping_loops: whether every backward jump sleeps first, so that the program can be simulated
+        """
+        self.lines = lines
+        self.label_density = label_density
+        self.conditional_depth = conditional_depth
+        self.include_fanout = include_fanout
+        self.seed = seed
+        self.sleeping_loops = sleeping_loops
+
+    def to_dict(self):
+        result = {
+            "lines": self.lines,
+            "label_density": self.label_density,
+            "conditional_depth": self.conditional_depth,
+            "include_fanout": self.include_fanout,
+            "seed": self.seed,
+        }
+        # left out when off, so that results saved before it existed still compare
+        if self.sleeping_loops:
+            result["sleeping_loops"] = True
+        return result
+
+
+# constants defined at the top of every program for the body to refer to
+CONSTANTS = 8
+
+
+class _Generator(object):
+
+    def __init__(self, shape: ProgramShape):
+        self._shape = shape
+        self._rng = random.Random(shape.seed)
+        # labels are numbered across every file, as includes put everything in the same namespace
+        self._labels = []
+        self._skips = 0
+
+    def body(self, target):
+        """:return: about target lines of code"""
+        out = []
+        while len(out) < target:
+            self._statement(out, 0)
+        return out
+
+    def _statement(self, out, depth):
+        rng = self._rng
+        choice = rng.random()
+        if choice < self._shape.label_density:
+            name = "label{}".format(len(self._labels))
+            self._labels.append(name)
+            out.append("{}:".format(name))
+        elif choice < 0.25 and depth < self._shape.conditional_depth:
+            # a block skipped by a conditional jump, which may contain further blocks
+            skip = "skip{}".format(self._skips)
+            self._skips += 1
+            out.append("  teq acc {}".format(rng.randint(-999, 999)))
+            out.append("- jmp {}".format(skip))
+            for _ in range(rng.randint(2, 6)):
+                self._statement(out, depth + 1)
+            out.append("{}:".format(skip))
+        elif choice < 0.4:
+            out.append("  tgt acc {}".format(rng.randint(-999, 999)))
+            for _ in range(rng.randint(1, 3)):
+                out.append("{} add {}".format(rng.choice("+-"), rng.randint(1, 9)))
+        elif choice < 0.45 and self._labels:
+            out.append("  tlt acc 0")
+            if self._shape.sleeping_loops:
+                out.append("+ slp 1")
+            out.append("+ jmp {}".format(rng.choice(self._labels)))
+        elif choice < 0.55:
+            out.append("  add LIMIT{}".format(rng.randrange(CONSTANTS)))
+        elif choice < 0.6:
+            out.append("  slp 1")
+        else:
+            out.append("  mov {} acc".format(rng.randint(-999, 999)))
+
+
+def _start():
+    """:return: the constants and label every program starts with"""
+    return ["const LIMIT{} {}".format(index, index * 10) for index in range(CONSTANTS)] + ["start:"]
+
+
+def _end(shape: ProgramShape):
+    """:return: the lines every program ends with, jumping back to the start"""
+    return (["  slp 1"] if shape.sleeping_loops else []) + ["  jmp start"]
+
+
+def generate_lines(shape: ProgramShape) -> [str]:
+    """
+    generates a synthetic program as a single file, without any includes whatever the shape's include_fanout
+    :return: the text of each line
+    """
+    generator = _Generator(shape)
+    lines = _start()
+    lines.extend(generator.body(max(0, shape.lines - len(lines) - len(_end(shape)))))
+    lines.extend(_end(shape))
+    return lines
+
+
+def source_lines(shape: ProgramShape, file: str = "<synthetic>") -> [shenasm.source.LineOfSource]:
+    """:return: the lines generate_lines() makes, as if read from a file, for stages after read_lines"""
+    return [
+        shenasm.source.LineOfSource(shenasm.source.SourcePosition(file, number), text)
+        for number, text in enumerate(generate_lines(shape), start=1)
+    ]
+
+
+def generate_program(directory: str, shape: ProgramShape) -> str:
+    """
+    writes a synthetic program into a directory
+    :param directory: where to put the root file and the files it includes
+    :param shape: what the program should look like
+    :return: the path of the root file
+    """
+    generator = _Generator(shape)
+    share = max(1, shape.lines // (shape.include_fanout + 1))
+
+    root = _start()
+    for index in range(shape.include_fanout):
+        name = "part{}.asm".format(index)
+        with open(os.path.join(directory, name), 'w') as handle:
+            handle.write("\n".join(generator.body(share)))
+            handle.write("\n")
+        # the root file's own code is interleaved with the includes
+        root.append('!include "{}"'.format(name))
+        root.extend(generator.body(share // max(1, shape.include_fanout)))
+    root.extend(generator.body(max(0, shape.lines - share * shape.include_fanout - len(root))))
+    root.extend(_end(shape))
+
+    root_path = os.path.join(directory, "root.asm")
+    with open(root_path, 'w') as handle:
+        handle.write("\n".join(root))
+        handle.write("\n")
+    return root_path
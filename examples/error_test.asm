@@ -11,7 +11,7 @@
 const redef 4
 const redef 4
 
-# constants must be integers
+# constants must be integers, or expressions of other constants
 const non_integer_const non_integer_value
 
 # argument counts
@@ -2,6 +2,7 @@
 
 import argparse
 import typing
+import time
 import sys
 import io
 import os
@@ -12,14 +13,25 @@ import shenasm
 
 def main():
     args = get_args()
-    result = 0
 
     if args.verbose:
         shenasm.log.verbose = shenasm.log.verbose_on
 
+    if args.manifest is not None or args.glob:
+        sys.exit(batch(args))
+
+    if args.input is None:
+        print("an input file is required unless --manifest or --glob is given")
+        sys.exit(-1)
+
+    if args.verify:
+        args.input.close()
+        sys.exit(verify(args))
+
     root_path = os.path.abspath(args.input.name)
 
-    issues = shenasm.errors.IssueLog()
+    diagnostics = open_diagnostics(args)
+    issues = shenasm.errors.IssueLog(args.max_errors, diagnostics.write if diagnostics is not None else None)
 
     chip = shenasm.chips.lookup_by_name(args.chip)
     shenasm.log.verbose("selected chip {}:".format(args.chip))
@@ -29,6 +41,29 @@ def main():
             reg, chip.registers[reg].type
         ))
 
+    cache = None
+    cache_dir = args.cache_dir or shenasm.cache.default_cache_dir()
+    if cache_dir is not None:
+        shenasm.log.verbose("using parse cache in {}".format(cache_dir))
+        cache = shenasm.cache.ParseCache(cache_dir)
+
+    profiler = shenasm.profiling.Profiler() if args.profile is not None else shenasm.profiling.NULL_PROFILER
+
+    if args.watch:
+        args.input.close()
+        sys.exit(watch(args, chip, root_path, cache, diagnostics))
+
+    # with a cache, files are parsed (or fetched from the cache) one at a time
+    if cache is not None:
+        args.input.close()
+        build = shenasm.watch.IncrementalAssembler(chip, cache, args.max_errors, args.optimise).build(
+            root_path, diagnostics.write if diagnostics is not None else None, profiler
+        )
+        shenasm.log.verbose("parse cache: {} hits, {} misses".format(cache.hits, cache.misses))
+        result = report(args, build.issues, build.assembled, build.ir_nodes, diagnostics, profiler)
+        print_profile(args, profiler)
+        sys.exit(result)
+
     # this dictionary will track what files we include to prevent include cycles
     # the key is the absolute path to an included file
     # the value tracks where it was included
@@ -36,28 +71,282 @@ def main():
     included_files = {
         str(os.path.abspath(root_path)): shenasm.source.SourcePosition("<root file passed to assembler>", None)
     }
-    lines = shenasm.source.read_lines(issues, args.input, root_path, included_files)
+    # lines are read lazily as the parser asks for them, rather than holding every file in memory at once
+    lines = shenasm.source.iter_lines(issues, args.input, root_path, included_files)
+
+    try:
+        if args.profile is not None:
+            # read everything up front so that reading is measured separately from parsing
+            with profiler.phase("read") as counts:
+                lines = list(lines)
+                counts["lines"] = len(lines)
+                counts["files"] = len(included_files)
+        assembled, ir_nodes = shenasm.assemble.assemble(issues, lines, chip, profiler, args.optimise)
+    except shenasm.errors.TooManyErrors:
+        assembled, ir_nodes = None, None
+    result = report(args, issues, assembled, ir_nodes, diagnostics, profiler)
+    print_profile(args, profiler)
+
+    sys.exit(result)
 
-    assembled, ir_nodes = shenasm.assemble.assemble(issues, lines, chip)
-    if args.dotfile is not None:
-        shenasm.intermediate.output_ir_dotfile(args.dotfile, ir_nodes)
-        print("wrote intermediate representation graph to dotfile: {}".format(args.dotfile))
+
+def print_profile(args, profiler):
+    """prints the measurements of each phase to stderr, keeping them apart from the assembler's usual output"""
+    if args.profile is not None:
+        print(shenasm.profiling.FORMATS[args.profile](profiler), file=sys.stderr)
+
+
+def open_diagnostics(args):
+    """
+    :return: the writer that streams issues in the requested machine readable format, or None for plain text
+    """
+    if args.diagnostics_format == 'text':
+        return None
+    return shenasm.diagnostics.FORMATS[args.diagnostics_format](sys.stdout)
+
+
+def report(args, issues, assembled, ir_nodes, diagnostics=None, profiler=shenasm.profiling.NULL_PROFILER) -> int:
+    """
+    prints the issues from an assembly and writes out its results
+    :param diagnostics: if given, the issues have already been streamed through it and it only needs closing
+    :param profiler: measures writing out the results
+    :return: the exit code for the assembly
+    """
+    # keep stdout for the diagnostics when they are machine readable
+    out = sys.stdout if diagnostics is None else sys.stderr
+
+    coverage = None
+    if args.coverage is not None and issues.error_count < 1:
+        with profiler.phase("coverage"):
+            coverage = measure_coverage(args, issues, assembled, ir_nodes, out)
+
+    if args.dotfile is not None and ir_nodes is not None:
+        with profiler.phase("dotfile") as counts:
+            shenasm.intermediate.output_ir_dotfile(
+                args.dotfile, ir_nodes, coverage.regions(ir_nodes) if coverage is not None else None
+            )
+            counts["regions"] = len(ir_nodes)
+        print("wrote intermediate representation graph to dotfile: {}".format(args.dotfile), file=out)
+
+    if (args.check_timing or args.time_budget is not None) and ir_nodes is not None:
+        with profiler.phase("timing"):
+            shenasm.timing.verify_timing(issues, ir_nodes, args.time_budget, dict(args.loop_bound))
+
+    if args.power and ir_nodes is not None:
+        with profiler.phase("power"):
+            estimate = shenasm.timing.estimate_power(ir_nodes, dict(args.loop_bound))
+        print(estimate.format_text(), file=out)
+
+    if args.superopt is not None and issues.error_count < 1:
+        with profiler.phase("superopt") as counts:
+            assembled = superoptimise(args, issues, assembled, out)
+            counts["lines"] = len(assembled)
 
     if len(issues.issues) > 0:
         print("{} warnings and {} errors".format(
-            len(issues.warnings),
-            len(issues.errors)
-        ))
+            issues.warning_count,
+            issues.error_count
+        ), file=out)
+        if diagnostics is None:
+            for issue in issues.issues:
+                print(issue)
+
+    if diagnostics is not None:
+        diagnostics.close()
+
+    if issues.limit_reached:
+        print("stopped after reaching the limit of {} errors".format(issues.max_errors), file=out)
+
+    if issues.error_count < 1:
+        with profiler.phase("write") as counts:
+            shenasm.serialise.write_out(assembled, args.output)
+            counts["lines"] = len(assembled)
+        return 0
+    else:
+        print("output inhibited due to errors", file=out)
+        return -1
+
+
+def measure_coverage(args, issues, assembled, ir_nodes, out):
+    """
+    runs the program through the test cases named by --coverage and prints the source annotated with how often
+    each line ran, along with the conditional code that never did
+    :return: the coverage, or None if it couldn't be measured
+    """
+    chip = shenasm.chips.lookup_by_name(args.chip)
+    try:
+        cases = shenasm.superopt.read_cases(args.coverage)
+    except (IOError, ValueError, KeyError, TypeError) as error:
+        issues.error(
+            shenasm.source.SourcePosition(args.coverage, None), "unable to read test cases: {}", error,
+            code=shenasm.codes.COVERAGE_CASES_READ_ERROR
+        )
+        return None
+    try:
+        coverage = shenasm.coverage.Coverage(assembled, chip)
+        coverage.run_cases(cases)
+    except shenasm.sim.SimulationError as error:
+        issues.warning(
+            shenasm.source.SourcePosition("<whole program>", None),
+            "unable to measure coverage, the program can't be simulated: {}", error,
+            code=shenasm.codes.COVERAGE_NOT_SIMULATABLE
+        )
+        return None
+    print(coverage.format_listing(), file=out)
+    if ir_nodes is not None:
+        for region in coverage.never_taken(ir_nodes):
+            print("{}: conditional code that never ran".format(region.first_instruction.source_pos), file=out)
+    return coverage
+
+
+def superoptimise(args, issues, assembled, out):
+    """
+    searches for a shorter (or lower power) program that passes the test cases named by --superopt
+    :return: the program to write out, the assembled one if nothing better was found
+    """
+    chip = shenasm.chips.lookup_by_name(args.chip)
+    try:
+        cases = shenasm.superopt.read_cases(args.superopt)
+    except (IOError, ValueError, KeyError, TypeError) as error:
+        issues.error(
+            shenasm.source.SourcePosition(args.superopt, None), "unable to read test cases: {}", error,
+            code=shenasm.codes.SUPEROPT_CASES_READ_ERROR
+        )
+        return assembled
+    try:
+        result = shenasm.superopt.superoptimise(
+            assembled, chip, cases, args.superopt_objective, args.superopt_time, args.jobs, args.superopt_mnemonics
+        )
+    except shenasm.sim.SimulationError as error:
+        issues.warning(
+            shenasm.source.SourcePosition("<whole program>", None),
+            "unable to superoptimise, the program can't be simulated: {}", error,
+            code=shenasm.codes.SUPEROPT_NOT_SIMULATABLE
+        )
+        return assembled
+    print(result.format_text(), file=out)
+    return result.program if result.program is not None else assembled
+
+
+def verify(args) -> int:
+    """
+    replays each recorded trace against the board described by the input and prints the scores
+    :return: the exit code, non-zero if any trace failed
+    """
+    diagnostics = open_diagnostics(args)
+    out = sys.stdout if diagnostics is None else sys.stderr
+    issues = shenasm.errors.IssueLog(args.max_errors, diagnostics.write if diagnostics is not None else None)
+
+    passed = 0
+    try:
+        spec = shenasm.board.read_board(issues, args.input.name)
+        for trace_path in args.verify if spec is not None else []:
+            result = shenasm.verify.verify(issues, spec, trace_path, optimise=args.optimise)
+            if result is not None:
+                print(result.format_text(), file=out)
+                passed += 1 if result.passed else 0
+    except shenasm.errors.TooManyErrors:
+        pass
+
+    if diagnostics is None:
         for issue in issues.issues:
             print(issue)
+    else:
+        diagnostics.close()
+    if issues.limit_reached:
+        print("stopped after reaching the limit of {} errors".format(issues.max_errors), file=out)
+
+    return 0 if passed == len(args.verify) and issues.error_count < 1 else -1
 
-    if len(issues.errors) < 1:
-        shenasm.serialise.write_out(assembled, args.output)
+
+def batch(args) -> int:
+    """
+    assembles every file named by a manifest and/or glob patterns across a pool of processes
+    :return: the exit code for the whole batch, non-zero if any file failed
+    """
+    diagnostics = open_diagnostics(args)
+    out = sys.stdout if diagnostics is None else sys.stderr
+    # issues from each file are streamed as soon as its job finishes
+    issues = shenasm.errors.IssueLog(args.max_errors, diagnostics.write if diagnostics is not None else None)
+    jobs = []
+    cache_dir = args.cache_dir or shenasm.cache.default_cache_dir()
+    failed = 0
+    finished = 0
+    results = None
+    try:
+        if args.manifest is not None:
+            jobs.extend(shenasm.build.read_manifest(issues, args.manifest, args.chip))
+        for pattern in args.glob:
+            matched = shenasm.build.jobs_from_glob(pattern, args.chip)
+            if len(matched) < 1:
+                issues.warning(
+                    shenasm.source.SourcePosition("<glob {}>".format(pattern), None), "matched no files",
+                    code=shenasm.codes.GLOB_MATCHED_NOTHING
+                )
+            jobs.extend(matched)
+
+        results = shenasm.build.run_jobs(
+            jobs, args.jobs, cache_dir, args.max_errors, args.optimise, args.check_timing, args.time_budget,
+            dict(args.loop_bound)
+        )
+        for result in results:
+            finished += 1
+            if not result.written:
+                failed += 1
+            shenasm.log.verbose("{} ({}) -> {}".format(
+                result.job.source, result.job.chip, result.job.output if result.written else "not written"
+            ))
+            issues.extend(result.issues)
+    except shenasm.errors.TooManyErrors:
+        # the limit applies to the whole batch too, so no more jobs are handed out (or started) once it is reached
+        pass
+    finally:
+        if results is not None:
+            results.close()
+
+    print("assembled {} of {} files: {} warnings and {} errors".format(
+        finished - failed,
+        len(jobs),
+        issues.warning_count,
+        issues.error_count
+    ), file=out)
+    if diagnostics is None:
+        for issue in issues.issues:
+            print(issue)
     else:
-        print("output inhibited due to errors")
-        result = -1
+        diagnostics.close()
+    if issues.limit_reached:
+        print("stopped after reaching the limit of {} errors".format(issues.max_errors), file=out)
 
-    sys.exit(result)
+    return -1 if issues.limit_reached or failed > 0 or issues.error_count > 0 else 0
+
+
+def watch(args, chip, root_path, cache, diagnostics=None) -> int:
+    """
+    re-assembles the input every time it or anything it includes changes, until interrupted
+    :param diagnostics: optional writer that issues are streamed through, each build's issues are closed off
+        separately, so a SARIF log is written per build
+    :return: the exit code of the last assembly
+    """
+    assembler = shenasm.watch.IncrementalAssembler(chip, cache, args.max_errors, args.optimise)
+    listener = diagnostics.write if diagnostics is not None else None
+    out = sys.stdout if diagnostics is None else sys.stderr
+    result = 0
+
+    print("watching {} for changes, press ctrl+c to stop".format(root_path), file=out)
+    try:
+        while True:
+            if assembler.stale():
+                start = time.perf_counter()
+                build = assembler.build(root_path, listener)
+                if build.changed:
+                    result = report(args, build.issues, build.assembled, build.ir_nodes, diagnostics)
+                    print("assembled in {:.1f}ms".format((time.perf_counter() - start) * 1000), file=out)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+    return result
 
 
 class ProgramArgs(argparse.Namespace):
@@ -69,6 +358,46 @@ class ProgramArgs(argparse.Namespace):
         self.chip = ""
         self.output = typing.cast(io.FileIO, None)
         self.dotfile = ""
+        self.watch = False
+        self.interval = 0.0
+        self.cache_dir = ""
+        self.manifest = ""
+        self.glob = []
+        self.jobs = 0
+        self.max_errors = 0
+        self.diagnostics_format = ""
+        self.profile = ""
+        self.power = False
+        self.loop_bound = []
+        self.check_timing = False
+        self.time_budget = 0
+        self.optimise = False
+        self.superopt = ""
+        self.superopt_objective = ""
+        self.superopt_time = 0.0
+        self.superopt_mnemonics = None
+        self.verify = []
+        self.coverage = ""
+
+
+def loop_bound(text) -> (str, int):
+    """parses a LABEL=N loop bound argument"""
+    label, separator, bound = text.partition('=')
+    try:
+        if separator and label and int(bound) >= 0:
+            return label, int(bound)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError("loop bounds look like LABEL=N, not '{}'".format(text))
+
+
+def mnemonic_list(text) -> [str]:
+    """parses a comma separated list of instructions, such as mov,slp,gen"""
+    mnemonics = [mnemonic.strip().lower() for mnemonic in text.split(',') if mnemonic.strip()]
+    unknown = [mnemonic for mnemonic in mnemonics if mnemonic not in shenasm.instructions.INSTRUCTIONS]
+    if not mnemonics or unknown:
+        raise argparse.ArgumentTypeError("not a list of instructions: '{}'".format(text))
+    return mnemonics
 
 
 def get_args() -> ProgramArgs:
@@ -80,7 +409,7 @@ def get_args() -> ProgramArgs:
         description="simple assembler/compiler for making it easier to write SHENZHEN.IO programs"
     )
     parser.add_argument(
-        'input', type=argparse.FileType(),
+        'input', type=argparse.FileType(), nargs='?', default=None,
         help="the input file to ingest"
     )
     parser.add_argument(
@@ -95,10 +424,97 @@ def get_args() -> ProgramArgs:
         '-v', '--verbose', action='store_true',
         help='flag to cause more verbose output during execution'
     )
+    parser.add_argument(
+        '-O', '--optimise', action='store_true',
+        help='shrink the output by removing unreachable code, unneeded tests and jumps to the next line'
+    )
     parser.add_argument(
         '--dotfile', type=str, default=None,
         help='write a graphviz compatible .dot file containing the intermediate representation graph of the input'
     )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='keep running, re-assembling whenever the input or a file it includes changes'
+    )
+    parser.add_argument(
+        '--interval', type=float, default=0.1,
+        help='how often to check for changes in watch mode, in seconds'
+    )
+    parser.add_argument(
+        '--cache-dir', type=str, default=None,
+        help='directory in which to cache parsed files between runs (defaults to ${})'.format(
+            shenasm.cache.CACHE_DIR_ENVIRONMENT_VARIABLE
+        )
+    )
+    parser.add_argument(
+        '--manifest', type=str, default=None,
+        help='assemble every source listed in a JSON manifest instead of a single input'
+    )
+    parser.add_argument(
+        '--glob', type=str, action='append', default=[],
+        help='assemble every source matching a glob pattern for --chip, may be given more than once'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=None,
+        help='number of processes to assemble a batch with, defaults to the number of CPUs'
+    )
+    parser.add_argument(
+        '--max-errors', type=int, default=None,
+        help='stop assembling once this many errors have been found, 0 means no limit'
+    )
+    parser.add_argument(
+        '--diagnostics-format', choices=['text'] + sorted(shenasm.diagnostics.FORMATS), default='text',
+        help='print issues as text after assembly, or stream them as they are found as JSON lines or SARIF'
+    )
+    parser.add_argument(
+        '--profile', nargs='?', const='text', default=None, choices=sorted(shenasm.profiling.FORMATS),
+        help='print the time, peak memory and item counts of each phase of assembly to stderr, as text or json'
+    )
+    parser.add_argument(
+        '--power', action='store_true',
+        help='estimate the power used by each region and the instructions run in each time unit'
+    )
+    parser.add_argument(
+        '--loop-bound', type=loop_bound, action='append', default=[], metavar='LABEL=N',
+        help='the most times the loop containing LABEL goes round without sleeping, for --power and timing checks'
+    )
+    parser.add_argument(
+        '--check-timing', action='store_true',
+        help='warn about loops that never sleep and so use power every time unit'
+    )
+    parser.add_argument(
+        '--time-budget', type=int, default=None, metavar='N',
+        help='as --check-timing, and also warn when more than N instructions can run between sleeps'
+    )
+    parser.add_argument(
+        '--superopt', type=str, default=None, metavar='CASES',
+        help='search for a shorter program that gives the same outputs for the test cases in this JSON file'
+    )
+    parser.add_argument(
+        '--superopt-objective', choices=shenasm.superopt.OBJECTIVES, default=shenasm.superopt.OBJECTIVE_LINES,
+        help='whether --superopt looks for the fewest lines or the least power'
+    )
+    parser.add_argument(
+        '--superopt-time', type=float, default=60.0, metavar='SECONDS',
+        help='how long --superopt searches for, across -j processes'
+    )
+    parser.add_argument(
+        '--superopt-mnemonics', type=mnemonic_list, default=None, metavar='MNEMONICS',
+        help='comma separated instructions --superopt builds candidates from, by default every instruction for '
+             'programs of up to {} lines and only those the program uses for longer ones'.format(
+                 shenasm.superopt.ALL_MNEMONICS_LINES
+             )
+    )
+    parser.add_argument(
+        '--coverage', type=str, default=None, metavar='CASES',
+        help='run the test cases in this JSON file and print the source annotated with how often each line ran, '
+             'with --dotfile the graph is coloured by where power is spent'
+    )
+    parser.add_argument(
+        '--verify', type=str, action='append', default=[], metavar='TRACE',
+        help='treat the input as a board description and replay this CSV or JSON trace against it, '
+             'may be given more than once'
+    )
     return parser.parse_args()
 
 
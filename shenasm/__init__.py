@@ -1,10 +1,24 @@
 
 from . import assemble
+from . import board
+from . import build
+from . import cache
 from . import chips
+from . import codes
+from . import compiled
+from . import coverage
+from . import diagnostics
 from . import errors
 from . import instructions
 from . import log
+from . import optimise
 from . import parse
+from . import profiling
 from . import serialise
+from . import sim
+from . import superopt
 from . import source
+from . import timing
+from . import verify
 from . import intermediate
+from . import watch
@@ -3,11 +3,15 @@ import typing
 
 
 from .instructions import INSTRUCTIONS, VIRTUAL_INSTRUCTIONS, FAKE_OP_CONST, FAKE_OP_ALIAS
-from .intermediate import build_ir_graph, warn_unused_code, output_ir_dotfile, IntermediateNode
+from .intermediate import build_ir_graph, warn_unused_code, output_ir_dotfile, IntermediateGraph
 from .parse import Instruction, Parser
 from .source import LineOfSource, SourcePosition
 from .errors import IssueLog
 from .chips import ChipInfo
+from .profiling import Profiler, NULL_PROFILER
+from .expressions import ConstantTable
+from .optimise import optimise_program
+from . import codes
 from . import log
 
 
@@ -15,6 +19,7 @@ class Symbol(object):
     """
     represents a symbol in a symbol table, such as a constant's name or register alias
     """
+    __slots__ = ('_source_pos', '_name', '_value')
 
     def __init__(self, source_pos: SourcePosition, name: str, value: typing.Union[str, int]):
         self._source_pos = source_pos
@@ -34,25 +39,90 @@ class Symbol(object):
         return self._value
 
 
-def assemble(issues: IssueLog, lines: [LineOfSource], chip: ChipInfo) -> ([Instruction], [IntermediateNode]):
+def assemble(issues: IssueLog, lines: typing.Iterable[LineOfSource], chip: ChipInfo,
+             profiler: Profiler = NULL_PROFILER, optimise: bool = False) -> ([Instruction], IntermediateGraph):
     """
     takes lines of text from a source file, parses them as instructions and
     produces a list of output instructions in the format SHENZHEN I/O expects
     :param issues: collection of errors generated by the assembly process so far
-    :param lines: a list of lines for parsing as instructions
+    :param lines: the lines for parsing as instructions, these may be a generator (see shenasm.source.iter_lines)
+                  in which case lines are read and parsed one at a time
     :param chip: information about the target microchip, for providing relevant warnings
+    :param profiler: optionally measures each phase of assembly, when lines is a generator the time
+                     spent reading them is part of the parse phase
+    :param optimise: whether to shrink the output with shenasm.optimise.optimise_program
     :return: a list of instructions ready for serialising and presenting to SHENZHEN I/O
     """
 
     # parse inputs
-    parser = Parser(issues)
-    instructions = parser.parse_lines(lines)
+    with profiler.phase("parse") as counts:
+        parser = Parser(issues)
+        instructions = parser.parse_lines(lines)
+        counts["instructions"] = len(instructions)
+
+    return assemble_instructions(issues, instructions, chip, profiler, optimise)
+
+
+def assemble_instructions(issues: IssueLog, instructions: [Instruction], chip: ChipInfo,
+                          profiler: Profiler = NULL_PROFILER,
+                          optimise: bool = False) -> ([Instruction], IntermediateGraph):
+    """
+    the part of assemble() that happens after parsing, for callers that already have parsed instructions
+    :param issues: collection of errors generated by the assembly process so far
+    :param instructions: the parsed instructions of the whole program
+    :param chip: information about the target microchip, for providing relevant warnings
+    :param profiler: optionally measures each phase of assembly
+    :param optimise: whether to shrink the output with shenasm.optimise.optimise_program, the intermediate graph
+                     returned is then that of the optimised program
+    :return: a list of instructions ready for serialising and presenting to SHENZHEN I/O
+    """
 
     # extract aliases/constants out into a dictionary
-    symbol_table = symbol_pass(issues, instructions, chip)
+    with profiler.phase("symbols") as counts:
+        symbol_table = symbol_pass(issues, instructions, chip)
+        counts["symbols"] = len(symbol_table)
+
+    with profiler.phase("ir_graph") as counts:
+        ir_nodes = build_ir_graph(
+            issues, instructions, {name: symbol.value for name, symbol in symbol_table.items()}
+        )
+        counts["regions"] = len(ir_nodes)
+
+    with profiler.phase("unused_code") as counts:
+        warnings_before = issues.warning_count
+        warn_unused_code(issues, ir_nodes)
+        counts["warnings"] = issues.warning_count - warnings_before
+
+    with profiler.phase("assemble") as counts:
+        output = _assemble_output(issues, instructions, chip, symbol_table)
+        counts["instructions"] = len(output)
+
+    # there's no point optimising a program that has errors in it
+    if optimise and issues.error_count == 0:
+        with profiler.phase("optimise") as counts:
+            output = optimise_program(output, chip)
+            # the graph is rebuilt so later analyses see the program that will run, its issues were found already
+            ir_nodes = build_ir_graph(IssueLog(), output)
+            counts["instructions"] = len(output)
+
+    # now we know how many lines of assembly we're generating, will it fit on the chip?
+    if len(output) > chip.memory:
+        issues.warning(
+            SourcePosition("<whole program>", None),
+            "program size exceeds chip memory ({} > {})",
+            len(output),
+            chip.memory,
+            code=codes.PROGRAM_TOO_LONG
+        )
+
+    return output, ir_nodes
+
 
-    ir_nodes = build_ir_graph(issues, instructions)
-    warn_unused_code(issues, ir_nodes)
+def _assemble_output(issues: IssueLog, instructions: [Instruction], chip: ChipInfo,
+                     symbol_table: typing.Dict[str, Symbol]) -> [Instruction]:
+    """
+    assembles every instruction in turn once the symbols are known, the last phase of assemble_instructions()
+    """
 
     # this will track the resulting instruction list
     output = []
@@ -115,18 +185,8 @@ def assemble(issues: IssueLog, lines: [LineOfSource], chip: ChipInfo) -> ([Instr
         output.append(assembled)
 
     # TODO: detect unused aliases/constants?
-    # TODO: optimisation pass?
-
-    # now we know how many lines of assembly we're generating, will it fit on the chip?
-    if len(output) > chip.memory:
-        issues.warning(
-            SourcePosition("<whole program>", None),
-            "program size exceeds chip memory ({} > {})",
-            len(output),
-            chip.memory
-        )
 
-    return output, ir_nodes
+    return output
 
 
 def assemble_instruction(issues: IssueLog, symbols: typing.Dict[str, Symbol], inst: [Instruction]):
@@ -147,7 +207,8 @@ def assemble_instruction(issues: IssueLog, symbols: typing.Dict[str, Symbol], in
         issues.error(
             inst.source_pos,
             "unknown instruction mneumonic: {}",
-            inst.mnemonic
+            inst.mnemonic,
+            code=codes.UNKNOWN_INSTRUCTION
         )
         return None
 
@@ -158,7 +219,8 @@ def assemble_instruction(issues: IssueLog, symbols: typing.Dict[str, Symbol], in
             issues.error(
                 inst.source_pos,
                 "too few arguments to {} instruction",
-                inst.mnemonic
+                inst.mnemonic,
+                code=codes.TOO_FEW_ARGUMENTS
             )
             return None
 
@@ -166,7 +228,8 @@ def assemble_instruction(issues: IssueLog, symbols: typing.Dict[str, Symbol], in
             issues.error(
                 inst.source_pos,
                 "too many arguments to {} instruction",
-                inst.mnemonic
+                inst.mnemonic,
+                code=codes.TOO_MANY_ARGUMENTS
             )
             return None
 
@@ -187,13 +250,16 @@ def assemble_instruction(issues: IssueLog, symbols: typing.Dict[str, Symbol], in
 
 def symbol_pass(issues: IssueLog, instructions: [Instruction], chip: ChipInfo) -> typing.Dict[str, Symbol]:
     """
-    scan through the instructions looking for aliases and constant definitions, producing a table of them
+    scan through the instructions looking for aliases and constant definitions, producing a table of them,
+    constants are evaluated once every definition has been seen, so they may refer to ones defined later
     :param issues: collection of issues generated during assembler execution
     :param instructions: the instructions to scan
     :param chip: information about the target chip, in order to diagnose bad register aliases
     :return: a dictionary of symbols
     """
     result = {}
+    # the const instructions, evaluated after the scan
+    constants = {}
 
     # scan each instruction
     for inst in instructions:
@@ -206,19 +272,21 @@ def symbol_pass(issues: IssueLog, instructions: [Instruction], chip: ChipInfo) -
             issues.error(
                 inst.source_pos,
                 "expected two arguments to {}: name and value",
-                inst.mnemonic
+                inst.mnemonic,
+                code=codes.SYMBOL_WITHOUT_VALUE
             )
             continue
 
         name = inst.args[0]
         value = inst.args[1]
 
-        if name in result:
+        if name in result or name in constants:
             issues.error(
                 inst.source_pos,
                 "redefinition of symbol '{}', previously declared here: {}",
                 name,
-                result[name].source_pos
+                (result[name] if name in result else constants[name]).source_pos,
+                code=codes.SYMBOL_REDEFINED
             )
             continue
 
@@ -228,7 +296,8 @@ def symbol_pass(issues: IssueLog, instructions: [Instruction], chip: ChipInfo) -
                 inst.source_pos,
                 "cannot use {} as an {} name, reserved as a register name on this chip",
                 name,
-                inst.mnemonic
+                inst.mnemonic,
+                code=codes.SYMBOL_IS_REGISTER
             )
             continue
 
@@ -238,33 +307,17 @@ def symbol_pass(issues: IssueLog, instructions: [Instruction], chip: ChipInfo) -
                 inst.source_pos,
                 "{} is an invalid alias as '{}' is not a valid register name on this chip",
                 name,
-                value
+                value,
+                code=codes.ALIAS_NOT_REGISTER
             )
             continue
 
-        # ensure that constants are valid
+        # constants may be expressions of other constants, which can only be evaluated once they are all known
         if inst.mnemonic == FAKE_OP_CONST:
-            # we currently only support integer literal constants
-
-            # ensure it parses as an integer
-            try:
-                as_integer = int(value)
-            except ValueError:
-                issues.error(
-                    inst.source_pos,
-                    "constants currently only support integer literals"
-                )
-                continue
-
-            # ensure it's within the range of integers that SHENZHEN I/O requires
-            if not (-999 <= as_integer <= 999):
-                issues.error(
-                    inst.source_pos,
-                    "integer constants must be between -999 and 999 inclusive"
-                )
-                continue
+            constants[name] = inst
+            continue
 
-        # record the new alias/const
+        # record the new alias
         log.verbose("symbol {} is {} of {}".format(
             name, inst.mnemonic, value
         ))
@@ -273,4 +326,18 @@ def symbol_pass(issues: IssueLog, instructions: [Instruction], chip: ChipInfo) -
             name=name,
             value=value
         )
+
+    table = ConstantTable(issues, constants)
+    for name, inst in constants.items():
+        value = table.value(name)
+        if value is None:
+            continue
+        log.verbose("symbol {} is {} of {}".format(
+            name, inst.mnemonic, value
+        ))
+        result[name] = Symbol(
+            source_pos=inst.source_pos,
+            name=name,
+            value=str(value)
+        )
     return result
@@ -0,0 +1,330 @@
+"""
+runs one decoded Program over many independent sets of inputs at once using NumPy
+
+this module needs numpy, which the rest of shenasm doesn't, so it isn't imported by the package itself:
+
+    import shenasm.batch
+"""
+
+import typing
+
+import numpy as np
+
+
+from .sim import Program, SimulationError, DEFAULT_INSTRUCTION_LIMIT, VALUE_MIN, VALUE_MAX, SIMPLE_MIN, \
+    SIMPLE_MAX, OPERAND_INT, OPERAND_ACC, OPERAND_DAT, OPERAND_NULL, OPERAND_SIMPLE, OPERAND_XBUS, OP_NOP, \
+    OP_MOV, OP_JMP, OP_SLP, OP_SLX, OP_ADD, OP_SUB, OP_MUL, OP_NOT, OP_DGT, OP_DST, OP_TEQ, OP_TGT, OP_TLT, \
+    OP_TCP, OP_GEN_ON, OP_GEN_OFF, COND_NONE, COND_ONCE, FLAG_NONE, FLAG_TRUE, FLAG_FALSE
+from .chips import REG_TYPE_SIMPLE
+
+
+# registers are held as int32 so that products of two in-range values can't overflow before clamping
+VALUE_DTYPE = np.int32
+
+
+class BatchChip(object):
+    """
+    simulates `lanes` copies of the same program side by side, each with its own registers, enable flags,
+    program counter and inputs, lanes that branch differently simply execute different operations
+    in the same step
+    """
+
+    def __init__(self, program: Program, lanes: int,
+                 simple_inputs: typing.Dict[str, np.ndarray] = None,
+                 xbus_inputs: typing.Dict[str, np.ndarray] = None,
+                 instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT):
+        """
+        :param program: the decoded program every lane runs
+        :param lanes: how many independent copies to simulate
+        :param simple_inputs: per simple pin, either a (lanes,) array of held values or a (time, lanes)
+                              array giving the value for each time unit
+        :param xbus_inputs: per XBus pin, a (lanes, count) array of values each lane reads in order,
+                            a lane blocks once it has read all of its values
+        :param instruction_limit: how many operations (including skipped ones) a lane may step
+                                  through in one time unit before it is assumed to never sleep
+        """
+        self.program = program
+        self.lanes = lanes
+        self.instruction_limit = instruction_limit
+
+        self.acc = np.zeros(lanes, dtype=VALUE_DTYPE)
+        self.dat = np.zeros(lanes, dtype=VALUE_DTYPE)
+        self.pc = np.zeros(lanes, dtype=np.int32)
+        self.flag = np.full(lanes, FLAG_NONE, dtype=np.int8)
+        self.wake_time = np.zeros(lanes, dtype=np.int64)
+        self.power = np.zeros(lanes, dtype=np.int64)
+        self.once_done = np.zeros((lanes, len(program)), dtype=bool)
+
+        self.simple_inputs = {}
+        for pin, values in (simple_inputs.items() if simple_inputs is not None else []):
+            values = np.asarray(values, dtype=VALUE_DTYPE)
+            if values.shape[-1] != lanes or values.ndim not in (1, 2):
+                raise SimulationError("simple input for {} must have shape (lanes,) or (time, lanes)".format(pin))
+            self.simple_inputs[pin] = values
+
+        self.xbus_inputs = {}
+        self.xbus_cursor = {}
+        for pin, values in (xbus_inputs.items() if xbus_inputs is not None else []):
+            values = np.asarray(values, dtype=VALUE_DTYPE)
+            if values.ndim != 2 or values.shape[0] != lanes:
+                raise SimulationError("xbus input for {} must have shape (lanes, count)".format(pin))
+            self.xbus_inputs[pin] = values
+            self.xbus_cursor[pin] = np.zeros(lanes, dtype=np.int64)
+
+        # the value currently driven onto each simple pin, and its history one row per time unit
+        self.simple_outputs = {
+            name: np.zeros(lanes, dtype=VALUE_DTYPE)
+            for name, info in program.chip.registers.items()
+            if info.type == REG_TYPE_SIMPLE
+        }
+        self.simple_history = {name: [] for name in self.simple_outputs}
+
+        # XBus writes never block in a batch, they are recorded as chunks of (time, lanes, values)
+        self._xbus_written = {}
+
+        self._now = 0
+        self._running = None
+
+    def run_for(self, time_units: int):
+        """
+        simulates every lane for a number of time units
+        :param time_units: how many time units to simulate
+        """
+        for _ in range(time_units):
+            self.run_time_unit()
+
+    def run_time_unit(self):
+        """
+        executes every awake lane until it sleeps or blocks, then records the simple pin outputs
+        """
+        now = self._now
+        self._running = self.wake_time <= now
+        steps = np.zeros(self.lanes, dtype=np.int64)
+
+        while True:
+            running = np.flatnonzero(self._running)
+            if len(running) < 1:
+                break
+
+            steps[running] += 1
+            if steps[running].max() > self.instruction_limit:
+                raise SimulationError("a lane stepped through {} operations in time unit {} without sleeping".format(
+                    self.instruction_limit, now
+                ))
+
+            pcs = self.pc[running]
+            first = pcs[0]
+            if (pcs == first).all():
+                self._execute(int(first), running)
+            else:
+                for pc in np.unique(pcs):
+                    self._execute(int(pc), running[pcs == pc])
+
+        for name, value in self.simple_outputs.items():
+            self.simple_history[name].append(value.copy())
+        self._now = now + 1
+
+    def history(self, pin: str) -> np.ndarray:
+        """
+        :return: a (time, lanes) array of the value each lane drove onto a simple pin at the end of each time unit
+        """
+        rows = self.simple_history[pin]
+        if len(rows) < 1:
+            return np.zeros((0, self.lanes), dtype=VALUE_DTYPE)
+        return np.stack(rows)
+
+    def xbus_written(self, pin: str) -> (np.ndarray, np.ndarray, np.ndarray):
+        """
+        :return: arrays of (time, lane, value) for every value written to an XBus pin, in the order written
+        """
+        chunks = self._xbus_written.get(pin, [])
+        if len(chunks) < 1:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=VALUE_DTYPE)
+        times = np.concatenate([np.full(len(lanes), time, dtype=np.int64) for time, lanes, _ in chunks])
+        lanes = np.concatenate([lanes for _, lanes, _ in chunks])
+        values = np.concatenate([values for _, _, values in chunks])
+        return times, lanes, values
+
+    def _execute(self, pc: int, idx: np.ndarray):
+        """
+        executes the operation at pc for the given lanes, all of which are running and sat at pc
+        """
+        op, cond, ak, av, bk, bv, ck, cv = self.program.ops[pc]
+        next_pc = pc + 1 if pc + 1 < len(self.program) else 0
+
+        # lanes whose condition doesn't hold just move on to the next operation, past both halves of a gen
+        if cond != COND_NONE:
+            if cond == COND_ONCE:
+                enabled = ~self.once_done[idx, pc]
+            else:
+                enabled = self.flag[idx] == cond
+            skip_pc = next_pc
+            if op == OP_GEN_ON:
+                skip_pc = pc + 2 if pc + 2 < len(self.program) else 0
+            self.pc[idx[~enabled]] = skip_pc
+            idx = idx[enabled]
+            if len(idx) < 1:
+                return
+
+        # lanes that would read an empty XBus input block until the next time unit, checking before
+        # consuming anything means an instruction with two XBus operands never loses a value
+        xbus_pins = []
+        if op == OP_SLX:
+            xbus_pins.append(av)
+        else:
+            if ak == OPERAND_XBUS:
+                xbus_pins.append(av)
+            if bk == OPERAND_XBUS and op >= OP_DST:
+                xbus_pins.append(bv)
+        if xbus_pins:
+            ready = np.ones(len(idx), dtype=bool)
+            for pin in xbus_pins:
+                ready &= self._xbus_available(pin, idx) > xbus_pins.count(pin) - 1
+            self._running[idx[~ready]] = False
+            idx = idx[ready]
+            if len(idx) < 1:
+                return
+
+        if cond == COND_ONCE:
+            self.once_done[idx, pc] = True
+
+        sleeping = None
+
+        if op == OP_MOV:
+            a = self._fetch(ak, av, idx)
+            if bk == OPERAND_ACC:
+                self.acc[idx] = a
+            elif bk == OPERAND_DAT:
+                self.dat[idx] = a
+            elif bk == OPERAND_SIMPLE:
+                self.simple_outputs[bv][idx] = np.clip(a, SIMPLE_MIN, SIMPLE_MAX)
+            elif bk == OPERAND_XBUS:
+                self._xbus_written.setdefault(bv, []).append(
+                    (self._now, idx.copy(), np.broadcast_to(a, idx.shape).astype(VALUE_DTYPE))
+                )
+        elif op == OP_ADD:
+            self.acc[idx] = np.clip(self.acc[idx] + self._fetch(ak, av, idx), VALUE_MIN, VALUE_MAX)
+        elif op == OP_SUB:
+            self.acc[idx] = np.clip(self.acc[idx] - self._fetch(ak, av, idx), VALUE_MIN, VALUE_MAX)
+        elif op == OP_MUL:
+            self.acc[idx] = np.clip(self.acc[idx] * self._fetch(ak, av, idx), VALUE_MIN, VALUE_MAX)
+        elif op == OP_NOT:
+            self.acc[idx] = np.where(self.acc[idx] == 0, SIMPLE_MAX, 0)
+        elif op == OP_DGT:
+            self.acc[idx] = digit_of(self.acc[idx], self._fetch(ak, av, idx))
+        elif op == OP_DST:
+            a = self._fetch(ak, av, idx)
+            b = self._fetch(bk, bv, idx)
+            self.acc[idx] = set_digit(self.acc[idx], a, b)
+        elif op in (OP_TEQ, OP_TGT, OP_TLT, OP_TCP):
+            a = self._fetch(ak, av, idx)
+            b = self._fetch(bk, bv, idx)
+            if op == OP_TEQ:
+                flag = np.where(a == b, FLAG_TRUE, FLAG_FALSE)
+            elif op == OP_TGT:
+                flag = np.where(a > b, FLAG_TRUE, FLAG_FALSE)
+            elif op == OP_TLT:
+                flag = np.where(a < b, FLAG_TRUE, FLAG_FALSE)
+            else:
+                flag = np.where(a > b, FLAG_TRUE, np.where(a < b, FLAG_FALSE, FLAG_NONE))
+            self.flag[idx] = flag
+        elif op == OP_JMP:
+            next_pc = av
+        elif op == OP_SLP:
+            duration = np.maximum(self._fetch(ak, av, idx), 1)
+            self.wake_time[idx] = self._now + duration
+            sleeping = idx
+        elif op in (OP_GEN_ON, OP_GEN_OFF):
+            self.simple_outputs[av][idx] = SIMPLE_MAX if op == OP_GEN_ON else SIMPLE_MIN
+            duration = np.broadcast_to(self._fetch(bk, bv, idx), idx.shape)
+            positive = duration > 0
+            self.wake_time[idx[positive]] = self._now + duration[positive]
+            sleeping = idx[positive]
+        elif op not in (OP_NOP, OP_SLX):
+            raise SimulationError("batch simulation cannot execute operation {}".format(op))
+
+        # both halves of gen together count as a single instruction for power
+        if op != OP_GEN_OFF:
+            self.power[idx] += 1
+        self.pc[idx] = next_pc
+        if sleeping is not None:
+            self._running[sleeping] = False
+
+    def _fetch(self, kind, value, idx):
+        """
+        reads an operand for the given lanes, returning either a scalar or an array aligned with idx
+        """
+        if kind == OPERAND_INT:
+            return value
+        if kind == OPERAND_ACC:
+            return self.acc[idx]
+        if kind == OPERAND_DAT:
+            return self.dat[idx]
+        if kind == OPERAND_NULL:
+            return 0
+        if kind == OPERAND_SIMPLE:
+            values = self.simple_inputs.get(value, None)
+            if values is None:
+                return 0
+            if values.ndim == 2:
+                row = self._now if self._now < values.shape[0] else values.shape[0] - 1
+                return values[row, idx]
+            return values[idx]
+        # XBus, availability was checked before executing
+        cursor = self.xbus_cursor[value]
+        result = self.xbus_inputs[value][idx, cursor[idx]]
+        cursor[idx] += 1
+        return result
+
+    def _xbus_available(self, pin, idx):
+        values = self.xbus_inputs.get(pin, None)
+        if values is None:
+            return np.zeros(len(idx), dtype=np.int64)
+        return values.shape[1] - self.xbus_cursor[pin][idx]
+
+
+def digit_of(value, index):
+    """vectorised equivalent of shenasm.sim.digit_of"""
+    index = np.asarray(index)
+    valid = (index >= 0) & (index <= 2)
+    scale = 10 ** np.clip(index, 0, 2)
+    digit = (np.abs(value) // scale) % 10
+    return np.where(valid, np.where(value < 0, -digit, digit), 0)
+
+
+def set_digit(value, index, digit):
+    """vectorised equivalent of shenasm.sim.set_digit"""
+    index = np.asarray(index)
+    valid = (index >= 0) & (index <= 2)
+    scale = 10 ** np.clip(index, 0, 2)
+    magnitude = np.abs(value)
+    magnitude = magnitude + ((np.abs(digit) % 10) - (magnitude // scale) % 10) * scale
+    negative = (digit < 0) | ((digit == 0) & (value < 0))
+    return np.where(valid, np.where(negative, -magnitude, magnitude), value)
+
+
+def sweep(program: Program, pin: str, values: typing.Iterable[int], time_units: int,
+          instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT) -> BatchChip:
+    """
+    runs a program once per value with that value held on a simple pin, or repeatedly offered on an XBus pin
+    :param program: the decoded program to test
+    :param pin: the input pin to drive
+    :param values: one value per lane, for example range(-999, 1000)
+    :param time_units: how many time units to simulate
+    :param instruction_limit: see BatchChip
+    :return: the BatchChip after simulation, for inspecting outputs and power
+    """
+    values = np.asarray(list(values), dtype=VALUE_DTYPE)
+    register = program.chip.registers.get(pin, None)
+    if register is None:
+        raise SimulationError("'{}' is not a pin on this chip".format(pin))
+
+    if register.type == REG_TYPE_SIMPLE:
+        batch = BatchChip(program, len(values), simple_inputs={pin: values}, instruction_limit=instruction_limit)
+    else:
+        # offer each lane its value once for every time unit simulated
+        stream = np.repeat(values[:, np.newaxis], max(time_units, 1), axis=1)
+        batch = BatchChip(program, len(values), xbus_inputs={pin: stream}, instruction_limit=instruction_limit)
+    batch.run_for(time_units)
+    return batch
@@ -0,0 +1,504 @@
+from collections import OrderedDict, deque
+import heapq
+import json
+import os
+import typing
+
+
+from .errors import IssueLog
+from .source import SourcePosition, read_lines
+from .chips import ChipInfo, REG_TYPE_SIMPLE, REG_TYPE_XBUS, lookup_by_name
+from .sim import Chip, Program, SimulationError, decode_program, STATUS_SLEEP, STATUS_BLOCKED_WRITE, \
+    DEFAULT_INSTRUCTION_LIMIT
+from .compiled import CompiledChip
+from . import assemble
+from . import codes
+from . import log
+
+
+NET_SIMPLE = 'simple'
+NET_XBUS = 'xbus'
+
+
+class ChipSpec(object):
+    """describes one chip on a board: its name, chip type and the source file it runs"""
+
+    def __init__(self, name, chip_type, source):
+        self._name = name
+        self._chip_type = chip_type
+        self._source = source
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def chip_type(self):
+        return self._chip_type
+
+    @property
+    def source(self):
+        return self._source
+
+
+class BoardSpec(object):
+    """
+    a board description: the chips, the wires joining their pins, and which wires are
+    the board's external inputs and outputs
+    """
+
+    def __init__(self, path, chips: [ChipSpec], wires: [[str]], inputs: [str], outputs: [str]):
+        self._path = path
+        self._chips = chips
+        self._wires = wires
+        self._inputs = inputs
+        self._outputs = outputs
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def chips(self):
+        return self._chips
+
+    @property
+    def wires(self):
+        """each wire is a list of terminals, either "chip.pin" or the name of an external input/output"""
+        return self._wires
+
+    @property
+    def inputs(self):
+        return self._inputs
+
+    @property
+    def outputs(self):
+        return self._outputs
+
+
+def read_board(issues: IssueLog, path: str) -> typing.Optional[BoardSpec]:
+    """
+    reads a JSON board description of the form:
+
+        {
+          "chips": [{"name": "ctrl", "type": "MC6000", "source": "ctrl.asm"}, ...],
+          "wires": [["ctrl.x0", "ram.x1"], ["ctrl.p1", "speaker"], ...],
+          "inputs": ["button"],
+          "outputs": ["speaker"]
+        }
+
+    source paths are relative to the board file
+    :param issues: collection of issues generated during assembler execution
+    :param path: path to the board description
+    :return: the board description, or None if it could not be read
+    """
+    pos = SourcePosition(path, None)
+    try:
+        with open(path) as handle:
+            document = json.load(handle)
+    except (IOError, ValueError) as error:
+        issues.error(pos, "unable to read board description: {}", error, code=codes.BOARD_READ_ERROR)
+        return None
+
+    if not isinstance(document, dict) or not isinstance(document.get("chips", None), list):
+        issues.error(pos, "board description must be an object with a list of chips", code=codes.BOARD_NOT_OBJECT)
+        return None
+
+    folder = os.path.dirname(os.path.abspath(path))
+    chips = []
+    for entry in document["chips"]:
+        if not isinstance(entry, dict) or not all(key in entry for key in ("name", "type", "source")):
+            issues.error(pos, "each chip needs a name, type and source", code=codes.BOARD_CHIP_INCOMPLETE)
+            continue
+        source = entry["source"]
+        if not os.path.isabs(source):
+            source = os.path.join(folder, source)
+        chips.append(ChipSpec(entry["name"], entry["type"], source))
+
+    return BoardSpec(
+        path,
+        chips,
+        [list(wire) for wire in document.get("wires", [])],
+        list(document.get("inputs", [])),
+        list(document.get("outputs", [])),
+    )
+
+
+def assemble_board(issues: IssueLog, spec: BoardSpec, optimise: bool = False) -> \
+        typing.Optional[typing.Dict[str, typing.Tuple[typing.List, ChipInfo]]]:
+    """
+    reads and assembles every chip's source
+    :param issues: collection of issues generated during assembler execution
+    :param spec: the board description
+    :param optimise: whether to apply the -O passes to each chip
+    :return: the assembled instructions and chip information for each chip, by name, or None if anything failed
+    """
+    pos = SourcePosition(spec.path, None)
+    errors_before = issues.error_count
+
+    programs = OrderedDict()
+    for chip_spec in spec.chips:
+        chip_info = lookup_by_name(chip_spec.chip_type)
+        if chip_info is None:
+            issues.error(
+                pos, "chip {} has unknown type '{}'", chip_spec.name, chip_spec.chip_type, code=codes.BOARD_UNKNOWN_CHIP
+            )
+            continue
+        if chip_spec.name in programs:
+            issues.error(pos, "chip name '{}' is used more than once", chip_spec.name, code=codes.BOARD_DUPLICATE_CHIP)
+            continue
+
+        root_path = os.path.abspath(chip_spec.source)
+        try:
+            handle = open(root_path)
+        except IOError as io_error:
+            issues.error(
+                pos, "error opening source for chip {}: {}", chip_spec.name, io_error,
+                code=codes.BOARD_SOURCE_OPEN_ERROR
+            )
+            continue
+        with handle:
+            included_files = {root_path: SourcePosition("<board {} chip {}>".format(spec.path, chip_spec.name), None)}
+            lines = read_lines(issues, handle, root_path, included_files)
+
+        assembled, _ = assemble.assemble(issues, lines, chip_info, optimise=optimise)
+        log.verbose("assembled chip {} ({}) to {} lines".format(chip_spec.name, chip_spec.chip_type, len(assembled)))
+        programs[chip_spec.name] = (assembled, chip_info)
+
+    if issues.error_count > errors_before:
+        return None
+    return programs
+
+
+def build_board(issues: IssueLog, spec: BoardSpec, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT,
+                compiled: bool = False, programs=None) -> typing.Optional['Board']:
+    """
+    reads and assembles every chip's source and wires the results together
+    :param issues: collection of issues generated during assembler execution
+    :param spec: the board description
+    :param instruction_limit: passed on to each simulated chip
+    :param compiled: simulate each chip with shenasm.compiled rather than the interpreter
+    :param programs: the result of assemble_board() if the chips have already been assembled
+    :return: the board ready to simulate, or None if anything failed to assemble
+    """
+    pos = SourcePosition(spec.path, None)
+    errors_before = issues.error_count
+
+    if programs is None:
+        programs = assemble_board(issues, spec)
+        if programs is None:
+            return None
+
+    decoded = OrderedDict()
+    for name, (assembled, chip_info) in programs.items():
+        try:
+            decoded[name] = decode_program(assembled, chip_info)
+        except SimulationError as error:
+            issues.error(pos, "chip {} cannot be simulated: {}", name, error, code=codes.BOARD_CHIP_NOT_SIMULATABLE)
+
+    if issues.error_count > errors_before:
+        return None
+
+    try:
+        return Board(decoded, spec.wires, spec.inputs, spec.outputs, instruction_limit, compiled)
+    except SimulationError as error:
+        issues.error(pos, "{}", error, code=codes.BOARD_INVALID_WIRING)
+        return None
+
+
+class SimpleNet(object):
+    """a simple I/O wire, every terminal reads the largest value driven by any other terminal"""
+
+    def __init__(self, name):
+        self.name = name
+        self.kind = NET_SIMPLE
+        self.driven = {}
+        # changes to the wire's value, as a list of (time, value), recorded for external outputs
+        self.trace = []
+        self.traced = False
+
+    def read(self, reader):
+        value = 0
+        for owner, driven in self.driven.items():
+            if owner is not reader and driven > value:
+                value = driven
+        return value
+
+    def write(self, writer, value, now):
+        self.driven[writer] = value
+        if self.traced:
+            value = max(self.driven.values())
+            if self.trace and self.trace[-1][0] == now:
+                self.trace[-1] = (now, value)
+            elif not self.trace or self.trace[-1][1] != value:
+                self.trace.append((now, value))
+
+
+class XBusNet(object):
+    """
+    an XBus wire, writes are offered to the wire and the writer stays blocked until a reader on another
+    terminal takes the value, readers block until a value is offered
+    """
+
+    def __init__(self, name, board):
+        self.name = name
+        self.kind = NET_XBUS
+        self._board = board
+        # values offered by blocked writers, in the order they were offered
+        self.offers = OrderedDict()
+        # writers whose offer has been taken, their next attempt at the write completes
+        self.taken = set()
+        # chips waiting for something to happen on this wire
+        self.waiting_readers = []
+        self.waiting_writers = []
+        # external inputs feed the wire from a queue, external outputs take everything offered
+        self.source = None
+        self.sink = None
+
+    def ready(self, reader):
+        if self.source:
+            return True
+        for owner in self.offers:
+            if owner is not reader:
+                return True
+        return False
+
+    def read(self, reader):
+        if self.source:
+            return self.source.popleft()
+        for owner in self.offers:
+            if owner is not reader:
+                value = self.offers.pop(owner)
+                self.taken.add(owner)
+                self._wake(self.waiting_writers)
+                return value
+        return None
+
+    def write(self, writer, value, now):
+        if writer in self.taken:
+            self.taken.discard(writer)
+            return True
+        if self.sink is not None:
+            self.sink.append((now, value))
+            return True
+        if writer not in self.offers:
+            self.offers[writer] = value
+            self._wake(self.waiting_readers)
+        return False
+
+    def feed(self, values):
+        if self.source is None:
+            self.source = deque()
+        self.source.extend(values)
+        self._wake(self.waiting_readers)
+
+    def _wake(self, waiting):
+        for slot in waiting:
+            self._board.wake(slot)
+        del waiting[:]
+
+
+class ChipPort(object):
+    """connects one simulated chip's pins to the nets of a board, in the form shenasm.sim.Chip expects"""
+
+    def __init__(self, board, nets):
+        self._board = board
+        self.nets = nets
+
+    def read_simple(self, pin):
+        net = self.nets.get(pin, None)
+        return net.read(self) if net is not None else 0
+
+    def write_simple(self, pin, value):
+        net = self.nets.get(pin, None)
+        if net is not None:
+            net.write(self, value, self._board.now)
+
+    def xbus_ready(self, pin):
+        net = self.nets.get(pin, None)
+        return net is not None and net.ready(self)
+
+    def xbus_read(self, pin):
+        net = self.nets.get(pin, None)
+        return net.read(self) if net is not None else None
+
+    def xbus_write(self, pin, value):
+        net = self.nets.get(pin, None)
+        # writing to an unconnected XBus pin blocks forever, as nothing will ever read it
+        return net.write(self, value, self._board.now) if net is not None else False
+
+
+class BoardSlot(object):
+    """scheduler bookkeeping for one chip on a board"""
+
+    def __init__(self, name, chip, port):
+        self.name = name
+        self.chip = chip
+        self.port = port
+        self.queued = False
+
+
+class Board(object):
+    """
+    simulates several chips wired together, only running chips when they are due to wake from slp
+    or when something changes on the XBus wire they are blocked on
+
+    within a time unit chips run in the order they were declared, and re-run whenever XBus
+    traffic unblocks them, values written to simple I/O are visible immediately
+    """
+
+    def __init__(self, programs: typing.Dict[str, Program], wires: [[str]], inputs: [str] = (), outputs: [str] = (),
+                 instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT, compiled: bool = False):
+        self.now = 0
+        self.slots = OrderedDict()
+        self._queue = deque()
+        self._sleepers = []
+        self._sequence = 0
+
+        self.terminals = {}
+        pin_nets = {name: {} for name in programs}
+        for index, wire in enumerate(wires):
+            net = self._make_net(index, wire, programs, set(inputs) | set(outputs))
+            for terminal in wire:
+                if terminal in self.terminals:
+                    raise SimulationError("terminal '{}' is connected to more than one wire".format(terminal))
+                if "." in terminal:
+                    chip_name, pin = terminal.split(".", 1)
+                    if pin in pin_nets[chip_name]:
+                        raise SimulationError("pin {} is connected to more than one wire".format(terminal))
+                    pin_nets[chip_name][pin] = net
+                else:
+                    self.terminals[terminal] = net
+                    if terminal in outputs:
+                        if net.kind == NET_SIMPLE:
+                            net.traced = True
+                        else:
+                            net.sink = []
+
+        for name in list(inputs) + list(outputs):
+            if name not in self.terminals:
+                raise SimulationError("external terminal '{}' isn't connected to anything".format(name))
+
+        for name, program in programs.items():
+            port = ChipPort(self, pin_nets[name])
+            chip_class = CompiledChip if compiled else Chip
+            slot = BoardSlot(name, chip_class(program, port, instruction_limit), port)
+            self.slots[name] = slot
+            self.wake(slot)
+
+    def _make_net(self, index, wire, programs, external):
+        kinds = set()
+        for terminal in wire:
+            if "." in terminal:
+                chip_name, pin = terminal.split(".", 1)
+                program = programs.get(chip_name, None)
+                if program is None:
+                    raise SimulationError("wire {} refers to unknown chip '{}'".format(index, chip_name))
+                register = program.chip.registers.get(pin, None)
+                if register is None or register.type not in (REG_TYPE_SIMPLE, REG_TYPE_XBUS):
+                    raise SimulationError("wire {} refers to '{}' which isn't a pin".format(index, terminal))
+                kinds.add(NET_SIMPLE if register.type == REG_TYPE_SIMPLE else NET_XBUS)
+            elif terminal not in external:
+                raise SimulationError("wire {} refers to '{}' which is neither a chip pin nor an input/output".format(
+                    index, terminal
+                ))
+
+        if len(kinds) > 1:
+            raise SimulationError("wire {} connects simple I/O pins to XBus pins".format(index))
+        if len(kinds) < 1:
+            raise SimulationError("wire {} isn't connected to any chip".format(index))
+
+        name = "wire{}".format(index)
+        return SimpleNet(name) if NET_SIMPLE in kinds else XBusNet(name, self)
+
+    def wake(self, slot: BoardSlot):
+        """queues a chip to run during the current time unit"""
+        if not slot.queued:
+            slot.queued = True
+            self._queue.append(slot)
+
+    def drive(self, terminal: str, value: int):
+        """sets the value an external simple I/O input drives onto its wire"""
+        self.terminals[terminal].write(terminal, value, self.now)
+
+    def send(self, terminal: str, values: typing.Iterable[int]):
+        """queues values on an external XBus input, chips may read them from now on"""
+        self.terminals[terminal].feed(values)
+
+    def value(self, terminal: str) -> int:
+        """the value currently on an external simple I/O terminal's wire"""
+        return self.terminals[terminal].read(terminal)
+
+    def trace(self, terminal: str) -> [(int, int)]:
+        """
+        :return: for a simple output, each (time, value) the wire changed to,
+                 for an XBus output, each (time, value) written to it
+        """
+        net = self.terminals[terminal]
+        return net.trace if net.kind == NET_SIMPLE else net.sink
+
+    def clear_traces(self):
+        """forgets everything recorded on the external outputs so far, so that long runs don't accumulate it"""
+        for net in self.terminals.values():
+            if net.kind == NET_SIMPLE:
+                del net.trace[:]
+            elif net.sink is not None:
+                del net.sink[:]
+
+    @property
+    def power(self):
+        return sum(slot.chip.power for slot in self.slots.values())
+
+    def run_for(self, time_units: int):
+        """
+        simulates the board for a number of time units, time units in which no chip wakes are skipped
+        :param time_units: how many time units to simulate
+        """
+        self.run_until(self.now + time_units)
+
+    def run_until(self, end: int):
+        """
+        simulates the board until time unit `end`, which is not simulated
+        :param end: the first time unit not to simulate
+        """
+        sleepers = self._sleepers
+        while self.now < end:
+            while sleepers and sleepers[0][0] <= self.now:
+                self.wake(heapq.heappop(sleepers)[2])
+
+            self._run_queue()
+
+            # jump straight to the next time unit in which a chip is due to wake, if nothing
+            # is sleeping then every chip is blocked and only outside input can change that
+            if sleepers:
+                self.now = max(self.now + 1, min(sleepers[0][0], end))
+            else:
+                self.now = end
+
+    def _run_queue(self):
+        queue = self._queue
+        now = self.now
+        while queue:
+            slot = queue.popleft()
+            slot.queued = False
+            status = slot.chip.run(now)
+
+            if status == STATUS_SLEEP:
+                self._sequence += 1
+                heapq.heappush(self._sleepers, (slot.chip.wake_time, self._sequence, slot))
+                continue
+
+            net = slot.port.nets.get(slot.chip.blocked_on, None)
+            if net is None:
+                # blocked on a pin with no wire, it will never wake
+                continue
+            if status == STATUS_BLOCKED_WRITE:
+                if slot.port in net.taken:
+                    self.wake(slot)
+                else:
+                    net.waiting_writers.append(slot)
+            else:
+                if net.ready(slot.port):
+                    self.wake(slot)
+                else:
+                    net.waiting_readers.append(slot)
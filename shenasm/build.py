@@ -0,0 +1,237 @@
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import json
+import os
+import typing
+
+
+from .errors import IssueLog, Issue, TooManyErrors
+from .source import SourcePosition, iter_lines
+from .chips import lookup_by_name
+from .cache import ParseCache
+from .watch import IncrementalAssembler
+from . import assemble
+from . import codes
+from . import serialise
+from . import timing
+
+
+# the suffix given to output files when a job doesn't name its output
+DEFAULT_OUTPUT_SUFFIX = ".out.asm"
+
+
+class BuildJob(object):
+    """one source file to assemble as part of a batch, along with its target chip and output path"""
+
+    def __init__(self, source, chip, output):
+        self._source = source
+        self._chip = chip
+        self._output = output
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def chip(self):
+        return self._chip
+
+    @property
+    def output(self):
+        return self._output
+
+
+class JobResult(object):
+    """the outcome of one BuildJob, sent back from whichever process assembled it"""
+
+    def __init__(self, job: BuildJob, issues: [Issue], written: bool):
+        self._job = job
+        self._issues = issues
+        self._written = written
+
+    @property
+    def job(self):
+        return self._job
+
+    @property
+    def issues(self):
+        return self._issues
+
+    @property
+    def written(self):
+        """whether output was written, it is inhibited by errors"""
+        return self._written
+
+
+def default_output_path(source: str) -> str:
+    return os.path.splitext(source)[0] + DEFAULT_OUTPUT_SUFFIX
+
+
+def read_manifest(issues: IssueLog, path: str, default_chip: str) -> [BuildJob]:
+    """
+    reads a JSON manifest listing the files to assemble, of the form:
+
+        [
+          {"source": "controller.asm", "chip": "MC6000", "output": "build/controller.asm"},
+          {"source": "pulse.asm"},
+          ...
+        ]
+
+    paths are relative to the manifest, chip defaults to default_chip and output to the source
+    path with DEFAULT_OUTPUT_SUFFIX in place of its extension
+    :param issues: collection of issues generated during assembler execution
+    :param path: path to the manifest
+    :param default_chip: the chip type for entries that don't give one
+    :return: the jobs described by the manifest
+    """
+    pos = SourcePosition(path, None)
+    try:
+        with open(path) as handle:
+            document = json.load(handle)
+    except (IOError, ValueError) as error:
+        issues.error(pos, "unable to read manifest: {}", error, code=codes.MANIFEST_READ_ERROR)
+        return []
+
+    if not isinstance(document, list):
+        issues.error(pos, "manifest must be a list of sources to assemble", code=codes.MANIFEST_NOT_LIST)
+        return []
+
+    folder = os.path.dirname(os.path.abspath(path))
+
+    def relative_to_manifest(entry_path):
+        return entry_path if os.path.isabs(entry_path) else os.path.join(folder, entry_path)
+
+    jobs = []
+    for index, entry in enumerate(document):
+        if isinstance(entry, str):
+            entry = {"source": entry}
+        if not isinstance(entry, dict) or "source" not in entry:
+            issues.error(pos, "manifest entry {} must name a source", index, code=codes.MANIFEST_ENTRY_WITHOUT_SOURCE)
+            continue
+
+        chip = entry.get("chip", default_chip)
+        if lookup_by_name(chip) is None:
+            issues.error(
+                pos, "manifest entry {} has unknown chip type '{}'", index, chip, code=codes.MANIFEST_UNKNOWN_CHIP
+            )
+            continue
+
+        source = relative_to_manifest(entry["source"])
+        output = relative_to_manifest(entry["output"]) if "output" in entry else default_output_path(source)
+        jobs.append(BuildJob(source, chip, output))
+    return jobs
+
+
+def jobs_from_glob(pattern: str, chip: str) -> [BuildJob]:
+    """
+    :return: a job for every file matching the pattern, all for the same chip and with default output paths
+    """
+    return [
+        BuildJob(os.path.abspath(source), chip, default_output_path(os.path.abspath(source)))
+        for source in sorted(glob.glob(pattern, recursive=True))
+        # don't pick up the output of a previous batch as another input
+        if not source.endswith(DEFAULT_OUTPUT_SUFFIX)
+    ]
+
+
+def assemble_file(issues: IssueLog, path: str, chip_name: str, cache: ParseCache = None, optimise: bool = False):
+    """
+    reads, assembles and returns a single source file
+    :param issues: collection of issues generated during assembler execution
+    :param path: the file to assemble
+    :param chip_name: the type of chip being assembled for
+    :param cache: optional parse cache
+    :param optimise: whether to optimise the assembled program
+    :return: tuple of the assembled instructions and IR graph, or (None, None) if the file couldn't be read
+    """
+    root_path = os.path.abspath(path)
+    chip = lookup_by_name(chip_name)
+
+    if cache is not None:
+        build = IncrementalAssembler(chip, cache, issues.max_errors, optimise).build(root_path)
+        issues.extend(build.issues.issues)
+        return build.assembled, build.ir_nodes
+
+    try:
+        handle = open(root_path)
+    except IOError as io_error:
+        issues.error(SourcePosition(root_path, None), "error opening file: {}", io_error, code=codes.FILE_OPEN_ERROR)
+        return None, None
+
+    with handle:
+        included_files = {
+            root_path: SourcePosition("<root file passed to assembler>", None)
+        }
+        lines = iter_lines(issues, handle, root_path, included_files)
+        return assemble.assemble(issues, lines, chip, optimise=optimise)
+
+
+def run_job(job: BuildJob, cache_dir: typing.Optional[str] = None, max_errors: int = None,
+            optimise: bool = False, check_timing: bool = False, time_budget: int = None,
+            loop_bounds: typing.Dict[str, int] = None) -> JobResult:
+    """
+    assembles one job and writes its output unless there were errors, this runs in a worker process
+    :param check_timing: whether to check the program with timing.verify_timing(), implied by a time budget
+    :param time_budget: passed on to timing.verify_timing()
+    :param loop_bounds: passed on to timing.verify_timing()
+    """
+    issues = IssueLog(max_errors)
+    cache = ParseCache(cache_dir) if cache_dir is not None else None
+    try:
+        assembled, ir_nodes = assemble_file(issues, job.source, job.chip, cache, optimise)
+        if (check_timing or time_budget is not None) and ir_nodes is not None:
+            timing.verify_timing(issues, ir_nodes, time_budget, loop_bounds)
+    except TooManyErrors:
+        assembled = None
+
+    written = False
+    if assembled is not None and issues.error_count < 1:
+        try:
+            output_folder = os.path.dirname(job.output)
+            if output_folder:
+                os.makedirs(output_folder, exist_ok=True)
+            serialise.write_out(assembled, job.output)
+            written = True
+        except (IOError, OSError) as io_error:
+            issues.error(
+                SourcePosition(job.output, None), "unable to write output: {}", io_error, code=codes.OUTPUT_WRITE_ERROR
+            )
+
+    return JobResult(job, issues.issues, written)
+
+
+def run_jobs(jobs: [BuildJob], processes: int = None, cache_dir: str = None,
+             max_errors: int = None, optimise: bool = False, check_timing: bool = False, time_budget: int = None,
+             loop_bounds: typing.Dict[str, int] = None) -> typing.Iterator[JobResult]:
+    """
+    assembles many jobs across a pool of processes, so that interpreter startup and the assembler's
+    own work are shared out rather than paid once per file
+    :param jobs: the files to assemble
+    :param processes: the size of the pool, defaults to the number of CPUs, 1 assembles in this process
+    :param cache_dir: optional parse cache directory shared by every worker
+    :param max_errors: if given, each job stops once it has found this many errors
+    :param optimise: whether to optimise every job's output
+    :param check_timing: whether to check the timing of every job, see run_job()
+    :param time_budget: passed on to run_job()
+    :param loop_bounds: passed on to run_job()
+    :return: the result of each job, in the same order as the jobs, closing the iterator early cancels
+        jobs that haven't started
+    """
+    if processes == 1 or len(jobs) < 2:
+        for job in jobs:
+            yield run_job(job, cache_dir, max_errors, optimise, check_timing, time_budget, loop_bounds)
+        return
+
+    processes = processes or os.cpu_count() or 1
+    # hand out jobs in chunks so that small files don't cost a round trip to a worker each
+    chunk_size = max(1, len(jobs) // (processes * 4))
+    pool = ProcessPoolExecutor(max_workers=processes)
+    try:
+        arguments = (
+            [cache_dir] * len(jobs), [max_errors] * len(jobs), [optimise] * len(jobs), [check_timing] * len(jobs),
+            [time_budget] * len(jobs), [loop_bounds] * len(jobs)
+        )
+        for result in pool.map(run_job, jobs, *arguments, chunksize=chunk_size):
+            yield result
+    finally:
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import tempfile
+import typing
+
+
+from .errors import Issue
+from .parse import Instruction
+from .source import SourcePosition, IncludeDirective
+from . import log
+
+
+# bump this whenever the layout of cache entries changes
+CACHE_FORMAT = 2
+
+# environment variable that can point at a cache directory instead of passing one explicitly
+CACHE_DIR_ENVIRONMENT_VARIABLE = 'SHENASM_CACHE_DIR'
+
+
+def _code_fingerprint():
+    """
+    hashes the code that preprocesses and parses files, along with the modules that decide what the issues found
+    while doing so look like and this one, which decides how entries are written, so that cache entries written by
+    a different version of the assembler are never used
+    """
+    digest = hashlib.sha1(str(CACHE_FORMAT).encode())
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for name in ("source.py", "parse.py", "codes.py", "errors.py", "cache.py"):
+        with open(os.path.join(folder, name), 'rb') as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()
+
+
+class ParseCache(object):
+    """
+    stores each file's preprocessed and parsed contents on disk, keyed by the file's absolute path and
+    the hash of its contents, so that a new process can skip parsing files it has seen before
+
+    entries are small JSON documents in which every position is just a line number, as everything in
+    an entry comes from the same file, and includes are objects among the lists of instructions
+    """
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self._fingerprint = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _entry_path(self, path, digest):
+        if self._fingerprint is None:
+            self._fingerprint = _code_fingerprint()
+        key = hashlib.sha1("\0".join((self._fingerprint, path, digest)).encode()).hexdigest()
+        return os.path.join(self._directory, key[:2], key + ".json")
+
+    def load(self, path: str, digest: str) -> typing.Optional[tuple]:
+        """
+        :param path: absolute path of the file
+        :param digest: hash of the file's contents
+        :return: the (items, issues) previously stored for this file, or None if there are none
+        """
+        entry_path = self._entry_path(path, digest)
+        try:
+            with open(entry_path) as handle:
+                entry = json.load(handle)
+            result = _decode(path, entry)
+        except (IOError, OSError, ValueError, KeyError, TypeError, IndexError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        log.verbose("parse cache hit for {}".format(path))
+        return result
+
+    def store(self, path: str, digest: str, items, issues):
+        """
+        records a file's parsed contents, failures to write are ignored as the cache is only an optimisation
+        :param path: absolute path of the file
+        :param digest: hash of the file's contents
+        :param items: lists of instructions separated by include directives
+        :param issues: the issues found while preprocessing and parsing the file
+        """
+        entry_path = self._entry_path(path, digest)
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # write somewhere else first then move into place, so that concurrent assemblers
+            # never see a partially written entry
+            handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix=".tmp")
+            with os.fdopen(handle, 'w') as output:
+                json.dump(_encode(items, issues), output, separators=(',', ':'))
+            os.replace(temporary_path, entry_path)
+        except (IOError, OSError) as io_error:
+            log.verbose("unable to write parse cache entry for {}: {}".format(path, io_error))
+
+
+def default_cache_dir() -> typing.Optional[str]:
+    return os.environ.get(CACHE_DIR_ENVIRONMENT_VARIABLE, None) or None
+
+
+def _encode(items, issues):
+    encoded_items = []
+    for item in items:
+        if isinstance(item, IncludeDirective):
+            encoded_items.append({"line": item.pos.line, "path": item.path})
+        else:
+            encoded_items.append([
+                [inst.source_pos.line, inst.label, inst.condition, inst.mnemonic, inst.args]
+                for inst in item
+            ])
+    encoded_issues = [
+        [issue.level, issue.source_pos.line, issue.message, issue.code]
+        for issue in issues
+    ]
+    return {"items": encoded_items, "issues": encoded_issues}
+
+
+def _decode(path, entry):
+    # every entry's positions refer to the same file, so share a position object per line
+    positions = {}
+
+    def position(line):
+        pos = positions.get(line, None)
+        if pos is None:
+            pos = positions[line] = SourcePosition(path, line)
+        return pos
+
+    items = []
+    for item in entry["items"]:
+        if isinstance(item, dict):
+            items.append(IncludeDirective(position(item["line"]), item["path"]))
+        else:
+            items.append([
+                Instruction(position(line), label, condition, mnemonic, args)
+                for line, label, condition, mnemonic, args in item
+            ])
+    issues = [
+        Issue(level, position(line), message, (), code)
+        for level, line, message, code in entry["issues"]
+    ]
+    return items, issues
@@ -3,9 +3,10 @@ from collections import OrderedDict
 
 class ChipInfo(object):
 
-    def __init__(self, registers, memory):
+    def __init__(self, registers, memory, cost):
         self._registers = registers
         self._memory = memory
+        self._cost = cost
 
     @property
     def registers(self):
@@ -15,10 +16,16 @@ class ChipInfo(object):
     def memory(self):
         return self._memory
 
+    @property
+    def cost(self):
+        """the price of the chip in yuan, which the game adds up for a solution's cost score"""
+        return self._cost
+
     def replace(self, **kwargs):
         return ChipInfo(
             kwargs.get("registers", self.registers),
-            kwargs.get("memory", self.memory)
+            kwargs.get("memory", self.memory),
+            kwargs.get("cost", self.cost)
         )
 
 
@@ -57,7 +64,8 @@ CHIPS = {
             RegisterInfo('x0', REG_TYPE_XBUS),
             RegisterInfo('x1', REG_TYPE_XBUS),
         ],
-        memory=9
+        memory=9,
+        cost=3
     ),
     CHIP_TYPE_MC4000X: ChipInfo(
         registers=[
@@ -68,7 +76,8 @@ CHIPS = {
             RegisterInfo('x2', REG_TYPE_XBUS),
             RegisterInfo('x3', REG_TYPE_XBUS),
         ],
-        memory=9
+        memory=9,
+        cost=3
     ),
     CHIP_TYPE_MC6000: ChipInfo(
         registers=[
@@ -82,7 +91,8 @@ CHIPS = {
             RegisterInfo('x2', REG_TYPE_XBUS),
             RegisterInfo('x3', REG_TYPE_XBUS),
         ],
-        memory=14
+        memory=14,
+        cost=5
     ),
 }
 
@@ -0,0 +1,69 @@
+"""
+the stable code every issue is reported with, tools reading our diagnostics match on these rather than the wording of
+the messages, so a code is never reused for a different issue
+"""
+
+# reading source and the preprocessor
+FILE_OPEN_ERROR = 'SH100'
+INCLUDE_OPEN_ERROR = 'SH101'
+INCLUDE_WITHOUT_PATH = 'SH102'
+INCLUDE_PATH_NOT_QUOTED = 'SH103'
+UNKNOWN_DIRECTIVE = 'SH104'
+INCLUDE_NOT_FOUND = 'SH105'
+INCLUDED_MORE_THAN_ONCE = 'SH106'
+
+# parsing
+CONDITION_WITHOUT_INSTRUCTION = 'SH201'
+
+# assembling
+PROGRAM_TOO_LONG = 'SH301'
+UNKNOWN_INSTRUCTION = 'SH302'
+TOO_FEW_ARGUMENTS = 'SH303'
+TOO_MANY_ARGUMENTS = 'SH304'
+SYMBOL_WITHOUT_VALUE = 'SH305'
+SYMBOL_REDEFINED = 'SH306'
+SYMBOL_IS_REGISTER = 'SH307'
+ALIAS_NOT_REGISTER = 'SH308'
+INVALID_EXPRESSION = 'SH309'
+CONSTANT_OUT_OF_RANGE = 'SH310'
+UNKNOWN_CONSTANT = 'SH311'
+CIRCULAR_CONSTANTS = 'SH312'
+
+# control flow and timing
+UNKNOWN_LABEL = 'SH401'
+UNREACHABLE_CODE = 'SH402'
+OVER_TIME_BUDGET = 'SH403'
+SLEEPLESS_LOOP = 'SH404'
+UNBOUNDED_LOOP = 'SH405'
+
+# batch assembly
+MANIFEST_READ_ERROR = 'SH501'
+MANIFEST_NOT_LIST = 'SH502'
+MANIFEST_ENTRY_WITHOUT_SOURCE = 'SH503'
+MANIFEST_UNKNOWN_CHIP = 'SH504'
+OUTPUT_WRITE_ERROR = 'SH505'
+GLOB_MATCHED_NOTHING = 'SH506'
+
+# boards
+BOARD_READ_ERROR = 'SH601'
+BOARD_NOT_OBJECT = 'SH602'
+BOARD_CHIP_INCOMPLETE = 'SH603'
+BOARD_UNKNOWN_CHIP = 'SH604'
+BOARD_DUPLICATE_CHIP = 'SH605'
+BOARD_SOURCE_OPEN_ERROR = 'SH606'
+BOARD_CHIP_NOT_SIMULATABLE = 'SH607'
+BOARD_INVALID_WIRING = 'SH608'
+
+# the superoptimiser
+SUPEROPT_CASES_READ_ERROR = 'SH701'
+SUPEROPT_NOT_SIMULATABLE = 'SH702'
+
+# replaying traces
+TRACE_READ_ERROR = 'SH801'
+TRACE_INVALID = 'SH802'
+TRACE_MISMATCH = 'SH803'
+TRACE_SIMULATION_FAILED = 'SH804'
+
+# coverage
+COVERAGE_CASES_READ_ERROR = 'SH901'
+COVERAGE_NOT_SIMULATABLE = 'SH902'
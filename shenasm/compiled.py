@@ -0,0 +1,485 @@
+import hashlib
+import re
+import types
+import typing
+
+
+from .sim import Program, Chip, SimulationError, OPERAND_INT, OPERAND_ACC, OPERAND_DAT, OPERAND_NULL, \
+    OPERAND_SIMPLE, OPERAND_XBUS, OP_NOP, OP_MOV, OP_JMP, OP_SLP, OP_SLX, OP_ADD, OP_SUB, OP_MUL, OP_NOT, OP_DGT, \
+    OP_DST, OP_TEQ, OP_TGT, OP_TLT, OP_TCP, OP_GEN_ON, OP_GEN_OFF, COND_NONE, COND_ONCE, FLAG_NONE, FLAG_TRUE, \
+    FLAG_FALSE, STATUS_SLEEP, STATUS_SLX, STATUS_BLOCKED_READ, STATUS_BLOCKED_WRITE, VALUE_MIN, VALUE_MAX, \
+    SIMPLE_MIN, SIMPLE_MAX, DEFAULT_INSTRUCTION_LIMIT, digit_of, set_digit
+
+
+# how many compiled programs are kept, the oldest is dropped once there are more
+CACHE_SIZE = 256
+
+_cache = {}
+
+
+class CompiledProgram(object):
+    """
+    a Program translated into the source of a Python function that runs one time unit of it, with every
+    operand, condition and jump target written into the code rather than looked up as it runs
+    """
+
+    def __init__(self, program: Program, source: str, run):
+        self._program = program
+        self._source = source
+        self._run = run
+
+    @property
+    def program(self):
+        return self._program
+
+    @property
+    def source(self):
+        """the generated Python source, for debugging"""
+        return self._source
+
+    @property
+    def run(self):
+        """the compiled function, called with the CompiledChip and the time unit just like Chip.run"""
+        return self._run
+
+
+def program_hash(program: Program) -> str:
+    """:return: a digest of everything the compiled code depends on, which is only the operations"""
+    return hashlib.sha1(repr(program.ops).encode()).hexdigest()
+
+
+def compile_program(program: Program, count_hits: bool = False) -> CompiledProgram:
+    """
+    translates a decoded program into Python, reusing an earlier translation of an identical program
+    :param count_hits: whether the code should count how many times each operation runs, in the chip's hits
+    """
+    key = program_hash(program) + ("+hits" if count_hits else "")
+    compiled = _cache.get(key, None)
+    if compiled is not None:
+        return compiled
+
+    source = _Translator(program.ops, count_hits).translate()
+    namespace = {
+        'SimulationError': SimulationError,
+        'digit_of': digit_of,
+        'set_digit': set_digit,
+    }
+    exec(compile(source, "<compiled program {}>".format(key[:12]), "exec"), namespace)
+    compiled = CompiledProgram(program, source, namespace['run'])
+
+    if len(_cache) >= CACHE_SIZE:
+        del _cache[next(iter(_cache))]
+    _cache[key] = compiled
+    return compiled
+
+
+def clear_cache():
+    _cache.clear()
+
+
+class CompiledChip(Chip):
+    """
+    a Chip that runs its program as compiled Python rather than interpreting each operation, it behaves
+    exactly like Chip and can be used anywhere one is
+    """
+
+    def __init__(self, program: Program, io=None, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT,
+                 hits: typing.List[int] = None):
+        """
+        :param hits: if given, a count for each of the program's operations, added to each time one runs, as used
+                     for shenasm.coverage, the second half of gen is never counted so that the counts add up to power
+        """
+        super().__init__(program, io, instruction_limit)
+        self.hits = hits
+        self._compiled = compile_program(program, hits is not None)
+        # the compiled function is bound straight to the chip, saving a call every time unit
+        self.run = types.MethodType(self._compiled.run, self)
+
+    @property
+    def compiled(self) -> CompiledProgram:
+        return self._compiled
+
+    def run(self, now: int) -> str:
+        return self._compiled.run(self, now)
+
+
+def _clamp(register: str, low: bool = True, high: bool = True) -> [str]:
+    """
+    :return: the lines that clamp a register after arithmetic, which was done in place so the operand has only
+             been evaluated once, checking only the bounds the arithmetic could have crossed
+    """
+    lines = []
+    if high:
+        lines.append("if {r} > {max}: {r} = {max}".format(r=register, max=VALUE_MAX))
+    if low:
+        lines.append("{}if {r} < {min}: {r} = {min}".format("el" if high else "", r=register, min=VALUE_MIN))
+    return lines
+
+
+# the parts of a chip's io the generated code might call, each bound to a local only if it does
+_IO_METHODS = ("read_simple", "write_simple", "xbus_ready", "xbus_read", "xbus_write")
+
+# the registers kept in locals while the chip runs
+_REGISTERS = ("acc", "dat", "flag", "latched")
+
+
+def _reads_a(code) -> bool:
+    """slx, gen and jmp name their first operand rather than read it, and nop and not have none"""
+    return code not in (OP_NOP, OP_NOT, OP_SLX, OP_GEN_ON, OP_GEN_OFF, OP_JMP)
+
+
+def _may_block(op) -> bool:
+    code, _, a_kind, _, b_kind, _, _, _ = op
+    return (
+        code == OP_SLX
+        or (a_kind == OPERAND_XBUS and _reads_a(code))
+        or (b_kind == OPERAND_XBUS and (code == OP_MOV or code >= OP_DST))
+    )
+
+
+def _may_sleep(op) -> bool:
+    code, _, _, _, b_kind, b_value, _, _ = op
+    if code in (OP_GEN_ON, OP_GEN_OFF):
+        return b_kind != OPERAND_INT or b_value > 0
+    return code == OP_SLP
+
+
+class _Translator(object):
+    """
+    writes the function for a program, split into regions of straight-line code: a region starts wherever
+    execution can arrive other than by running on from the operation before (the start of the program, jump
+    targets, where a chip picks up after sleeping and operations that can block) and runs its operations one
+    after another without looking at pc, only going from one region to another searches for it by pc
+    """
+
+    def __init__(self, ops, count_hits: bool = False):
+        self._ops = ops
+        self._count_hits = count_hits
+        self._lines = []
+        self._indent = 0
+        # instructions completed in the current region that haven't been added to executed yet
+        self._pending = 0
+        self._region_start = None
+
+    def translate(self) -> str:
+        once = [index for index, op in enumerate(self._ops) if op[1] == COND_ONCE]
+        if len(self._ops) < 1:
+            return (
+                "def run(chip, now):\n"
+                "    if now < chip.wake_time:\n"
+                "        return {!r}\n"
+                "    raise SimulationError(\"time unit {{}}: every instruction was skipped, the chip can never sleep\""
+                ".format(now))\n"
+            ).format(STATUS_SLEEP)
+
+        # the body comes first, so that only what it uses is set up before it and stored after it
+        self._indent = 2
+        entries = self._entries()
+        self._dispatch(entries + [len(self._ops)], 0, len(entries))
+        body = self._lines
+        text = "\n".join(body)
+
+        def uses(name):
+            return re.search(r"\b{}\b".format(name), text) is not None
+
+        def assigns(name):
+            return re.search(r"\b{}\s*[-+*]?=[^=]".format(name), text) is not None
+
+        self._lines = []
+        self._indent = 0
+        self._emit("def run(chip, now):")
+        self._indent += 1
+        self._emit("if now < chip.wake_time:")
+        self._emit("    return {!r}".format(STATUS_SLEEP))
+        if any(uses(name) for name in _IO_METHODS):
+            self._emit("io = chip.io")
+        for name in _IO_METHODS:
+            if uses(name):
+                self._emit("{0} = io.{0}".format(name))
+        if uses("check_progress"):
+            self._emit("check_progress = chip._check_progress")
+            self._emit("executed_at_wrap = -1")
+        if uses("once_done"):
+            self._emit("once_done = chip.once_done")
+        if uses("hits"):
+            self._emit("hits = chip.hits")
+        if uses("limit"):
+            self._emit("limit = chip.instruction_limit")
+        # registers are only copied in if they are used, and only copied back out if they can change
+        stored = [name for name in _REGISTERS if assigns(name)]
+        for name in _REGISTERS:
+            if uses(name):
+                self._emit("{0} = chip.{0}".format(name))
+        self._emit("pc = chip.pc")
+        self._emit("executed = 0")
+        blocks = uses("blocked_on")
+        if blocks:
+            self._emit("blocked_on = None")
+        self._emit("while True:")
+        self._lines.extend(body)
+        if once and blocks:
+            self._emit("if blocked_on is not None and pc in {!r}:".format(frozenset(once)))
+            self._emit("    once_done[pc] = 0")
+        for name in stored:
+            self._emit("chip.{0} = {0}".format(name))
+        self._emit("chip.pc = pc")
+        self._emit("chip.power += executed")
+        if blocks:
+            self._emit("chip.blocked_on = blocked_on")
+        self._emit("return status")
+        return "\n".join(self._lines) + "\n"
+
+    def _emit(self, line):
+        self._lines.append("    " * self._indent + line)
+
+    def _entries(self) -> [int]:
+        """:return: the operations a region starts at, in order"""
+        count = len(self._ops)
+        entries = {0}
+        for index, op in enumerate(self._ops):
+            if op[0] == OP_JMP:
+                entries.add(op[3])
+            if _may_block(op):
+                # a blocked operation runs again from the start when the chip retries
+                entries.add(index)
+            if _may_sleep(op):
+                entries.add((index + 1) % count)
+            if op[0] == OP_GEN_ON and op[1] != COND_NONE:
+                entries.add((index + 2) % count)
+        return sorted(entries)
+
+    def _dispatch(self, bounds, first, last):
+        """emits a binary search over pc for the regions from first up to (but not including) last"""
+        if last - first == 1:
+            self._region(bounds[first], bounds[first + 1])
+            return
+        middle = (first + last) // 2
+        self._emit("if pc < {}:".format(bounds[middle]))
+        self._indent += 1
+        self._dispatch(bounds, first, middle)
+        self._indent -= 1
+        self._emit("else:")
+        self._indent += 1
+        self._dispatch(bounds, middle, last)
+        self._indent -= 1
+
+    def _region(self, start, end):
+        self._region_start = start
+        self._pending = 0
+        stopped = False
+        for index in range(start, end):
+            stopped = self._operation(index, self._ops[index])
+        if not stopped:
+            self._flush()
+            self._advance(end - 1)
+            self._emit("continue")
+
+    def _flush(self, extra=0, keep=False):
+        """
+        brings executed up to date, before anything reads it or execution leaves the region
+        :param extra: instructions to add on top of those pending
+        :param keep: whether what was pending is still pending afterwards, for a flush on only one path
+        """
+        if self._pending + extra:
+            self._emit("executed += {}".format(self._pending + extra))
+        if not keep:
+            self._pending = 0
+
+    def _advance(self, index, target=None):
+        """moves pc on to the next operation (or the target of a jump), noting each time execution wraps around"""
+        if target is not None:
+            self._emit("pc = {}".format(target))
+        elif index + 1 == len(self._ops):
+            self._emit("pc = 0")
+            self._emit("executed_at_wrap = check_progress(now, executed, executed_at_wrap)")
+        else:
+            self._emit("pc = {}".format(index + 1))
+
+    def _stop(self, index, status):
+        """
+        emits stopping for a reason other than sleep part way through a region, which can only be at its first
+        operation, so pc is already right and nothing is pending
+        """
+        assert index == self._region_start and self._pending == 0
+        self._emit("status, blocked_on = {}".format(status))
+        self._emit("break")
+
+    def _sleep(self, index, cost):
+        """emits going to sleep once the operation at index has completed"""
+        self._flush(cost, keep=True)
+        self._advance(index)
+        self._emit("status = {!r}".format(STATUS_SLEEP))
+        self._emit("break")
+
+    def _fetch(self, index, kind, value, name, first_kind=None) -> str:
+        """
+        emits whatever is needed to read an operand
+        :param first_kind: for a second operand, the kind of the first, which has to be kept if this read blocks
+        :return: an expression for the operand's value
+        """
+        if kind == OPERAND_INT:
+            return repr(value)
+        if kind == OPERAND_ACC:
+            return "acc"
+        if kind == OPERAND_DAT:
+            return "dat"
+        if kind == OPERAND_NULL:
+            return "0"
+        if kind == OPERAND_SIMPLE:
+            self._emit("{} = read_simple({!r})".format(name, value))
+            return name
+        if first_kind is None:
+            # a value read before blocking is kept for when the operation runs again
+            self._emit("if latched is not None:")
+            self._emit("    {} = latched".format(name))
+            self._emit("    latched = None")
+            self._emit("else:")
+            self._indent += 1
+        self._emit("{} = xbus_read({!r})".format(name, value))
+        self._emit("if {} is None:".format(name))
+        self._indent += 1
+        if first_kind == OPERAND_XBUS:
+            self._emit("latched = a")
+        self._stop(index, "{!r}, {!r}".format(STATUS_BLOCKED_READ, value))
+        self._indent -= 1
+        if first_kind is None:
+            self._indent -= 1
+        return name
+
+    def _operation(self, index, op) -> bool:
+        """
+        emits one operation, running on into whatever comes after it
+        :return: whether execution can never run on past it
+        """
+        code, condition, a_kind, a_value, b_kind, b_value, c_kind, c_value = op
+
+        guarded = False
+        if condition != COND_NONE:
+            self._flush()
+            if code == OP_GEN_ON:
+                # skipping gen skips both of its halves, which isn't where running on would go
+                self._emit("if once_done[{}]:".format(index) if condition == COND_ONCE else
+                           "if flag != {}:".format(condition))
+                self._indent += 1
+                self._advance(index + 1)
+                self._emit("continue")
+                self._indent -= 1
+                if condition == COND_ONCE:
+                    self._emit("once_done[{}] = 1".format(index))
+            else:
+                # @ operations are marked as done up front and unmarked again if they block before completing
+                self._emit("if not once_done[{}]:".format(index) if condition == COND_ONCE else
+                           "if flag == {}:".format(condition))
+                self._indent += 1
+                if condition == COND_ONCE:
+                    self._emit("once_done[{}] = 1".format(index))
+                guarded = True
+
+        a = self._fetch(index, a_kind, a_value, "a") if _reads_a(code) else None
+        # both halves of gen together are a single instruction as far as power goes
+        cost = 0 if code == OP_GEN_OFF else 1
+        stops = False
+
+        if code == OP_MOV:
+            if b_kind == OPERAND_ACC:
+                self._emit("acc = {}".format(a))
+            elif b_kind == OPERAND_DAT:
+                self._emit("dat = {}".format(a))
+            elif b_kind == OPERAND_SIMPLE:
+                if a_kind == OPERAND_INT:
+                    self._emit("write_simple({!r}, {!r})".format(b_value, min(max(a_value, SIMPLE_MIN), SIMPLE_MAX)))
+                else:
+                    self._emit("write_simple({!r}, {min} if {a} < {min} else ({max} if {a} > {max} else {a}))".format(
+                        b_value, a=a, min=SIMPLE_MIN, max=SIMPLE_MAX
+                    ))
+            elif b_kind == OPERAND_XBUS:
+                self._emit("if not xbus_write({!r}, {}):".format(b_value, a))
+                self._indent += 1
+                if a_kind == OPERAND_XBUS:
+                    self._emit("latched = a")
+                self._stop(index, "{!r}, {!r}".format(STATUS_BLOCKED_WRITE, b_value))
+                self._indent -= 1
+        elif code in (OP_ADD, OP_SUB):
+            self._emit("acc {}= {}".format("+" if code == OP_ADD else "-", a))
+            if a_kind == OPERAND_INT:
+                # a literal can only push acc past the bound on its own side
+                rising = (a_value > 0) == (code == OP_ADD)
+                if a_value != 0:
+                    for line in _clamp("acc", low=not rising, high=rising):
+                        self._emit(line)
+            else:
+                for line in _clamp("acc"):
+                    self._emit(line)
+        elif code == OP_MUL:
+            self._emit("acc *= {}".format(a))
+            if a_kind != OPERAND_INT or not (-1 <= a_value <= 1):
+                for line in _clamp("acc"):
+                    self._emit(line)
+        elif code == OP_NOT:
+            self._emit("acc = {} if acc == 0 else 0".format(SIMPLE_MAX))
+        elif code == OP_DGT:
+            self._emit("acc = digit_of(acc, {})".format(a))
+        elif code == OP_JMP:
+            self._flush()
+            self._emit("if executed >= limit:")
+            self._emit("    raise SimulationError(\"executed {} instructions in time unit {} without sleeping\""
+                       ".format(executed, now))")
+            self._emit("executed += 1")
+            if self._count_hits:
+                self._emit("hits[{}] += 1".format(index))
+            self._advance(index, a_value)
+            self._emit("continue")
+            stops = True
+        elif code == OP_SLP:
+            if a_kind == OPERAND_INT:
+                self._emit("chip.wake_time = now + {}".format(a_value if a_value > 1 else 1))
+            else:
+                self._emit("chip.wake_time = now + ({a} if {a} > 1 else 1)".format(a=a))
+            stops = True
+        elif code == OP_SLX:
+            self._emit("if not xbus_ready({!r}):".format(a_value))
+            self._indent += 1
+            self._stop(index, "{!r}, {!r}".format(STATUS_SLX, a_value))
+            self._indent -= 1
+        elif code >= OP_DST:
+            b = self._fetch(index, b_kind, b_value, "b", a_kind)
+            if code == OP_TEQ:
+                self._emit("flag = {} if {} == {} else {}".format(FLAG_TRUE, a, b, FLAG_FALSE))
+            elif code == OP_TGT:
+                self._emit("flag = {} if {} > {} else {}".format(FLAG_TRUE, a, b, FLAG_FALSE))
+            elif code == OP_TLT:
+                self._emit("flag = {} if {} < {} else {}".format(FLAG_TRUE, a, b, FLAG_FALSE))
+            elif code == OP_TCP:
+                self._emit("flag = {t} if {a} > {b} else ({f} if {a} < {b} else {n})".format(
+                    a=a, b=b, t=FLAG_TRUE, f=FLAG_FALSE, n=FLAG_NONE
+                ))
+            elif code == OP_DST:
+                self._emit("acc = set_digit(acc, {}, {})".format(a, b))
+            else:
+                self._emit("write_simple({!r}, {})".format(a_value, SIMPLE_MAX if code == OP_GEN_ON else SIMPLE_MIN))
+                if b_kind == OPERAND_INT:
+                    if b_value > 0:
+                        self._emit("chip.wake_time = now + {}".format(b_value))
+                        stops = True
+                else:
+                    self._emit("if {} > 0:".format(b))
+                    self._indent += 1
+                    self._emit("chip.wake_time = now + {}".format(b))
+                    if self._count_hits and cost:
+                        self._emit("hits[{}] += 1".format(index))
+                    self._sleep(index, cost)
+                    self._indent -= 1
+
+        # the operation completed, so it costs power
+        if code != OP_JMP:
+            if self._count_hits and cost:
+                self._emit("hits[{}] += 1".format(index))
+            self._pending += cost
+            if stops:
+                self._sleep(index, 0)
+                self._pending = 0
+        if guarded:
+            self._flush()
+            self._indent -= 1
+            return False
+        return stops
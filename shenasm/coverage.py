@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import typing
+
+
+from .chips import ChipInfo
+from .compiled import CompiledChip
+from .intermediate import IntermediateGraph, IntermediateNode, TRUE_CONDITIONAL, FALSE_CONDITIONAL
+from .parse import Instruction
+from .sim import decode_program, Program, DEFAULT_INSTRUCTION_LIMIT
+from .superopt import TestCase, run_case
+
+
+# how the annotated listing marks lines that never ran and lines that hold no instruction, as gcov does
+NEVER_RUN = "#####"
+NOT_CODE = "-"
+
+
+class RegionCoverage(object):
+    """how often a region of the intermediate graph ran and the power spent in it"""
+
+    def __init__(self, region: IntermediateNode, runs: int, power: int):
+        self._region = region
+        self._runs = runs
+        self._power = power
+
+    @property
+    def region(self):
+        return self._region
+
+    @property
+    def runs(self):
+        """how many times the region was entered and ran"""
+        return self._runs
+
+    @property
+    def power(self):
+        """the instructions executed in the region"""
+        return self._power
+
+
+class Coverage(object):
+    """
+    counts how many times each instruction of an assembled program runs, over any number of simulations, and
+    attributes the counts back to the source lines (and so the regions) the instructions came from
+    """
+
+    def __init__(self, instructions: [Instruction], chip: ChipInfo):
+        """
+        :param instructions: the output of assemble()
+        :param chip: the chip the program runs on
+        :raises SimulationError: if the program can't be simulated
+        """
+        self._instructions = instructions
+        self._program = decode_program(instructions, chip)
+        self._op_hits = [0] * len(self._program)
+
+    @property
+    def program(self) -> Program:
+        return self._program
+
+    def chip(self, io=None, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT) -> CompiledChip:
+        """:return: a chip running the program whose executions are counted here"""
+        return CompiledChip(self._program, io, instruction_limit, self._op_hits)
+
+    def run_cases(self, cases: [TestCase], instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT):
+        """
+        runs the program through test cases in the format shenasm.superopt reads
+        :raises SimulationError: if the program can't make progress
+        """
+        for case in cases:
+            run_case(self._program, case, instruction_limit, chip_class=lambda _, io, limit: self.chip(io, limit))
+
+    @property
+    def power(self) -> int:
+        return sum(self._op_hits)
+
+    @property
+    def hits(self) -> [typing.Optional[int]]:
+        """the times each assembled instruction ran, None for lines holding only a label"""
+        hits = [None if instruction.mnemonic is None else 0 for instruction in self._instructions]
+        for op, source in enumerate(self._program.sources):
+            hits[source] += self._op_hits[op]
+        return hits
+
+    def by_line(self) -> typing.Dict[typing.Tuple[str, int], int]:
+        """:return: the times instructions on each source line ran, by (file, line), in program order"""
+        lines = OrderedDict()
+        for instruction, hits in zip(self._instructions, self.hits):
+            position = instruction.source_pos
+            if hits is None or position is None or position.line is None:
+                continue
+            key = (position.file, position.line)
+            lines[key] = lines.get(key, 0) + hits
+        return lines
+
+    def regions(self, ir_nodes: IntermediateGraph) -> typing.Dict[IntermediateNode, RegionCoverage]:
+        """
+        :param ir_nodes: the graph assemble() returned along with the instructions
+        :return: the coverage of each region, found from the source lines of its instructions
+        """
+        lines = self.by_line()
+        result = OrderedDict()
+        for region in ir_nodes:
+            keys = OrderedDict.fromkeys(
+                (instruction.source_pos.file, instruction.source_pos.line)
+                for instruction in region.instructions if instruction.source_pos is not None
+            )
+            counts = [lines[key] for key in keys if key in lines]
+            result[region] = RegionCoverage(region, max(counts, default=0), sum(counts))
+        return result
+
+    def never_taken(self, ir_nodes: IntermediateGraph) -> [IntermediateNode]:
+        """:return: the conditional regions that never ran although the region before them did"""
+        coverage = self.regions(ir_nodes)
+        return [
+            region for region, covered in coverage.items()
+            if covered.runs == 0 and region.first_instruction.condition in (TRUE_CONDITIONAL, FALSE_CONDITIONAL)
+            and any(coverage[source].runs > 0 for source in region.incoming if source in coverage)
+        ]
+
+    def format_listing(self) -> str:
+        """
+        :return: every source file the program came from, each line prefixed with the times it ran, in the style
+                 of gcov: NEVER_RUN for an instruction that never ran and NOT_CODE for anything else
+        """
+        lines = self.by_line()
+        hits = self.hits
+        total = sum(1 for count in hits if count is not None)
+        run = sum(1 for count in hits if count)
+        output = ["{} of {} instructions ran, using {} power".format(run, total, self.power)]
+
+        for path in OrderedDict.fromkeys(file for file, _ in lines):
+            output.append("{:>9}:{:>5}:Source:{}".format(NOT_CODE, 0, path))
+            try:
+                with open(path) as handle:
+                    text = handle.read().splitlines()
+            except IOError as error:
+                output.append("{:>9}:{:>5}:unable to read source: {}".format(NOT_CODE, 0, error))
+                continue
+            for number, line in enumerate(text, start=1):
+                hits = lines.get((path, number), None)
+                count = NOT_CODE if hits is None else (NEVER_RUN if hits == 0 else str(hits))
+                output.append("{:>9}:{:>5}:{}".format(count, number, line))
+        return "\n".join(output)
@@ -0,0 +1,119 @@
+import json
+import os
+import pathlib
+import typing
+
+
+from .errors import Issue
+
+
+# the name tools reading our machine readable diagnostics know us by
+TOOL_NAME = "shenasm"
+
+SARIF_VERSION = "2.1.0"
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+def is_real_file(path: typing.Optional[str]) -> bool:
+    """positions such as <whole program> name something other than a file"""
+    return path is not None and not path.startswith("<")
+
+
+def issue_to_dict(issue: Issue) -> dict:
+    """
+    :return: the issue as a flat dictionary of file, line, level, code and message
+    """
+    return {
+        "file": issue.source_pos.file,
+        "line": issue.source_pos.line,
+        "level": issue.level,
+        "code": issue.code,
+        "message": issue.message,
+    }
+
+
+class JsonLinesWriter(object):
+    """writes each issue as a JSON object on its own line, as soon as it is reported"""
+
+    def __init__(self, stream: typing.TextIO):
+        self._stream = stream
+
+    def write(self, issue: Issue):
+        self._stream.write(json.dumps(issue_to_dict(issue)))
+        self._stream.write("\n")
+        # whoever reads us wants each issue now rather than when a buffer fills up
+        self._stream.flush()
+
+    def close(self):
+        self._stream.flush()
+
+
+class SarifWriter(object):
+    """
+    writes issues as a SARIF log, the results are written out as they are reported
+    and the document is completed by close()
+    """
+
+    def __init__(self, stream: typing.TextIO):
+        self._stream = stream
+        self._results = 0
+        self._started = False
+
+    def _start(self):
+        driver = json.dumps({"name": TOOL_NAME})
+        self._stream.write(
+            '{{"version":"{}","$schema":"{}","runs":[{{"tool":{{"driver":{}}},"results":['.format(
+                SARIF_VERSION, SARIF_SCHEMA, driver
+            )
+        )
+        self._started = True
+
+    def write(self, issue: Issue):
+        if not self._started:
+            self._start()
+        if self._results > 0:
+            self._stream.write(",")
+        self._stream.write("\n")
+        self._stream.write(json.dumps(sarif_result(issue)))
+        self._stream.flush()
+        self._results += 1
+
+    def close(self):
+        if not self._started:
+            self._start()
+        self._stream.write("\n]}]}\n")
+        self._stream.flush()
+        # the next issue will start a fresh document
+        self._started = False
+        self._results = 0
+
+
+def sarif_result(issue: Issue) -> dict:
+    """
+    :return: the issue as a SARIF result object
+    """
+    result = {
+        "ruleId": issue.code,
+        "level": issue.level,
+        "message": {"text": issue.message},
+    }
+    pos = issue.source_pos
+    if is_real_file(pos.file):
+        location = {"artifactLocation": {"uri": file_uri(pos.file)}}
+        if pos.line is not None:
+            location["region"] = {"startLine": pos.line}
+        result["locations"] = [{"physicalLocation": location}]
+    return result
+
+
+def file_uri(path: str) -> str:
+    if os.path.isabs(path):
+        return pathlib.Path(path).as_uri()
+    return pathlib.PurePath(path).as_posix()
+
+
+# maps the names accepted by --diagnostics-format to the writers for them
+FORMATS = {
+    "json": JsonLinesWriter,
+    "sarif": SarifWriter,
+}
@@ -1,16 +1,35 @@
+import typing
 
 
 WARNING = 'warning'
 ERROR = 'error'
 
 
+class TooManyErrors(Exception):
+    """raised by an IssueLog when it records its maximum number of errors, to stop assembly early"""
+
+    def __init__(self, max_errors):
+        super().__init__("stopped after {} errors".format(max_errors))
+        self.max_errors = max_errors
+
+
 class Issue(object):
     """records information about an issue that was encountered during assembler execution"""
+    __slots__ = ('_level', '_source_pos', '_message', '_args', '_code')
 
-    def __init__(self, level, source_pos, message):
+    def __init__(self, level, source_pos, message, args=(), code=None):
+        """
+        :param level: WARNING or ERROR
+        :param source_pos: the position in the source that the issue refers to
+        :param message: a description of the issue, formatted with args only when it is first needed
+        :param args: arguments to be forwarded to message.format(*args)
+        :param code: identifies the kind of issue, unlike the message it doesn't change between versions
+        """
         self._level = level
         self._source_pos = source_pos
         self._message = message
+        self._args = args
+        self._code = code
 
     @property
     def level(self):
@@ -20,10 +39,21 @@ class Issue(object):
     def source_pos(self):
         return self._source_pos
 
+    @property
+    def code(self):
+        return self._code
+
     @property
     def message(self):
+        if self._args:
+            self._message = self._message.format(*self._args)
+            self._args = ()
         return self._message
 
+    def __reduce__(self):
+        # arguments could be anything, so send issues between processes with their message already formatted
+        return Issue, (self._level, self._source_pos, self.message, (), self._code)
+
     def __str__(self):
         return "{} line {}: {} - {}".format(
             self.source_pos.file,
@@ -36,36 +66,80 @@ class Issue(object):
 class IssueLog(object):
     """collects all issues that occur during assembler execution"""
 
-    def __init__(self):
+    def __init__(self, max_errors: int = None, listener: typing.Callable[[Issue], None] = None):
+        """
+        :param max_errors: if given and positive, recording this many errors raises TooManyErrors
+        :param listener: if given, called with each issue as soon as it is recorded
+        """
         self._log = []
+        # every issue is also indexed by its level, so that counting or listing one level doesn't scan the log
+        self._by_level = {WARNING: [], ERROR: []}
+        self._max_errors = max_errors if max_errors is not None and max_errors > 0 else None
+        self._limit_reached = False
+        self._listener = listener
 
     @property
     def issues(self): return self._log
 
+    # like issues, these are the log's own lists rather than copies, so they are cheap to look at but not to be changed
+
     @property
-    def warnings(self): return list(filter(lambda issue: issue.level == WARNING, self.issues))
+    def warnings(self): return self._by_level[WARNING]
 
     @property
-    def errors(self): return list(filter(lambda issue: issue.level == ERROR, self.issues))
+    def errors(self): return self._by_level[ERROR]
 
-    def warning(self, source_pos, message, *args):
+    @property
+    def warning_count(self): return len(self._by_level[WARNING])
+
+    @property
+    def error_count(self): return len(self._by_level[ERROR])
+
+    @property
+    def max_errors(self): return self._max_errors
+
+    @property
+    def limit_reached(self):
+        """whether assembly was stopped early because max_errors was reached"""
+        return self._limit_reached
+
+    def warning(self, source_pos, message, *args, code=None):
         """
         emits a warning to the issue log
         :param source_pos: the position in the source that the warning refers to
         :param message: a description of the issue
         :param args: arguments to be forwarded to message.format(*args)
+        :param code: the stable identifier of this kind of warning
         """
-        self._log.append(
-            Issue(WARNING, source_pos, message.format(*args))
-        )
+        self._record(Issue(WARNING, source_pos, message, args, code))
 
-    def error(self, source_pos, message, *args):
+    def error(self, source_pos, message, *args, code=None):
         """
         emits an error to the issue log
         :param source_pos: the position in the source that the error refers to
         :param message: a description of the issue
         :param args: arguments to be forwarded to message.format(*args)
+        :param code: the stable identifier of this kind of error
         """
-        self._log.append(
-            Issue(ERROR, source_pos, message.format(*args))
-        )
+        self._record(Issue(ERROR, source_pos, message, args, code))
+
+    def extend(self, issues):
+        """
+        records issues that were collected elsewhere, such as in a cache of previously parsed files
+        :param issues: the issues to add to this log, in order
+        """
+        for issue in issues:
+            self._record(issue)
+
+    def _record(self, issue):
+        self._log.append(issue)
+        by_level = self._by_level.get(issue.level, None)
+        if by_level is None:
+            by_level = self._by_level[issue.level] = []
+        by_level.append(issue)
+        if self._listener is not None:
+            self._listener(issue)
+
+        if issue.level == ERROR and self._max_errors is not None and len(by_level) >= self._max_errors:
+            self._limit_reached = True
+            raise TooManyErrors(self._max_errors)
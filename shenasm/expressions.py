@@ -0,0 +1,215 @@
+import re
+import typing
+
+
+from .errors import IssueLog
+from .parse import Instruction
+from .sim import clamp, digit_of, set_digit
+from . import codes
+
+
+# the range of integers SHENZHEN I/O allows a constant to hold
+VALUE_MIN = -999
+VALUE_MAX = 999
+
+# integers, names, operators and brackets, separated by any amount of whitespace
+_TOKEN_PATTERN = re.compile(r"\s*(?:(\d+)|([A-Za-z_][\w.]*)|(\S))")
+
+# the functions expressions can call, by name and number of arguments, these match what the chip's
+# instructions of the same name do
+FUNCTIONS = {
+    'dgt': (2, digit_of),
+    'dst': (3, set_digit),
+    'clamp': (1, clamp),
+}
+
+
+class ExpressionError(Exception):
+    """
+    a constant expression that can't be evaluated, code is the issue code to report it with
+    """
+
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+
+class _DependencyFailed(Exception):
+    """a constant depends on another that has already had its error reported"""
+
+
+def tokenise(text: str) -> [str]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_PATTERN.match(text, position)
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+
+class _ExpressionParser(object):
+    """
+    evaluates an expression as it parses it, by recursive descent:
+
+        expression := term (('+' | '-') term)*
+        term       := unary (('*' | '/' | '%') unary)*
+        unary      := ('-' | '+') unary | primary
+        primary    := integer | name | name '(' expression (',' expression)* ')' | '(' expression ')'
+    """
+
+    def __init__(self, tokens: [str], lookup: typing.Callable[[str], int]):
+        self._tokens = tokens
+        self._position = 0
+        self._lookup = lookup
+
+    def parse(self) -> int:
+        if not self._tokens:
+            raise ExpressionError("expected a value", codes.INVALID_EXPRESSION)
+        value = self._expression()
+        if self._position < len(self._tokens):
+            raise ExpressionError("unexpected '{}'".format(self._tokens[self._position]), codes.INVALID_EXPRESSION)
+        return value
+
+    def _peek(self) -> typing.Optional[str]:
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+    def _take(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise ExpressionError("expression ends too soon", codes.INVALID_EXPRESSION)
+        self._position += 1
+        return token
+
+    def _expect(self, expected):
+        token = self._take()
+        if token != expected:
+            raise ExpressionError("expected '{}' but found '{}'".format(expected, token), codes.INVALID_EXPRESSION)
+
+    def _expression(self) -> int:
+        value = self._term()
+        while self._peek() in ('+', '-'):
+            if self._take() == '+':
+                value += self._term()
+            else:
+                value -= self._term()
+        return value
+
+    def _term(self) -> int:
+        value = self._unary()
+        while self._peek() in ('*', '/', '%'):
+            operator = self._take()
+            operand = self._unary()
+            if operator == '*':
+                value *= operand
+                continue
+            if operand == 0:
+                raise ExpressionError("division by zero", codes.INVALID_EXPRESSION)
+            # both round towards zero, so that negating an operand only negates the result
+            quotient = abs(value) // abs(operand) * (1 if (value < 0) == (operand < 0) else -1)
+            value = quotient if operator == '/' else value - quotient * operand
+        return value
+
+    def _unary(self) -> int:
+        if self._peek() == '-':
+            self._take()
+            return -self._unary()
+        if self._peek() == '+':
+            self._take()
+            return self._unary()
+        return self._primary()
+
+    def _primary(self) -> int:
+        token = self._take()
+        if token == '(':
+            value = self._expression()
+            self._expect(')')
+            return value
+        if token.isdigit():
+            return int(token)
+        if not (token[0].isalpha() or token[0] == '_'):
+            raise ExpressionError("unexpected '{}'".format(token), codes.INVALID_EXPRESSION)
+        if self._peek() != '(':
+            return self._lookup(token)
+
+        function = FUNCTIONS.get(token, None)
+        if function is None:
+            raise ExpressionError("unknown function '{}'".format(token), codes.INVALID_EXPRESSION)
+        arity, implementation = function
+        self._take()
+        args = [self._expression()]
+        while self._peek() == ',':
+            self._take()
+            args.append(self._expression())
+        self._expect(')')
+        if len(args) != arity:
+            raise ExpressionError(
+                "{} takes {} arguments but was given {}".format(token, arity, len(args)), codes.INVALID_EXPRESSION
+            )
+        return implementation(*args)
+
+
+class ConstantTable(object):
+    """
+    evaluates constant expressions, each constant is evaluated at most once and those it refers to are
+    evaluated first, whatever order they were defined in
+    """
+
+    def __init__(self, issues: IssueLog, definitions: typing.Dict[str, Instruction]):
+        """
+        :param issues: where errors in the expressions are reported, once for each constant
+        :param definitions: the const instruction defining each constant, by name
+        """
+        self._issues = issues
+        self._definitions = definitions
+        self._values = {}
+        # constants whose expressions are being evaluated, in the order they were started, to catch cycles
+        self._evaluating = []
+
+    def value(self, name: str) -> typing.Optional[int]:
+        """
+        :return: the value of a constant, or None if its expression (or one it refers to) has an error
+        """
+        try:
+            return self._evaluate(name)
+        except _DependencyFailed:
+            return None
+
+    def _evaluate(self, name: str) -> int:
+        if name in self._values:
+            if self._values[name] is None:
+                raise _DependencyFailed()
+            return self._values[name]
+
+        definition = self._definitions[name]
+        self._evaluating.append(name)
+        try:
+            value = _ExpressionParser(tokenise(" ".join(definition.args[1:])), self._lookup).parse()
+            if not (VALUE_MIN <= value <= VALUE_MAX):
+                raise ExpressionError(
+                    "integer constants must be between {} and {} inclusive, {} is {}".format(
+                        VALUE_MIN, VALUE_MAX, name, value
+                    ),
+                    codes.CONSTANT_OUT_OF_RANGE
+                )
+        except ExpressionError as error:
+            self._values[name] = None
+            self._issues.error(definition.source_pos, "invalid constant {}: {}", name, error, code=error.code)
+            raise _DependencyFailed()
+        except _DependencyFailed:
+            self._values[name] = None
+            raise
+        finally:
+            self._evaluating.pop()
+
+        self._values[name] = value
+        return value
+
+    def _lookup(self, name: str) -> int:
+        if name in self._evaluating:
+            cycle = self._evaluating[self._evaluating.index(name):] + [name]
+            raise ExpressionError("defined in terms of itself: {}".format(" -> ".join(cycle)), codes.CIRCULAR_CONSTANTS)
+        if name not in self._definitions:
+            raise ExpressionError("'{}' is not a constant".format(name), codes.UNKNOWN_CONSTANT)
+        return self._evaluate(name)
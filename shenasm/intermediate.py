@@ -1,3 +1,4 @@
+from collections import OrderedDict, deque
 import typing
 import uuid
 
@@ -5,6 +6,7 @@ import uuid
 from .instructions import CHIP_OP_TEQ, CHIP_OP_TGT, CHIP_OP_TLT, CHIP_OP_TCP, CHIP_OP_JMP
 from .parse import Instruction
 from .errors import IssueLog
+from . import codes
 from . import log
 
 
@@ -31,20 +33,34 @@ class IntermediateNode(object):
         return self.instructions[-1]
 
     def is_orphan(self, entry_node):
-        orphaned = False
+        """
+        checks whether this node can be reached from the entry node by walking incoming edges backwards,
+        prefer IntermediateGraph.is_reachable when checking many nodes as it answers from a cached set
+        """
+        if self is entry_node:
+            return False
+
+        visited = {id(self)}
+        to_check = deque(self.incoming)
+        while len(to_check) > 0:
+            ancestor = to_check.popleft()
+            if ancestor is entry_node:
+                return False
+            if id(ancestor) in visited:
+                continue
+            visited.add(id(ancestor))
+            to_check.extend(ancestor.incoming)
+
+        return True
 
-        if self is not entry_node:
-            orphaned = True
-
-            to_check = [] + self.incoming
-            while len(to_check) > 0:
-                ancestor = to_check.pop(0)
-                if ancestor is entry_node:
-                    orphaned = False
-                    break
-                to_check.extend(ancestor.incoming)
-
-        return orphaned
+    @property
+    def successors(self):
+        """the distinct nodes execution can go to after this one, in exit order"""
+        result = []
+        for target in self.exits.values():
+            if not any(target is seen for seen in result):
+                result.append(target)
+        return result
 
     @staticmethod
     def create_child_of(incoming: ['IntermediateNode'], exit_key: str, instructions: [Instruction]):
@@ -53,7 +69,236 @@ class IntermediateNode(object):
         return result
 
 
-def build_ir_graph(issues: IssueLog, instructions: [Instruction]):
+class Loop(object):
+    """a natural loop in the IR graph: a header node that dominates every node in the loop's body"""
+
+    def __init__(self, header: IntermediateNode, body: typing.Set[IntermediateNode]):
+        self.header = header
+        self.body = body
+        self.parent = None
+        self.children = []
+
+    @property
+    def depth(self):
+        depth = 1
+        loop = self.parent
+        while loop is not None:
+            depth += 1
+            loop = loop.parent
+        return depth
+
+
+class IntermediateGraph(object):
+    """
+    the IR nodes of a program along with analyses over them (reachability, dominators, loops),
+    each analysis is computed on first use and cached, call invalidate() after changing the graph
+    """
+
+    def __init__(self, nodes: [IntermediateNode], symbols: typing.Dict[str, str] = None):
+        self.nodes = nodes
+        self._symbols = symbols if symbols is not None else {}
+        self.invalidate()
+
+    @property
+    def symbols(self) -> typing.Dict[str, str]:
+        """what each alias and const named in the nodes' instructions stands for"""
+        return self._symbols
+
+    def invalidate(self):
+        self._reverse_postorder = None
+        self._reachable = None
+        self._idom = None
+        self._dom_interval = None
+        self._loops = None
+        self._innermost_loop = None
+
+    @property
+    def entry(self):
+        return self.nodes[0] if len(self.nodes) > 0 else None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __getitem__(self, index):
+        return self.nodes[index]
+
+    @property
+    def reverse_postorder(self) -> [IntermediateNode]:
+        """the reachable nodes in reverse postorder of a depth first search from the entry"""
+        if self._reverse_postorder is None:
+            self._analyse_reachability()
+        return self._reverse_postorder
+
+    @property
+    def reachable(self) -> typing.Set[IntermediateNode]:
+        if self._reachable is None:
+            self._analyse_reachability()
+        return self._reachable
+
+    def is_reachable(self, node: IntermediateNode):
+        return node in self.reachable
+
+    def immediate_dominator(self, node: IntermediateNode) -> typing.Optional[IntermediateNode]:
+        """
+        :return: the closest node every path from the entry to node must pass through,
+                 None for the entry and unreachable nodes
+        """
+        if self._idom is None:
+            self._analyse_dominators()
+        return self._idom.get(node, None)
+
+    def dominates(self, a: IntermediateNode, b: IntermediateNode):
+        """whether every path from the entry to b passes through a (a node dominates itself)"""
+        if self._dom_interval is None:
+            self._analyse_dominators()
+        a_interval = self._dom_interval.get(a, None)
+        b_interval = self._dom_interval.get(b, None)
+        if a_interval is None or b_interval is None:
+            return False
+        return a_interval[0] <= b_interval[0] and b_interval[1] <= a_interval[1]
+
+    @property
+    def loops(self) -> [Loop]:
+        """every natural loop, a loop always comes before any loop nested inside it"""
+        if self._loops is None:
+            self._analyse_loops()
+        return self._loops
+
+    def innermost_loop(self, node: IntermediateNode) -> typing.Optional[Loop]:
+        if self._loops is None:
+            self._analyse_loops()
+        return self._innermost_loop.get(node, None)
+
+    def loop_depth(self, node: IntermediateNode):
+        loop = self.innermost_loop(node)
+        return loop.depth if loop is not None else 0
+
+    def _analyse_reachability(self):
+        # iterative depth first search, so that large generated programs don't hit the recursion limit
+        postorder = []
+        reachable = set()
+        entry = self.entry
+        if entry is not None:
+            reachable.add(entry)
+            stack = [(entry, iter(entry.successors))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if child not in reachable:
+                        reachable.add(child)
+                        stack.append((child, iter(child.successors)))
+                        break
+                else:
+                    stack.pop()
+                    postorder.append(node)
+        postorder.reverse()
+        self._reverse_postorder = postorder
+        self._reachable = reachable
+
+    def _analyse_dominators(self):
+        # the iterative algorithm from Cooper, Harvey and Kennedy's "A Simple, Fast Dominance Algorithm",
+        # working on reverse postorder numbers so intersecting two dominator chains is cheap
+        order = self.reverse_postorder
+        number = {node: index for index, node in enumerate(order)}
+        idom = [None] * len(order)
+        if len(order) > 0:
+            idom[0] = 0
+
+        def intersect(a, b):
+            while a != b:
+                while a > b:
+                    a = idom[a]
+                while b > a:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for index in range(1, len(order)):
+                new_idom = None
+                for predecessor in order[index].incoming:
+                    predecessor_number = number.get(predecessor, None)
+                    if predecessor_number is None or idom[predecessor_number] is None:
+                        continue
+                    new_idom = predecessor_number if new_idom is None else intersect(predecessor_number, new_idom)
+                if new_idom is not None and idom[index] != new_idom:
+                    idom[index] = new_idom
+                    changed = True
+
+        self._idom = {
+            order[index]: order[idom[index]]
+            for index in range(1, len(order))
+        }
+
+        # number the dominator tree so that dominance checks are an interval containment test
+        children = {node: [] for node in order}
+        for node, parent in self._idom.items():
+            children[parent].append(node)
+        intervals = {}
+        counter = 0
+        if len(order) > 0:
+            stack = [(order[0], False)]
+            while stack:
+                node, finished = stack.pop()
+                if finished:
+                    intervals[node] = (intervals[node], counter)
+                    counter += 1
+                    continue
+                intervals[node] = counter
+                counter += 1
+                stack.append((node, True))
+                stack.extend((child, False) for child in children[node])
+        self._dom_interval = intervals
+
+    def _analyse_loops(self):
+        # every edge to a node that dominates its source is a back edge, and its target the header of a loop
+        bodies = OrderedDict()
+        for node in self.reverse_postorder:
+            for successor in node.successors:
+                if self.dominates(successor, node):
+                    body = bodies.setdefault(successor, {successor})
+                    # the loop body is everything that reaches the back edge without going through the header
+                    to_check = [node]
+                    while to_check:
+                        member = to_check.pop()
+                        if member in body:
+                            continue
+                        body.add(member)
+                        to_check.extend(
+                            predecessor for predecessor in member.incoming
+                            if predecessor in self.reachable
+                        )
+
+        # sort outermost first, a loop's parent is then the smallest earlier loop containing its header
+        loops = sorted(
+            (Loop(header, body) for header, body in bodies.items()),
+            key=lambda loop: len(loop.body),
+            reverse=True
+        )
+        innermost = {}
+        for loop in loops:
+            loop.parent = innermost.get(loop.header, None)
+            if loop.parent is not None:
+                loop.parent.children.append(loop)
+            for member in loop.body:
+                innermost[member] = loop
+
+        self._loops = loops
+        self._innermost_loop = innermost
+
+
+def build_ir_graph(issues: IssueLog, instructions: [Instruction],
+                   symbols: typing.Dict[str, str] = None) -> IntermediateGraph:
+    """
+    :param issues: where to report jumps to labels that don't exist
+    :param instructions: the program's instructions
+    :param symbols: the value of each alias and const, for analyses that need to see through them
+    :return: the program divided into regions with the ways execution can flow between them
+    """
     # first divide the program into 'regions', each region consists of
     # a group of instructions that can always execute together:
     #  - adjacent unconditional instructions (except when a label is involved)
@@ -91,9 +336,27 @@ def build_ir_graph(issues: IssueLog, instructions: [Instruction]):
             label_to_region[label_without_trailing_colon] = region
             log.verbose("label '{}' points to region {}".format(first_instruction.label, region.uid))
 
+    # for every position in the region list, record the first region at or after it that starts with a
+    # positive, negative or no condition, built in one backwards pass so that finding where each region
+    # can go next is a constant time lookup rather than a scan over the rest of the program
+    region_count = len(regions)
+    next_positive = [None] * (region_count + 1)
+    next_negative = [None] * (region_count + 1)
+    next_unconditional = [None] * (region_count + 1)
+    for index in range(region_count - 1, -1, -1):
+        next_positive[index] = next_positive[index + 1]
+        next_negative[index] = next_negative[index + 1]
+        next_unconditional[index] = next_unconditional[index + 1]
+        condition = regions[index].first_instruction.condition
+        if condition == TRUE_CONDITIONAL:
+            next_positive[index] = index
+        elif condition == FALSE_CONDITIONAL:
+            next_negative[index] = index
+        elif condition is None:
+            next_unconditional[index] = index
+
     # now go through each ir node and work out what its 'children' (exits) are (where could execution go next?)
-    for index in range(len(regions)):
-        after = regions[index+1:]
+    for index in range(region_count):
         current = regions[index]
 
         # jump instructions are treated specially, they always just go where they say
@@ -102,17 +365,16 @@ def build_ir_graph(issues: IssueLog, instructions: [Instruction]):
             target = label_to_region.get(target_label, None)
 
             if target is None:
-                issues.error(current.instructions[-1].source_pos, "jump to non-existent label '{}'", target_label)
+                issues.error(
+                    current.instructions[-1].source_pos, "jump to non-existent label '{}'", target_label,
+                    code=codes.UNKNOWN_LABEL
+                )
             else:
                 current.exits[UNCONDITIONAL] = target
                 target.incoming.append(current)
         # every other instruction will go to whatever next instruction makes sense based on
         # the current and subsequent instructions' condition flags
         else:
-            first_positive_condition = None
-            first_negative_condition = None
-            first_unconditional = None
-
             # there can only be a positive branch if we aren't in a negative branch, because by definition we know
             # the test register is negative in that case, UNLESS the instruction is a test!
             can_branch_positive = current.first_instruction.condition != '-' or is_test_instruction(current.first_instruction)
@@ -120,23 +382,32 @@ def build_ir_graph(issues: IssueLog, instructions: [Instruction]):
             # the test register is positive in that case, UNLESS the instruction is a test!
             can_branch_negative = current.first_instruction.condition != '+' or is_test_instruction(current.first_instruction)
 
-            # find the first positive and negative conditional instructions, but stop looking if you find
-            # an unconditional instruction first.
-            for inner_region in after:
-                # only look for positive conditional instructions if we can branch positively and haven't found one yet
-                if can_branch_positive and first_positive_condition is None and inner_region.first_instruction.condition == '+':
-                    first_positive_condition = inner_region
-                # only look for negative conditional instructions if we can branch negatively and haven't found one yet
-                elif can_branch_negative and first_negative_condition is None and inner_region.first_instruction.condition == '-':
-                    first_negative_condition = inner_region
-                # if we find an unconditional instruction stop
-                elif inner_region.first_instruction.condition is None:
-                    first_unconditional = inner_region
-                    break
-
-                # if we've found both a positive and negative conditional instruction then we can stop
-                if None not in (first_positive_condition, first_negative_condition):
-                    break
+            # find the first positive and negative conditional regions after this one, but only those
+            # that come before the first unconditional region
+            unconditional_index = next_unconditional[index + 1]
+            positive_index = next_positive[index + 1] if can_branch_positive else None
+            negative_index = next_negative[index + 1] if can_branch_negative else None
+            if unconditional_index is not None:
+                if positive_index is not None and positive_index > unconditional_index:
+                    positive_index = None
+                if negative_index is not None and negative_index > unconditional_index:
+                    negative_index = None
+            else:
+                # execution runs off the end of the program and wraps around to the top,
+                # so carry on looking from the first region
+                unconditional_index = next_unconditional[0]
+                if can_branch_positive and positive_index is None:
+                    positive_index = next_positive[0]
+                    if unconditional_index is not None and positive_index is not None and positive_index > unconditional_index:
+                        positive_index = None
+                if can_branch_negative and negative_index is None:
+                    negative_index = next_negative[0]
+                    if unconditional_index is not None and negative_index is not None and negative_index > unconditional_index:
+                        negative_index = None
+
+            first_positive_condition = regions[positive_index] if positive_index is not None else None
+            first_negative_condition = regions[negative_index] if negative_index is not None else None
+            first_unconditional = regions[unconditional_index] if unconditional_index is not None else None
 
             # identify what regions we can branch to based on our search
             true_target, false_target = None, None
@@ -162,10 +433,21 @@ def build_ir_graph(issues: IssueLog, instructions: [Instruction]):
                     current.exits[condition] = false_target
                     false_target.incoming.append(current)
 
-    return regions
+    return IntermediateGraph(regions, symbols)
+
+
+def heat_colour(fraction: float) -> str:
+    """:return: a colour from pale yellow for 0 to red for 1"""
+    cool = (0xff, 0xff, 0xcc)
+    hot = (0xe3, 0x1a, 0x1c)
+    return "#" + "".join("{:02x}".format(int(round(c + (h - c) * fraction))) for c, h in zip(cool, hot))
 
 
-def output_ir_dotfile(path, ir_nodes):
+def output_ir_dotfile(path, ir_nodes: IntermediateGraph, coverage: typing.Dict[IntermediateNode, typing.Any] = None):
+    """
+    :param coverage: if given, the result of shenasm.coverage.Coverage.regions(), regions are then coloured by
+                     the power spent in them and labelled with how often they ran
+    """
     dotfile = open(path, 'w')
 
     def dot(x, *args):
@@ -187,7 +469,8 @@ def output_ir_dotfile(path, ir_nodes):
     dot("  ratio = fill;")
     dot("  node [style=filled];")
     dot("")
-    dot("  ENTRY -> {};", node2name(ir_nodes[0]))
+    if ir_nodes.entry is not None:
+        dot("  ENTRY -> {};", node2name(ir_nodes.entry))
     for region in ir_nodes:
         for transition_type, target in region.exits.items():
             colour = black
@@ -201,7 +484,7 @@ def output_ir_dotfile(path, ir_nodes):
                     label = "false"
             elif is_jump_instruction(region.instructions[-1]):
                 colour = jump_colour
-            if region.is_orphan(ir_nodes[0]):
+            if not ir_nodes.is_reachable(region):
                 colour = orphan_colour
             dot("  {} -> {} [label=\"{}\" color=\"{}\"];".format(
                 node2name(region),
@@ -213,9 +496,22 @@ def output_ir_dotfile(path, ir_nodes):
     dot("")
 
     dot("  ENTRY;")
+    hottest = max((covered.power for covered in coverage.values()), default=0) if coverage is not None else 0
     for region in ir_nodes:
         colour = unconditional_colour
-        if region.is_orphan(ir_nodes[0]):
+        if coverage is not None:
+            covered = coverage.get(region, None)
+            runs = covered.runs if covered is not None else 0
+            colour = heat_colour(covered.power / hottest) if runs > 0 and hottest > 0 else orphan_colour
+            dot("  {} [label=\"{}\" color=\"{}\" shape=rectangle labeljust=l];".format(
+                node2name(region),
+                "\\l".join(map(str, region.instructions)) + "\\l" + (
+                    "ran {} times, {} power\\l".format(runs, covered.power) if runs > 0 else "never ran\\l"
+                ),
+                colour
+            ))
+            continue
+        if not ir_nodes.is_reachable(region):
             colour = orphan_colour
         elif is_jump_instruction(region.instructions[-1]):
             colour = jump_colour
@@ -232,15 +528,15 @@ def output_ir_dotfile(path, ir_nodes):
     dot("}}")
 
 
-def warn_unused_code(issues, ir_nodes):
-    entry_node = ir_nodes[0]
-    for node in ir_nodes[1:]:
-        if node.is_orphan(entry_node):
+def warn_unused_code(issues, ir_nodes: IntermediateGraph):
+    for node in ir_nodes:
+        if not ir_nodes.is_reachable(node):
             issues.warning(
                 node.instructions[0].source_pos,
                 "unreachable instructions between lines {} and {}?",
                 node.instructions[0].source_pos.line,
-                node.instructions[-1].source_pos.line
+                node.instructions[-1].source_pos.line,
+                code=codes.UNREACHABLE_CODE
             )
 
 
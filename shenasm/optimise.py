@@ -0,0 +1,521 @@
+from collections import deque
+import typing
+
+
+from .instructions import CHIP_OP_JMP, CHIP_OP_MOV, CHIP_OP_SLP, CHIP_OP_ADD, CHIP_OP_SUB, CHIP_OP_MUL, \
+    CHIP_OP_NOT, CHIP_OP_DGT, CHIP_OP_DST, CHIP_OP_GEN, CHIP_OP_TEQ, CHIP_OP_TGT, CHIP_OP_TLT, CHIP_OP_TCP
+from .chips import ChipInfo, REG_TYPE_XBUS
+from .parse import Instruction
+from .sim import clamp, digit_of, set_digit, SIMPLE_MAX
+from . import log
+
+
+# the states the test flag can be in, as bits so that a set of possible states is a mask
+FLAG_PLUS = 1
+FLAG_MINUS = 2
+FLAG_NONE = 4
+
+CONDITION_FLAGS = {
+    '+': FLAG_PLUS,
+    '-': FLAG_MINUS,
+}
+
+TEST_INSTRUCTIONS = (CHIP_OP_TEQ, CHIP_OP_TGT, CHIP_OP_TLT, CHIP_OP_TCP)
+
+# instructions that always write their result to acc
+ACC_WRITING_INSTRUCTIONS = (CHIP_OP_ADD, CHIP_OP_SUB, CHIP_OP_MUL, CHIP_OP_NOT, CHIP_OP_DGT, CHIP_OP_DST)
+
+# the internal registers, whose values only change when this chip's own instructions write them
+INTERNAL_REGISTERS = ('acc', 'dat')
+
+# the positions of the arguments each instruction reads a value from
+SOURCE_ARGS = {
+    CHIP_OP_MOV: (0,),
+    CHIP_OP_SLP: (0,),
+    CHIP_OP_ADD: (0,),
+    CHIP_OP_SUB: (0,),
+    CHIP_OP_MUL: (0,),
+    CHIP_OP_DGT: (0,),
+    CHIP_OP_DST: (0, 1),
+    CHIP_OP_TEQ: (0, 1),
+    CHIP_OP_TGT: (0, 1),
+    CHIP_OP_TLT: (0, 1),
+    CHIP_OP_TCP: (0, 1),
+    CHIP_OP_GEN: (1, 2),
+}
+
+# both internal registers hold zero when the chip starts
+INITIAL_VALUES = {'acc': 0, 'dat': 0}
+
+# optimisations can enable each other, but give up rather than go round forever if they keep finding work
+MAX_ROUNDS = 20
+
+
+def optimise_program(instructions: [Instruction], chip: ChipInfo) -> [Instruction]:
+    """
+    shrinks an assembled program without changing what it does, by repeatedly:
+      - removing instructions that can never run, because they are unreachable or their condition can never hold
+      - making conditional instructions whose condition always holds unconditional
+      - removing tests whose result is never used
+      - removing a test that repeats the one before it when nothing it reads has changed
+      - removing jumps to the next instruction
+      - replacing reads of acc and dat with their values where those are always the same, and instructions whose
+        result is always the same with a mov of it
+      - removing writes to acc and dat that are never read, or that write the value already there
+    labels of removed instructions are moved to the next instruction, and labels no jump refers to are dropped
+    :param instructions: the output of assembly, with symbols replaced by their values
+    :param chip: the chip the program is for, to know which registers are XBus pins
+    :return: the optimised program
+    """
+    program = list(instructions)
+    # without knowing where a jump goes nothing can be proven about the code around it, so leave it alone
+    labels = set(label_name(instruction) for instruction in program if instruction.label is not None)
+    if any(instruction.mnemonic == CHIP_OP_JMP and instruction.args and instruction.args[0] not in labels
+           for instruction in program):
+        log.verbose("not optimising a program that jumps to missing labels")
+        return program
+
+    passes = (
+        _remove_unexecuted_instructions,
+        _remove_unused_tests,
+        _remove_repeated_tests,
+        _remove_jumps_to_next,
+        _propagate_constants,
+        _remove_dead_writes,
+    )
+    for _ in range(MAX_ROUNDS):
+        changed = False
+        for optimisation in passes:
+            replacements = optimisation(program, chip)
+            if replacements:
+                program = _rebuild(program, replacements)
+                changed = True
+        if not changed:
+            break
+    program = _rebuild(program, {})
+    log.verbose("optimisation took the program from {} to {} lines".format(len(instructions), len(program)))
+    return program
+
+
+def label_name(instruction: Instruction) -> typing.Optional[str]:
+    return instruction.label[:-1] if instruction.label is not None else None
+
+
+def literal_value(arg: str) -> typing.Optional[int]:
+    """:return: the value of an operand known without running the program, None if it isn't known"""
+    if arg == 'null':
+        return 0
+    try:
+        # the chip clamps literals just as it does results
+        return clamp(int(arg))
+    except ValueError:
+        return None
+
+
+def operand_value(arg: str, values: typing.Dict[str, typing.Optional[int]]) -> typing.Optional[int]:
+    """:return: the value of an operand given the known values of the internal registers, None if it isn't known"""
+    if arg in values:
+        return values[arg]
+    return literal_value(arg)
+
+
+def evaluate(instruction: Instruction, values: typing.Dict[str, typing.Optional[int]]) -> \
+        typing.Dict[str, typing.Optional[int]]:
+    """
+    :param values: the value of each internal register before the instruction runs, None where it isn't known
+    :return: the values of the internal registers after the instruction runs
+    """
+    result = dict(values)
+    register = written_register(instruction)
+    if register not in result:
+        return result
+
+    args = [operand_value(arg, values) for arg in instruction.args]
+    acc = values['acc']
+    if instruction.mnemonic == CHIP_OP_MOV:
+        result[register] = args[0]
+    elif acc is None or None in args:
+        result[register] = None
+    elif instruction.mnemonic == CHIP_OP_ADD:
+        result[register] = clamp(acc + args[0])
+    elif instruction.mnemonic == CHIP_OP_SUB:
+        result[register] = clamp(acc - args[0])
+    elif instruction.mnemonic == CHIP_OP_MUL:
+        result[register] = clamp(acc * args[0])
+    elif instruction.mnemonic == CHIP_OP_NOT:
+        result[register] = SIMPLE_MAX if acc == 0 else 0
+    elif instruction.mnemonic == CHIP_OP_DGT:
+        result[register] = digit_of(acc, args[0])
+    else:
+        result[register] = set_digit(acc, args[0], args[1])
+    return result
+
+
+def read_registers(instruction: Instruction) -> typing.Set[str]:
+    """:return: the internal registers an instruction reads"""
+    result = set(
+        instruction.args[index] for index in SOURCE_ARGS.get(instruction.mnemonic, ())
+        if index < len(instruction.args) and instruction.args[index] in INTERNAL_REGISTERS
+    )
+    # arithmetic works on acc
+    if instruction.mnemonic in ACC_WRITING_INSTRUCTIONS:
+        result.add('acc')
+    return result
+
+
+def test_outcome(instruction: Instruction) -> int:
+    """:return: the mask of flag states a test instruction can leave behind"""
+    unknown = FLAG_PLUS | FLAG_MINUS | FLAG_NONE if instruction.mnemonic == CHIP_OP_TCP else FLAG_PLUS | FLAG_MINUS
+    if len(instruction.args) != 2:
+        return unknown
+
+    a, b = instruction.args
+    a_value, b_value = literal_value(a), literal_value(b)
+    if a_value is None or b_value is None:
+        # comparing an internal register with itself always gives the same answer
+        if a == b and a in INTERNAL_REGISTERS:
+            a_value = b_value = 0
+        else:
+            return unknown
+
+    if instruction.mnemonic == CHIP_OP_TEQ:
+        return FLAG_PLUS if a_value == b_value else FLAG_MINUS
+    if instruction.mnemonic == CHIP_OP_TGT:
+        return FLAG_PLUS if a_value > b_value else FLAG_MINUS
+    if instruction.mnemonic == CHIP_OP_TLT:
+        return FLAG_PLUS if a_value < b_value else FLAG_MINUS
+    # tcp sets neither flag when its operands are equal
+    if a_value == b_value:
+        return FLAG_NONE
+    return FLAG_PLUS if a_value > b_value else FLAG_MINUS
+
+
+def written_register(instruction: Instruction) -> typing.Optional[str]:
+    """:return: the register an instruction writes to, if any"""
+    if instruction.mnemonic == CHIP_OP_MOV and len(instruction.args) == 2:
+        return instruction.args[1]
+    if instruction.mnemonic in ACC_WRITING_INSTRUCTIONS:
+        return 'acc'
+    if instruction.mnemonic == CHIP_OP_GEN and len(instruction.args) > 0:
+        return instruction.args[0]
+    return None
+
+
+def has_side_effects(instruction: Instruction, chip: ChipInfo) -> bool:
+    """whether an instruction that only reads does anything else when it runs, reading an XBus pin consumes its data"""
+    for arg in instruction.args:
+        register = chip.registers.get(arg, None)
+        if register is not None and register.type == REG_TYPE_XBUS:
+            return True
+    return False
+
+
+class _ControlFlow(object):
+    """where execution can go after each instruction, running off the end wraps around to the top"""
+
+    def __init__(self, program: [Instruction]):
+        count = len(program)
+        self.labels = {
+            label_name(instruction): index
+            for index, instruction in enumerate(program) if instruction.label is not None
+        }
+        # each edge is (target, taken only when the instruction runs, taken only when it doesn't)
+        self.edges = []
+        for index, instruction in enumerate(program):
+            following = (index + 1) % count
+            if instruction.mnemonic == CHIP_OP_JMP:
+                target = self.labels.get(instruction.args[0], None) if instruction.args else None
+                edges = []
+                if target is not None:
+                    edges.append((target, True))
+                if instruction.condition is not None:
+                    edges.append((following, False))
+                self.edges.append(edges)
+            else:
+                self.edges.append([(following, None)])
+
+        self.predecessors = [[] for _ in program]
+        for index, edges in enumerate(self.edges):
+            for target, _ in edges:
+                self.predecessors[target].append(index)
+
+    def flag_states(self, program: [Instruction]) -> [int]:
+        """
+        :return: for every instruction, the mask of flag states execution can arrive at it with (whether or not it
+                 then runs), zero if it can't be reached at all
+        """
+        states = [0] * len(program)
+        if not program:
+            return states
+        # neither flag is set when the chip starts
+        states[0] = FLAG_NONE
+        to_visit = deque([0])
+        while to_visit:
+            index = to_visit.popleft()
+            instruction = program[index]
+            state = states[index]
+
+            condition_flag = CONDITION_FLAGS.get(instruction.condition, None)
+            if condition_flag is not None:
+                runs, skips = state & condition_flag, state & ~condition_flag
+            elif instruction.condition is not None:
+                # @ instructions run the first time they are reached and are skipped after that
+                runs, skips = state, state
+            else:
+                runs, skips = state, 0
+
+            after = skips
+            if instruction.mnemonic in TEST_INSTRUCTIONS:
+                if runs:
+                    after |= test_outcome(instruction)
+            else:
+                after |= runs
+
+            for target, taken_when_run in self.edges[index]:
+                if taken_when_run is None:
+                    arriving = after
+                else:
+                    arriving = runs if taken_when_run else skips
+                if arriving & ~states[target]:
+                    states[target] |= arriving
+                    to_visit.append(target)
+        return states
+
+    def flag_live_after(self, program: [Instruction]) -> [bool]:
+        """:return: for every instruction, whether the flag might be read before it is next set"""
+        count = len(program)
+        reads = [CONDITION_FLAGS.get(instruction.condition, None) is not None for instruction in program]
+        sets = [
+            instruction.mnemonic in TEST_INSTRUCTIONS and instruction.condition is None
+            for instruction in program
+        ]
+        live_in = [False] * count
+        live_out = [False] * count
+        to_visit = deque(range(count))
+        while to_visit:
+            index = to_visit.popleft()
+            live_out[index] = any(live_in[target] for target, _ in self.edges[index])
+            new_live_in = reads[index] or (live_out[index] and not sets[index])
+            if new_live_in and not live_in[index]:
+                live_in[index] = True
+                to_visit.extend(self.predecessors[index])
+        return live_out
+
+    def register_values(self, program: [Instruction]) -> [typing.Optional[typing.Dict[str, typing.Optional[int]]]]:
+        """
+        :return: for every instruction, the values the internal registers can arrive at it with, None for registers
+                 that can arrive with different values, or None in place of the values if it can't be reached at all
+        """
+        states = [None] * len(program)
+        if not program:
+            return states
+        states[0] = dict(INITIAL_VALUES)
+        to_visit = deque([0])
+        while to_visit:
+            index = to_visit.popleft()
+            instruction = program[index]
+            state = states[index]
+
+            after = evaluate(instruction, state)
+            if instruction.condition is not None:
+                after = _merge_values(after, state)
+
+            for target, _ in self.edges[index]:
+                arriving = after if states[target] is None else _merge_values(states[target], after)
+                if arriving != states[target]:
+                    states[target] = arriving
+                    to_visit.append(target)
+        return states
+
+    def registers_live_after(self, program: [Instruction]) -> [typing.Set[str]]:
+        """:return: for every instruction, the internal registers that might be read before they are next written"""
+        count = len(program)
+        reads = [read_registers(instruction) for instruction in program]
+        kills = [
+            {written_register(instruction)} if instruction.condition is None else set()
+            for instruction in program
+        ]
+        live_in = [set() for _ in program]
+        live_out = [set() for _ in program]
+        to_visit = deque(range(count))
+        while to_visit:
+            index = to_visit.popleft()
+            live_out[index] = set().union(*(live_in[target] for target, _ in self.edges[index]))
+            new_live_in = reads[index] | (live_out[index] - kills[index])
+            if new_live_in != live_in[index]:
+                live_in[index] = new_live_in
+                to_visit.extend(self.predecessors[index])
+        return live_out
+
+
+def _merge_values(a, b):
+    return {register: value if b[register] == value else None for register, value in a.items()}
+
+
+def _remove_unexecuted_instructions(program: [Instruction], chip: ChipInfo) -> typing.Dict[int, Instruction]:
+    _ = chip
+    states = _ControlFlow(program).flag_states(program)
+    replacements = {}
+    for index, instruction in enumerate(program):
+        if instruction.mnemonic is None:
+            continue
+        state = states[index]
+        condition_flag = CONDITION_FLAGS.get(instruction.condition, None)
+        if state == 0:
+            replacements[index] = None
+        elif condition_flag is not None:
+            if not state & condition_flag:
+                replacements[index] = None
+            elif state == condition_flag:
+                replacements[index] = instruction.replace(condition=None)
+    return replacements
+
+
+def _remove_unused_tests(program: [Instruction], chip: ChipInfo) -> typing.Dict[int, Instruction]:
+    live = _ControlFlow(program).flag_live_after(program)
+    return {
+        index: None
+        for index, instruction in enumerate(program)
+        if instruction.mnemonic in TEST_INSTRUCTIONS and not live[index] and not has_side_effects(instruction, chip)
+    }
+
+
+def _remove_repeated_tests(program: [Instruction], chip: ChipInfo) -> typing.Dict[int, Instruction]:
+    replacements = {}
+    for index, test in enumerate(program):
+        if test.mnemonic not in TEST_INSTRUCTIONS or test.condition is not None or index in replacements:
+            continue
+        # pins can change between the two tests, so only tests of internal registers and literals are repeatable
+        if any(arg not in INTERNAL_REGISTERS and literal_value(arg) is None for arg in test.args):
+            continue
+        for later in range(index + 1, len(program)):
+            instruction = program[later]
+            # a label means execution could arrive from somewhere other than the first test
+            if instruction.label is not None or instruction.mnemonic == CHIP_OP_JMP:
+                break
+            if instruction.mnemonic in TEST_INSTRUCTIONS:
+                if instruction.condition is None and instruction.mnemonic == test.mnemonic \
+                        and instruction.args == test.args:
+                    replacements[later] = None
+                break
+            if written_register(instruction) in test.args:
+                break
+    return replacements
+
+
+def _remove_jumps_to_next(program: [Instruction], chip: ChipInfo) -> typing.Dict[int, Instruction]:
+    _ = chip
+    count = len(program)
+    flow = _ControlFlow(program)
+
+    def settle(index):
+        # label only lines do nothing, so execution is really at the next instruction after them
+        for _ in range(count):
+            if program[index].mnemonic is not None:
+                return index
+            index = (index + 1) % count
+        return None
+
+    executable = sum(1 for instruction in program if instruction.mnemonic is not None)
+    replacements = {}
+    for index, instruction in enumerate(program):
+        if instruction.mnemonic != CHIP_OP_JMP or not instruction.args:
+            continue
+        target = flow.labels.get(instruction.args[0], None)
+        # a program that is nothing but a jump to itself has to keep it
+        if target is None or executable - len(replacements) < 2:
+            continue
+        if settle(target) == settle((index + 1) % count):
+            replacements[index] = None
+    return replacements
+
+
+def _propagate_constants(program: [Instruction], chip: ChipInfo) -> typing.Dict[int, Instruction]:
+    states = _ControlFlow(program).register_values(program)
+    replacements = {}
+    for index, instruction in enumerate(program):
+        values = states[index]
+        if values is None or instruction.mnemonic is None:
+            continue
+
+        register = written_register(instruction)
+        if register in INTERNAL_REGISTERS and not has_side_effects(instruction, chip):
+            result = evaluate(instruction, values)[register]
+            if result is not None and result == values[register]:
+                # the register already holds the value being written
+                replacements[index] = None
+                continue
+            if result is not None:
+                folded = instruction.replace(mnemonic=CHIP_OP_MOV, args=[str(result), register])
+                if folded.mnemonic != instruction.mnemonic or folded.args != instruction.args:
+                    replacements[index] = folded
+                continue
+
+        args = list(instruction.args)
+        for position in SOURCE_ARGS.get(instruction.mnemonic, ()):
+            if position < len(args) and values.get(args[position], None) is not None:
+                args[position] = str(values[args[position]])
+        if args != instruction.args:
+            replacements[index] = instruction.replace(args=args)
+    return replacements
+
+
+def _remove_dead_writes(program: [Instruction], chip: ChipInfo) -> typing.Dict[int, Instruction]:
+    live = _ControlFlow(program).registers_live_after(program)
+    replacements = {}
+    for index, instruction in enumerate(program):
+        register = written_register(instruction)
+        if register in INTERNAL_REGISTERS and register not in live[index] and not has_side_effects(instruction, chip):
+            replacements[index] = None
+    return replacements
+
+
+def _rebuild(program: [Instruction], replacements: typing.Dict[int, typing.Optional[Instruction]]) -> [Instruction]:
+    """
+    applies the replacements (None removes an instruction) to a program, moving the labels of removed instructions and
+    label only lines onto the next instruction, so that each instruction carries at most one label that is used
+    """
+    result = []
+    pending = []
+    # labels that have been merged into another label on the same instruction
+    renamed = {}
+
+    def merge(instruction, labels):
+        own = label_name(instruction)
+        kept = own if own is not None else labels[0]
+        for label in labels:
+            if label != kept:
+                renamed[label] = kept
+        return instruction.replace(label=kept + ":") if own is None else instruction
+
+    for index, original in enumerate(program):
+        instruction = replacements.get(index, original) if index in replacements else original
+        if instruction is None or instruction.mnemonic is None:
+            if original.label is not None:
+                pending.append(label_name(original))
+            continue
+        if pending:
+            instruction = merge(instruction, pending)
+            pending = []
+        result.append(instruction)
+
+    if not result:
+        return []
+    # labels at the very end refer to the top of the program, where execution wraps around to
+    if pending:
+        result[0] = merge(result[0], pending)
+
+    referenced = set()
+    for index, instruction in enumerate(result):
+        if instruction.mnemonic == CHIP_OP_JMP and instruction.args:
+            target = instruction.args[0]
+            if target in renamed:
+                target = renamed[target]
+                result[index] = instruction.replace(args=[target] + instruction.args[1:])
+            referenced.add(target)
+
+    return [
+        instruction.replace(label=None) if instruction.label is not None and label_name(instruction) not in referenced
+        else instruction
+        for instruction in result
+    ]
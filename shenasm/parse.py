@@ -1,17 +1,22 @@
 import itertools
 import typing
+import sys
+import re
 
 
 from .source import LineOfSource
+from . import codes
 
 
 class Instruction(object):
+    __slots__ = ('_source_pos', '_label', '_condition', '_mnemonic', '_args')
 
     def __init__(self, source_pos, label, condition, mnemonic, args):
         self._source_pos = source_pos
         self._label = label
-        self._condition = condition
-        self._mnemonic = mnemonic
+        # there are only a handful of distinct mnemonics and conditions, share one copy of each
+        self._condition = sys.intern(condition) if condition is not None else None
+        self._mnemonic = sys.intern(mnemonic) if mnemonic is not None else None
         self._args = args
 
     @property
@@ -52,26 +57,68 @@ class Instruction(object):
         )
 
 
+# lexes a whole line in one pass: an optional label (a token ending in a colon), an optional condition
+# (+, - or @ on its own), the mnemonic and then the remaining arguments up to any comment, tokens are
+# separated by any whitespace and a token ends at whitespace, a comment or the end of the line
+_LINE_PATTERN = re.compile(r"""
+    \s*
+    (?: ( [^\s\#]*: ) (?![^\s\#]) \s* )?
+    (?: ( [-+@] ) (?![^\s\#]) \s* )?
+    ( [^\s\#]+ )?
+    ( [^\#]* )
+""", re.VERBOSE)
+
+
 class Parser(object):
 
     def __init__(self, issues):
         self._issues = issues
+        # the same text turns up on many lines (slp 1, mov acc p1, ...), so each distinct line is only lexed once
+        self._lexed = {}
 
-    def parse_lines(self, lines: [LineOfSource]) -> [Instruction]:
+    def parse_lines(self, lines: typing.Iterable[LineOfSource]) -> [Instruction]:
         """
         takes a collection of lines and parses them into instructions
         :param lines: the lines to parse
         :return: the resulting instruction list
         """
-        return list(
-            itertools.chain.from_iterable(
-                map(
-                    self._parse_line,
-                    lines
-                )
+        return list(self.iter_instructions(lines))
+
+    def iter_instructions(self, lines: typing.Iterable[LineOfSource]) -> typing.Iterator[Instruction]:
+        """
+        lazily parses lines into instructions, pulling each line from `lines` only when it is needed
+        :param lines: the lines to parse, such as the generator from shenasm.source.iter_lines
+        :return: a generator of the resulting instructions
+        """
+        return itertools.chain.from_iterable(
+            map(
+                self._parse_line,
+                lines
             )
         )
 
+    def _lex(self, text: str):
+        """
+        splits the text of a line into its parts, remembering the result for the next line with the same text
+        :param text: the line's text
+        :return: a tuple of label, condition, mnemonic and a tuple of arguments, each None if absent
+        """
+        lexed = self._lexed.get(text)
+        if lexed is not None:
+            return lexed
+
+        label, condition, mnemonic, rest = _LINE_PATTERN.match(text).groups()
+        args = None
+        if mnemonic is not None:
+            mnemonic = sys.intern(mnemonic.lower())
+            # register names and small literals repeat throughout a program, share one copy of each
+            args = tuple(sys.intern(token) for token in rest.split())
+        if condition is not None:
+            condition = sys.intern(condition)
+        lexed = (label, condition, mnemonic, args)
+        self._lexed[text] = lexed
+        return lexed
+
     def _parse_line(self, line: LineOfSource) -> [Instruction]:
         """
         parses a single line into an assembly instruction
@@ -79,46 +126,29 @@ class Parser(object):
         :return: an instruction object parsed from the given line
         """
 
-        text = line.text
-
-        # remove comments
-        comment_start = text.find("#")
-        if comment_start != -1:
-            text = text[:comment_start]
-        text = text.strip()
-
-        # empty lines don't need parsing
-        if not text:
-            return []
-
-        # parse by spaces, the list comprehension is to remove empty strings when double spacing etc is used
-        tokens = [token for token in text.split(" ") if token]
-        label, condition, mnemonic, args = None, None, None, None
-        # label?
-        if tokens[0].endswith(":"):
-            label = tokens[0]
-            tokens = tokens[1:]
-        if len(tokens) > 0:
-            # conditional?
-            if tokens[0] in ('+', '-', '@'):
-                condition = tokens[0]
-                tokens = tokens[1:]
-            if len(tokens) > 0:
-                # rest must be mnemonic and args
-                mnemonic = tokens[0].lower()
-                args = tokens[1:]
-        if condition is not None and mnemonic is None:
-            self._issues.error(
-                line.pos,
-                "condition symbol '{}' found with no associated instruction?",
-                condition
-            )
+        label, condition, mnemonic, args = self._lex(line.text)
+
+        if mnemonic is None:
+            # empty lines (or those with only a comment) don't need parsing
+            if label is None and condition is None:
+                return []
+            if condition is not None:
+                self._issues.error(
+                    line.pos,
+                    "condition symbol '{}' found with no associated instruction?",
+                    condition,
+                    code=codes.CONDITION_WITHOUT_INSTRUCTION
+                )
+            return [Instruction(line.pos, label, condition, None, None)]
+
+        # each instruction gets its own list of arguments, as later passes may replace them
+        args = list(args)
 
-        result = [Instruction(line.pos, label, condition, mnemonic, args)]
-        if label is not None and mnemonic is not None:
-            result = [
+        # a label with an instruction is split into a lonely label and the instruction
+        if label is not None:
+            return [
                 Instruction(line.pos, label, None, None, None),
                 Instruction(line.pos, None, condition, mnemonic, args),
             ]
 
-        return result
+        return [Instruction(line.pos, None, condition, mnemonic, args)]
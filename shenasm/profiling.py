@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+import json
+import time
+import tracemalloc
+import typing
+
+
+class PhaseStats(object):
+    """what one phase of assembly cost: its wall time, the most memory it had allocated at once and what it produced"""
+
+    def __init__(self, name: str, seconds: float, peak_memory: typing.Optional[int], counts: typing.Dict[str, int]):
+        self._name = name
+        self._seconds = seconds
+        self._peak_memory = peak_memory
+        self._counts = counts
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def seconds(self):
+        return self._seconds
+
+    @property
+    def peak_memory(self):
+        """bytes allocated by the phase at its peak, None if memory wasn't being tracked"""
+        return self._peak_memory
+
+    @property
+    def counts(self):
+        """the number of items (lines, instructions, symbols...) the phase produced, by name"""
+        return self._counts
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "peak_memory": self.peak_memory,
+            "counts": dict(self.counts),
+        }
+
+
+class Profiler(object):
+    """
+    measures each phase of assembly, pass one to shenasm.assemble.assemble() (or the other functions that
+    take a profiler) and read its phases afterwards, or give it a listener to hear about each phase as it ends
+
+    tracking memory uses tracemalloc, which makes everything run several times slower, so the times
+    measured with memory tracking on are best compared with each other rather than with normal runs
+    """
+
+    def __init__(self, track_memory: bool = True, listener: typing.Callable[[PhaseStats], None] = None):
+        """
+        :param track_memory: whether to measure the peak memory of each phase
+        :param listener: if given, called with the stats of each phase as soon as it ends
+        """
+        self._track_memory = track_memory
+        self._listener = listener
+        self._phases = []
+
+    @property
+    def phases(self) -> [PhaseStats]:
+        return self._phases
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        measures the code run inside a with block as one phase, the block is given a dictionary it can
+        record counts of the items it produced in
+        """
+        counts = {}
+        started_tracing = False
+        baseline = 0
+        if self._track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            seconds = time.perf_counter() - start
+            peak_memory = None
+            if self._track_memory:
+                peak_memory = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+                if started_tracing:
+                    tracemalloc.stop()
+
+            stats = PhaseStats(name, seconds, peak_memory, counts)
+            self._phases.append(stats)
+            if self._listener is not None:
+                self._listener(stats)
+
+    def to_dict(self) -> dict:
+        return {
+            "phases": [phase.to_dict() for phase in self._phases],
+            "total_seconds": sum(phase.seconds for phase in self._phases),
+        }
+
+    def format_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def format_text(self) -> str:
+        lines = ["{:<12} {:>10} {:>12}  {}".format("phase", "time (ms)", "peak memory", "counts")]
+        for phase in self._phases:
+            lines.append("{:<12} {:>10.2f} {:>12}  {}".format(
+                phase.name,
+                phase.seconds * 1000,
+                format_bytes(phase.peak_memory) if phase.peak_memory is not None else "-",
+                ", ".join("{} {}".format(value, key) for key, value in phase.counts.items())
+            ))
+        lines.append("{:<12} {:>10.2f}".format("total", sum(phase.seconds for phase in self._phases) * 1000))
+        return "\n".join(lines)
+
+
+class NullProfiler(Profiler):
+    """stands in for a Profiler when nothing is being measured, so code can always use a profiler"""
+
+    def __init__(self):
+        super().__init__(track_memory=False)
+
+    @contextmanager
+    def phase(self, name: str):
+        _ = name
+        yield {}
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def format_bytes(count: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if count < 1024:
+            return "{:.0f} {}".format(count, unit) if unit == "B" else "{:.1f} {}".format(count, unit)
+        count /= 1024
+    return "{:.1f} GiB".format(count)
+
+
+# the output formats accepted by --profile
+FORMATS = {
+    "text": Profiler.format_text,
+    "json": Profiler.format_json,
+}
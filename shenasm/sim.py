@@ -0,0 +1,537 @@
+from collections import deque
+import typing
+
+
+from .instructions import INSTRUCTIONS, CHIP_OP_NOP, CHIP_OP_MOV, CHIP_OP_JMP, CHIP_OP_SLP, CHIP_OP_SLX, \
+    CHIP_OP_ADD, CHIP_OP_SUB, CHIP_OP_MUL, CHIP_OP_NOT, CHIP_OP_DGT, CHIP_OP_DST, CHIP_OP_TEQ, CHIP_OP_TGT, \
+    CHIP_OP_TLT, CHIP_OP_TCP, CHIP_OP_GEN
+from .chips import ChipInfo, REG_TYPE_SIMPLE, REG_TYPE_XBUS
+from .parse import Instruction
+
+
+# the range of values registers can hold, results of arithmetic are clamped to it
+VALUE_MIN = -999
+VALUE_MAX = 999
+
+# the range of values a simple I/O pin can carry
+SIMPLE_MIN = 0
+SIMPLE_MAX = 100
+
+# the kinds of operand an instruction argument can decode to
+OPERAND_INT = 0
+OPERAND_ACC = 1
+OPERAND_DAT = 2
+OPERAND_NULL = 3
+OPERAND_SIMPLE = 4
+OPERAND_XBUS = 5
+
+# decoded operation codes, these are deliberately small integers so that
+# the interpreter loop can compare them cheaply
+OP_NOP = 0
+OP_MOV = 1
+OP_JMP = 2
+OP_SLP = 3
+OP_SLX = 4
+OP_ADD = 5
+OP_SUB = 6
+OP_MUL = 7
+OP_NOT = 8
+OP_DGT = 9
+OP_DST = 10
+OP_TEQ = 11
+OP_TGT = 12
+OP_TLT = 13
+OP_TCP = 14
+# gen is split into two operations: drive the pin high then sleep, drive it low then sleep
+OP_GEN_ON = 15
+OP_GEN_OFF = 16
+
+MNEMONIC_TO_OP = {
+    CHIP_OP_NOP: OP_NOP,
+    CHIP_OP_MOV: OP_MOV,
+    CHIP_OP_JMP: OP_JMP,
+    CHIP_OP_SLP: OP_SLP,
+    CHIP_OP_SLX: OP_SLX,
+    CHIP_OP_ADD: OP_ADD,
+    CHIP_OP_SUB: OP_SUB,
+    CHIP_OP_MUL: OP_MUL,
+    CHIP_OP_NOT: OP_NOT,
+    CHIP_OP_DGT: OP_DGT,
+    CHIP_OP_DST: OP_DST,
+    CHIP_OP_TEQ: OP_TEQ,
+    CHIP_OP_TGT: OP_TGT,
+    CHIP_OP_TLT: OP_TLT,
+    CHIP_OP_TCP: OP_TCP,
+    CHIP_OP_GEN: OP_GEN_ON,
+}
+
+# condition prefixes of decoded operations, the true/false values double as
+# the chip's enable flag state so a single comparison decides whether to run
+COND_NONE = 0
+COND_TRUE = 1
+COND_FALSE = 2
+COND_ONCE = 3
+
+FLAG_NONE = 0
+FLAG_TRUE = COND_TRUE
+FLAG_FALSE = COND_FALSE
+
+PREFIX_TO_COND = {
+    None: COND_NONE,
+    '+': COND_TRUE,
+    '-': COND_FALSE,
+    '@': COND_ONCE,
+}
+
+# the reasons a chip can stop executing during a time unit
+STATUS_SLEEP = 'sleep'
+STATUS_SLX = 'slx'
+STATUS_BLOCKED_READ = 'blocked read'
+STATUS_BLOCKED_WRITE = 'blocked write'
+
+# how many instructions a chip may execute in one time unit before we assume it will never sleep
+DEFAULT_INSTRUCTION_LIMIT = 100000
+
+
+class SimulationError(Exception):
+    """raised when a program cannot be decoded or misbehaves while being simulated"""
+    pass
+
+
+class Program(object):
+    """
+    an assembled program decoded into a table of operations ready for execution
+
+    each operation is a tuple of (op, condition, a_kind, a_value, b_kind, b_value, c_kind, c_value),
+    pin operands that are named rather than read (slx, gen) are stored as the integer kind with the pin name,
+    jump targets are resolved to operation indices and integer literals are already parsed and clamped
+    """
+
+    def __init__(self, ops, sources, chip):
+        self._ops = ops
+        self._sources = sources
+        self._chip = chip
+
+    @property
+    def ops(self):
+        return self._ops
+
+    @property
+    def sources(self):
+        """the index of the assembled instruction each operation was decoded from"""
+        return self._sources
+
+    @property
+    def chip(self):
+        return self._chip
+
+    def __len__(self):
+        return len(self._ops)
+
+
+class PinIO(object):
+    """
+    the outside world as seen by a single chip: simple pin inputs are held values, XBus inputs
+    are queues that are consumed by reads, and everything the chip writes is recorded
+    """
+
+    def __init__(self, simple_inputs: typing.Dict[str, int] = None, xbus_inputs: typing.Dict[str, typing.Iterable[int]] = None):
+        self.simple_inputs = dict(simple_inputs) if simple_inputs is not None else {}
+        self.simple_outputs = {}
+        self.xbus_inputs = {
+            pin: deque(values)
+            for pin, values in (xbus_inputs.items() if xbus_inputs is not None else [])
+        }
+        self.xbus_outputs = {}
+
+    def read_simple(self, pin):
+        return self.simple_inputs.get(pin, 0)
+
+    def write_simple(self, pin, value):
+        self.simple_outputs[pin] = value
+
+    def xbus_ready(self, pin):
+        return len(self.xbus_inputs.get(pin, ())) > 0
+
+    def xbus_read(self, pin):
+        """
+        :return: the next value on the pin, or None if there is nothing to read and the chip must block
+        """
+        queue = self.xbus_inputs.get(pin, None)
+        if not queue:
+            return None
+        return queue.popleft()
+
+    def xbus_write(self, pin, value):
+        """
+        :return: True once the write has completed, False if the chip must block and retry the same write
+        """
+        self.xbus_outputs.setdefault(pin, []).append(value)
+        return True
+
+
+def decode_program(instructions: [Instruction], chip: ChipInfo) -> Program:
+    """
+    decodes assembled instructions into a Program for the simulator
+    :param instructions: the output of assemble(), with all aliases and constants already substituted
+    :param chip: the chip the program will run on, used to classify register operands
+    :return: the decoded program
+    """
+
+    # first work out what operation index each label refers to, lines consisting only of
+    # a label don't execute so the label refers to the next real operation
+    labels = {}
+    pending_labels = []
+    op_count = 0
+    for inst in instructions:
+        if inst.label is not None:
+            pending_labels.append(inst.label[:-1] if inst.label.endswith(":") else inst.label)
+        if inst.mnemonic is not None:
+            for label in pending_labels:
+                labels[label] = op_count
+            pending_labels = []
+            op_count += 2 if inst.mnemonic == CHIP_OP_GEN else 1
+    # labels at the very end of the program wrap around to the start
+    for label in pending_labels:
+        labels[label] = 0
+
+    ops = []
+    sources = []
+    for index, inst in enumerate(instructions):
+        if inst.mnemonic is None:
+            continue
+
+        op = MNEMONIC_TO_OP.get(inst.mnemonic, None)
+        info = INSTRUCTIONS.get(inst.mnemonic, None)
+        if op is None or info is None:
+            raise SimulationError("{}: cannot simulate instruction '{}'".format(inst.source_pos, inst.mnemonic))
+
+        args = inst.args if inst.args is not None else []
+        if len(args) != len(info.argtypes):
+            raise SimulationError("{}: {} expects {} arguments, got {}".format(
+                inst.source_pos, inst.mnemonic, len(info.argtypes), len(args)
+            ))
+
+        cond = PREFIX_TO_COND.get(inst.condition, None)
+        if cond is None:
+            raise SimulationError("{}: unknown condition prefix '{}'".format(inst.source_pos, inst.condition))
+
+        operands = [OPERAND_INT, 0, OPERAND_INT, 0, OPERAND_INT, 0]
+        if op == OP_JMP:
+            target = labels.get(args[0], None)
+            if target is None:
+                raise SimulationError("{}: jump to non-existent label '{}'".format(inst.source_pos, args[0]))
+            operands[1] = target
+        elif op in (OP_SLX, OP_GEN_ON):
+            # the pin operand of slx and gen is named, never read
+            kind, pin = _decode_operand(inst, args[0], chip)
+            expected = OPERAND_XBUS if op == OP_SLX else OPERAND_SIMPLE
+            if kind != expected:
+                raise SimulationError("{}: {} expects a {} pin, got '{}'".format(
+                    inst.source_pos, inst.mnemonic, "XBus" if op == OP_SLX else "simple I/O", args[0]
+                ))
+            operands[1] = pin
+            for slot, arg in enumerate(args[1:], start=1):
+                operands[slot * 2], operands[slot * 2 + 1] = _decode_operand(inst, arg, chip)
+        else:
+            for slot, arg in enumerate(args):
+                operands[slot * 2], operands[slot * 2 + 1] = _decode_operand(inst, arg, chip)
+            if op == OP_MOV and operands[2] == OPERAND_INT:
+                raise SimulationError("{}: cannot mov into integer literal '{}'".format(inst.source_pos, args[1]))
+
+        ops.append(tuple([op, cond] + operands))
+        sources.append(index)
+        if op == OP_GEN_ON:
+            # the second half of gen only ever runs straight after the first, so it is unconditional,
+            # it takes the off duration as its second operand
+            ops.append(tuple([OP_GEN_OFF, COND_NONE] + operands[:2] + operands[4:] + [OPERAND_INT, 0]))
+            sources.append(index)
+
+    if len(ops) < 1:
+        raise SimulationError("program contains no instructions to simulate")
+
+    return Program(ops, sources, chip)
+
+
+def _decode_operand(inst: Instruction, arg: str, chip: ChipInfo):
+    """
+    classifies a single instruction argument
+    :return: tuple of operand kind and value (an integer for literals, the register name otherwise)
+    """
+    try:
+        return OPERAND_INT, clamp(int(arg))
+    except ValueError:
+        pass
+
+    if arg == 'acc':
+        return OPERAND_ACC, arg
+    if arg == 'dat' and arg in chip.registers:
+        return OPERAND_DAT, arg
+    if arg == 'null':
+        return OPERAND_NULL, arg
+
+    register = chip.registers.get(arg, None)
+    if register is not None and register.type == REG_TYPE_SIMPLE:
+        return OPERAND_SIMPLE, arg
+    if register is not None and register.type == REG_TYPE_XBUS:
+        return OPERAND_XBUS, arg
+
+    raise SimulationError("{}: '{}' is not a register on this chip or an integer".format(inst.source_pos, arg))
+
+
+def clamp(value):
+    return VALUE_MIN if value < VALUE_MIN else (VALUE_MAX if value > VALUE_MAX else value)
+
+
+def digit_of(value, index):
+    """
+    implements dgt: the digit of value at index (0 being the ones digit) keeping the sign of value,
+    indices outside of 0..2 give 0
+    """
+    if not (0 <= index <= 2):
+        return 0
+    digit = (abs(value) // (10 ** index)) % 10
+    return -digit if value < 0 else digit
+
+
+def set_digit(value, index, digit):
+    """
+    implements dst: replaces the digit of value at index with the ones digit of the given digit,
+    the result takes the sign of the digit argument (or keeps its own if that is zero), indices
+    outside of 0..2 leave the value unchanged
+    """
+    if not (0 <= index <= 2):
+        return value
+    scale = 10 ** index
+    magnitude = abs(value)
+    magnitude += ((abs(digit) % 10) - (magnitude // scale) % 10) * scale
+    negative = digit < 0 or (digit == 0 and value < 0)
+    return -magnitude if negative else magnitude
+
+
+class Chip(object):
+    """
+    the execution state of one microcontroller running a decoded Program
+    """
+
+    def __init__(self, program: Program, io=None, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT):
+        self.program = program
+        self.io = io if io is not None else PinIO()
+        self.instruction_limit = instruction_limit
+        self.acc = 0
+        self.dat = 0
+        self.pc = 0
+        self.flag = FLAG_NONE
+        self.wake_time = 0
+        # the number of instructions executed so far, which is what the game charges power for
+        self.power = 0
+        # operations with the @ prefix that have already run once
+        self.once_done = bytearray(len(program))
+        # a value read from XBus by an instruction that then blocked, reused when it retries
+        self.latched = None
+        # the pin the chip is waiting on if it stopped for anything other than slp
+        self.blocked_on = None
+
+    def run(self, now: int) -> str:
+        """
+        executes instructions for time unit `now` until the chip sleeps or blocks on XBus
+        :param now: the current time unit
+        :return: one of the STATUS_ values describing why execution stopped
+        """
+        if now < self.wake_time:
+            return STATUS_SLEEP
+
+        # copy everything the loop touches into locals, attribute lookups dominate otherwise
+        ops = self.program.ops
+        op_count = len(ops)
+        io = self.io
+        once_done = self.once_done
+        acc = self.acc
+        dat = self.dat
+        pc = self.pc
+        flag = self.flag
+        latched = self.latched
+        limit = self.instruction_limit
+        executed = 0
+        status = None
+        blocked_on = None
+
+        # the number of instructions executed when execution last wrapped around to the start,
+        # a whole pass that executes nothing can never make progress
+        executed_at_wrap = -1
+
+        while True:
+            op, cond, ak, av, bk, bv, ck, cv = ops[pc]
+
+            # skip operations whose condition isn't met, @ operations are marked as done up front
+            # and unmarked again if they block before completing, skipping gen skips both of its halves
+            if cond:
+                if cond == COND_ONCE:
+                    if once_done[pc]:
+                        pc += 2 if op == OP_GEN_ON else 1
+                        if pc == op_count:
+                            pc = 0
+                            executed_at_wrap = self._check_progress(now, executed, executed_at_wrap)
+                        continue
+                    once_done[pc] = 1
+                elif cond != flag:
+                    pc += 2 if op == OP_GEN_ON else 1
+                    if pc == op_count:
+                        pc = 0
+                        executed_at_wrap = self._check_progress(now, executed, executed_at_wrap)
+                    continue
+
+            # fetch the first operand
+            if ak == OPERAND_INT:
+                a = av
+            elif ak == OPERAND_ACC:
+                a = acc
+            elif ak == OPERAND_DAT:
+                a = dat
+            elif ak == OPERAND_NULL:
+                a = 0
+            elif ak == OPERAND_SIMPLE:
+                a = io.read_simple(av)
+            elif latched is not None:
+                a = latched
+                latched = None
+            else:
+                a = io.xbus_read(av)
+                if a is None:
+                    status, blocked_on = STATUS_BLOCKED_READ, av
+                    break
+
+            next_pc = pc + 1
+
+            if op == OP_MOV:
+                if bk == OPERAND_ACC:
+                    acc = a
+                elif bk == OPERAND_DAT:
+                    dat = a
+                elif bk == OPERAND_SIMPLE:
+                    io.write_simple(bv, SIMPLE_MIN if a < SIMPLE_MIN else (SIMPLE_MAX if a > SIMPLE_MAX else a))
+                elif bk == OPERAND_XBUS:
+                    if not io.xbus_write(bv, a):
+                        if ak == OPERAND_XBUS:
+                            latched = a
+                        status, blocked_on = STATUS_BLOCKED_WRITE, bv
+                        break
+            elif op == OP_ADD:
+                acc += a
+                acc = VALUE_MIN if acc < VALUE_MIN else (VALUE_MAX if acc > VALUE_MAX else acc)
+            elif op == OP_SUB:
+                acc -= a
+                acc = VALUE_MIN if acc < VALUE_MIN else (VALUE_MAX if acc > VALUE_MAX else acc)
+            elif op == OP_JMP:
+                next_pc = a
+                if executed >= limit:
+                    raise SimulationError("executed {} instructions in time unit {} without sleeping".format(
+                        executed, now
+                    ))
+            elif op == OP_SLP:
+                self.wake_time = now + (a if a > 1 else 1)
+                status = STATUS_SLEEP
+            elif op >= OP_DST:
+                # everything from here on takes a second operand
+                if bk == OPERAND_INT:
+                    b = bv
+                elif bk == OPERAND_ACC:
+                    b = acc
+                elif bk == OPERAND_DAT:
+                    b = dat
+                elif bk == OPERAND_NULL:
+                    b = 0
+                elif bk == OPERAND_SIMPLE:
+                    b = io.read_simple(bv)
+                else:
+                    b = io.xbus_read(bv)
+                    if b is None:
+                        if ak == OPERAND_XBUS:
+                            latched = a
+                        status, blocked_on = STATUS_BLOCKED_READ, bv
+                        break
+
+                if op == OP_TEQ:
+                    flag = FLAG_TRUE if a == b else FLAG_FALSE
+                elif op == OP_TGT:
+                    flag = FLAG_TRUE if a > b else FLAG_FALSE
+                elif op == OP_TLT:
+                    flag = FLAG_TRUE if a < b else FLAG_FALSE
+                elif op == OP_TCP:
+                    flag = FLAG_TRUE if a > b else (FLAG_FALSE if a < b else FLAG_NONE)
+                elif op == OP_DST:
+                    acc = set_digit(acc, a, b)
+                else:
+                    # gen drives the pin high then low, sleeping for each duration that is positive
+                    io.write_simple(av, SIMPLE_MAX if op == OP_GEN_ON else SIMPLE_MIN)
+                    if op == OP_GEN_OFF:
+                        # both halves together are a single instruction as far as power goes
+                        executed -= 1
+                    if b > 0:
+                        self.wake_time = now + b
+                        status = STATUS_SLEEP
+            elif op == OP_MUL:
+                acc *= a
+                acc = VALUE_MIN if acc < VALUE_MIN else (VALUE_MAX if acc > VALUE_MAX else acc)
+            elif op == OP_NOT:
+                acc = SIMPLE_MAX if acc == 0 else 0
+            elif op == OP_DGT:
+                acc = digit_of(acc, a)
+            elif op == OP_SLX:
+                if not io.xbus_ready(av):
+                    status, blocked_on = STATUS_SLX, av
+                    break
+
+            # the operation completed, so it costs power
+            executed += 1
+            if next_pc == op_count:
+                next_pc = 0
+                executed_at_wrap = self._check_progress(now, executed, executed_at_wrap)
+            pc = next_pc
+
+            if status is not None:
+                break
+
+        if blocked_on is not None and ops[pc][1] == COND_ONCE:
+            once_done[pc] = 0
+        self._store(acc, dat, pc, flag, latched, executed, blocked_on)
+        return status
+
+    def _check_progress(self, now, executed, executed_at_wrap):
+        """
+        called whenever execution wraps around to the start of the program to catch chips that never sleep
+        :return: the new value for executed_at_wrap
+        """
+        if executed == executed_at_wrap:
+            raise SimulationError("time unit {}: every instruction was skipped, the chip can never sleep".format(now))
+        if executed >= self.instruction_limit:
+            raise SimulationError("executed {} instructions in time unit {} without sleeping".format(executed, now))
+        return executed
+
+    def _store(self, acc, dat, pc, flag, latched, executed, blocked_on):
+        self.acc = acc
+        self.dat = dat
+        self.pc = pc
+        self.flag = flag
+        self.latched = latched
+        self.power += executed
+        self.blocked_on = blocked_on
+
+    def run_for(self, time_units: int, start: int = 0):
+        """
+        runs the chip on its own for a number of time units, a chip blocked on XBus simply
+        retries at the start of each time unit
+        :param time_units: how many time units to simulate
+        :param start: the time unit to start at
+        :return: the time unit after the last one simulated
+        """
+        run = self.run
+        end = start + time_units
+        now = start
+        while now < end:
+            run(now)
+            now += 1
+            # nothing else can wake a lone chip, so skip straight past time units it sleeps through
+            if self.wake_time > now:
+                now = self.wake_time if self.wake_time < end else end
+        return now
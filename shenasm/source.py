@@ -1,11 +1,14 @@
 import typing
+import sys
 import os
 
 
 from .errors import IssueLog
+from . import codes
 
 
 class LineOfSource(object):
+    __slots__ = ('_pos', '_text')
 
     def __init__(self, pos, text):
         self._pos = pos
@@ -21,9 +24,11 @@ class LineOfSource(object):
 
 
 class SourcePosition(object):
+    __slots__ = ('_file', '_line')
 
     def __init__(self, file, line):
-        self._file = file
+        # the same few file names are shared by every position, so keep one copy of each
+        self._file = sys.intern(file) if type(file) is str else file
         self._line = line
 
     @property
@@ -41,6 +46,23 @@ class SourcePosition(object):
         )
 
 
+class IncludeDirective(object):
+    """an !include found while preprocessing a file, with the included path already made absolute"""
+    __slots__ = ('_pos', '_path')
+
+    def __init__(self, pos, path):
+        self._pos = pos
+        self._path = path
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @property
+    def path(self):
+        return self._path
+
+
 def read_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[str, SourcePosition]) -> [LineOfSource]:
     """
     reads all the lines from a file and matches them up with their source position
@@ -50,11 +72,62 @@ def read_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[st
     :param included_files: a record of what files have been included already (and from where) to prevent include cycles
     :return: a collection of objects describing lines of text and their source position
     """
+    return list(iter_lines(issues, file, path, included_files))
+
+
+def iter_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[str, SourcePosition]) -> typing.Iterator[LineOfSource]:
+    """
+    lazily reads the lines from a file and matches them up with their source position, following includes
+    as they are reached, only one line of each open file is held in memory at a time and issues are
+    reported as soon as the line causing them is read
+    :param issues: a collection of issues generated during the assembler's execution
+    :param file: the file handle (or any iterable of lines) to read lines from
+    :param path: the path to the file being read
+    :param included_files: a record of what files have been included already (and from where) to prevent include cycles
+    :return: a generator of objects describing lines of text and their source position
+    """
+
+    for item in preprocess_lines(issues, file, path):
+        if isinstance(item, IncludeDirective):
+            if not check_include(issues, item, included_files):
+                continue
+
+            # try to open the file, if we can't open it then report an error
+            try:
+                handle = open(item.path)
+            except IOError as io_error:
+                issues.error(
+                    item.pos,
+                    "error opening included file '{}': {}",
+                    item.path,
+                    io_error,
+                    code=codes.INCLUDE_OPEN_ERROR
+                )
+                continue
+
+            included_files[item.path] = item.pos
+
+            # the included file is closed as soon as its last line has been read, or when
+            # this generator is closed early
+            with handle:
+                yield from iter_lines(issues, handle, item.path, included_files)
+        else:
+            yield item
+
+
+def preprocess_lines(issues: IssueLog, lines: typing.Iterable[str], path: str) -> typing.Iterator[typing.Union[LineOfSource, IncludeDirective]]:
+    """
+    tags each line of a single file with its source position and handles preprocessor directives,
+    includes are yielded as IncludeDirective objects rather than being followed
+    :param issues: a collection of issues generated during the assembler's execution
+    :param lines: the text of each line in the file
+    :param path: the path to the file the lines came from
+    :return: the file's lines of source, interleaved with the includes found between them
+    """
 
-    result = []
     # read in each line, tagging it with source position information, handling
     # preprocessor directives as we go
-    for number, line in enumerate(file.readlines(), start=1):
+    for number, line in enumerate(lines, start=1):
         pos = SourcePosition(path, number)
         line = line.strip()
 
@@ -65,7 +138,8 @@ def read_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[st
             if len(tokens) < 2:
                 issues.error(
                     pos,
-                    "include directive expects a parameter: a file path enclosed in quotes"
+                    "include directive expects a parameter: a file path enclosed in quotes",
+                    code=codes.INCLUDE_WITHOUT_PATH
                 )
                 continue
 
@@ -76,7 +150,8 @@ def read_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[st
             if not (included_path.startswith('"') and included_path.endswith('"')):
                 issues.error(
                     pos,
-                    "include directive expects filepath surrounded in quotation marks"
+                    "include directive expects filepath surrounded in quotation marks",
+                    code=codes.INCLUDE_PATH_NOT_QUOTED
                 )
                 continue
 
@@ -88,46 +163,7 @@ def read_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[st
                 current_folder = os.path.dirname(path)
                 included_path = os.path.join(current_folder, included_path)
 
-            # ensure it's a real file
-            if not os.path.isfile(included_path):
-                issues.error(
-                    pos,
-                    "include directive specifies invalid file '{}'".format(
-                        included_path
-                    )
-                )
-                continue
-
-            # try to open the file, if we can't open it then report an error
-            try:
-                handle = open(included_path)
-            except IOError as io_error:
-                issues.error(
-                    pos,
-                    "error opening included file '{}': {}".format(
-                        included_path,
-                        io_error
-                    )
-                )
-                continue
-
-            # check for include cycles
-            if included_path in included_files:
-                issues.error(
-                    pos,
-                    "include file {} is already included here: {}".format(
-                        included_path,
-                        included_files[included_path]
-                    )
-                )
-                continue
-
-            included_files[included_path] = pos
-
-            # add all the included lines into our result using recursion
-            result.extend(
-                read_lines(issues, handle, included_path, included_files)
-            )
+            yield IncludeDirective(pos, included_path)
         # this line looks like a preprocessor directive, but we can't handle it
         elif line.startswith("!"):
             words = line.split()
@@ -135,11 +171,42 @@ def read_lines(issues: IssueLog, file, path: str, included_files: typing.Dict[st
             issues.warning(
                 pos,
                 "unknown preprocessor directive '{}'",
-                directive
+                directive,
+                code=codes.UNKNOWN_DIRECTIVE
             )
         # this looks like a normal line of source, record it in our results
         else:
-            result.append(
-                LineOfSource(SourcePosition(path, number), line.strip())
-            )
-    return result
+            yield LineOfSource(pos, line)
+
+
+def check_include(issues: IssueLog, include: IncludeDirective, included_files: typing.Dict[str, SourcePosition]) -> bool:
+    """
+    checks that an included file exists and isn't already included
+    :param issues: a collection of issues generated during the assembler's execution
+    :param include: the include directive to check
+    :param included_files: a record of what files have been included already (and from where)
+    :return: whether the include should be followed
+    """
+
+    # ensure it's a real file
+    if not os.path.isfile(include.path):
+        issues.error(
+            include.pos,
+            "include directive specifies invalid file '{}'",
+            include.path,
+            code=codes.INCLUDE_NOT_FOUND
+        )
+        return False
+
+    # check for include cycles
+    if include.path in included_files:
+        issues.error(
+            include.pos,
+            "include file {} is already included here: {}",
+            include.path,
+            included_files[include.path],
+            code=codes.INCLUDED_MORE_THAN_ONCE
+        )
+        return False
+
+    return True
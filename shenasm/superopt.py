@@ -0,0 +1,514 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import itertools
+import json
+import os
+import time
+import typing
+
+
+from .instructions import INSTRUCTIONS, INST_ARG_TYPE_REG, INST_ARG_TYPE_INT, INST_ARG_TYPE_LBL, INST_ARG_TYPE_PIN, \
+    INST_ARG_TYPE_SIMPLE_PIN, INST_ARG_TYPE_XBUS_PIN, CHIP_OP_NOP, CHIP_OP_MOV, CHIP_OP_JMP, CHIP_OP_SLP, \
+    CHIP_OP_SLX, CHIP_OP_GEN, CHIP_OP_TEQ, CHIP_OP_TGT, CHIP_OP_TLT, CHIP_OP_TCP
+from .chips import ChipInfo, REG_TYPE_SIMPLE, REG_TYPE_XBUS
+from .parse import Instruction
+from .source import SourcePosition
+from .sim import decode_program, PinIO, Chip, Program, SimulationError, OP_JMP, DEFAULT_INSTRUCTION_LIMIT
+from . import log
+
+
+OBJECTIVE_LINES = 'lines'
+OBJECTIVE_POWER = 'power'
+OBJECTIVES = (OBJECTIVE_LINES, OBJECTIVE_POWER)
+
+# candidates are first run on this many time units of the first test case, most fail within them
+PROBE_TIME_UNITS = 4
+
+# a candidate is given up on once it runs this many times more instructions in a time unit than the original program
+# ever did (plus INSTRUCTION_LIMIT_SLACK), most candidates that get that far never sleep at all
+INSTRUCTION_LIMIT_FACTOR = 4
+INSTRUCTION_LIMIT_SLACK = 16
+
+# programs of up to this many lines are searched with every instruction, not just those they already use, the search
+# space is still small enough at these lengths and the shortest replacement often uses an instruction the original
+# doesn't (two mov and slp pairs are one gen)
+ALL_MNEMONICS_LINES = 4
+
+# the conditions a candidate line can have
+CONDITIONS = (None, '+', '-', '@')
+
+TEST_MNEMONICS = (CHIP_OP_TEQ, CHIP_OP_TGT, CHIP_OP_TLT, CHIP_OP_TCP)
+SLEEP_MNEMONICS = (CHIP_OP_SLP, CHIP_OP_SLX, CHIP_OP_GEN)
+
+CANDIDATE_SOURCE = SourcePosition("<superoptimiser>", None)
+
+
+class TestCase(object):
+    """
+    the inputs for one run of a program: the value of each simple input pin in each time unit (the last value is held
+    once the list runs out) and the values waiting to be read from each XBus input pin
+    """
+    __slots__ = ('_time_units', '_simple_inputs', '_xbus_inputs')
+
+    def __init__(self, time_units: int, simple_inputs: typing.Dict[str, typing.List[int]] = None,
+                 xbus_inputs: typing.Dict[str, typing.List[int]] = None):
+        self._time_units = time_units
+        self._simple_inputs = simple_inputs if simple_inputs is not None else {}
+        self._xbus_inputs = xbus_inputs if xbus_inputs is not None else {}
+
+    @property
+    def time_units(self):
+        return self._time_units
+
+    @property
+    def simple_inputs(self):
+        return self._simple_inputs
+
+    @property
+    def xbus_inputs(self):
+        return self._xbus_inputs
+
+    def truncated(self, time_units: int) -> 'TestCase':
+        return TestCase(min(time_units, self._time_units), self._simple_inputs, self._xbus_inputs)
+
+
+class Specification(object):
+    """the behaviour a program has to have: the trace of outputs expected from each test case"""
+
+    def __init__(self, cases: [TestCase], expected: [list], instruction_limit: int):
+        self._cases = cases
+        self._expected = expected
+        self._instruction_limit = instruction_limit
+
+    @property
+    def cases(self):
+        return self._cases
+
+    @property
+    def expected(self):
+        return self._expected
+
+    @property
+    def instruction_limit(self):
+        """the most instructions a program may run in one time unit"""
+        return self._instruction_limit
+
+
+class SearchResult(object):
+    """the best program a search found, which is None if nothing beat the original"""
+
+    def __init__(self, program: typing.Optional[typing.List[Instruction]], lines: int, power: int,
+                 original_lines: int, original_power: int, examined: int, complete: bool):
+        self._program = program
+        self._lines = lines
+        self._power = power
+        self._original_lines = original_lines
+        self._original_power = original_power
+        self._examined = examined
+        self._complete = complete
+
+    @property
+    def program(self):
+        return self._program
+
+    @property
+    def lines(self):
+        return self._lines
+
+    @property
+    def power(self):
+        """the power used over every test case"""
+        return self._power
+
+    @property
+    def original_lines(self):
+        return self._original_lines
+
+    @property
+    def original_power(self):
+        return self._original_power
+
+    @property
+    def examined(self):
+        """how many candidates were run"""
+        return self._examined
+
+    @property
+    def complete(self):
+        """whether every candidate was tried, rather than the search running out of time"""
+        return self._complete
+
+    def format_text(self) -> str:
+        summary = "examined {} candidates{}".format(
+            self._examined, "" if self._complete else " before running out of time"
+        )
+        if self._program is None:
+            return "{}, nothing beat the original {} lines using {} power".format(
+                summary, self._original_lines, self._original_power
+            )
+        return "{}, found {} lines using {} power in place of {} lines using {} power:\n{}".format(
+            summary, self._lines, self._power, self._original_lines, self._original_power,
+            "\n".join(str(instruction) for instruction in self._program)
+        )
+
+
+def read_cases(path: str) -> [TestCase]:
+    """
+    reads test cases from a JSON file, a list of objects like:
+        {"time_units": 20, "simple": {"p0": [0, 0, 100]}, "xbus": {"x0": [5, 3]}}
+    """
+    with open(path) as handle:
+        entries = json.load(handle)
+    return [
+        TestCase(entry["time_units"], entry.get("simple", None), entry.get("xbus", None))
+        for entry in entries
+    ]
+
+
+def run_case(program: Program, case: TestCase, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT,
+             powers: typing.List[int] = None, chip_class: typing.Callable[..., Chip] = Chip) -> (list, int):
+    """
+    runs a program through a test case
+    :param powers: if given, the power used in each time unit is appended to it
+    :param chip_class: makes the chip to run, from the program, its io and the instruction limit
+    :return: tuple of what the program output in each time unit, followed by how long it still sleeps for once the
+             case is over, and the power it used
+    :raises SimulationError: if the program can't make progress
+    """
+    io = PinIO(xbus_inputs=case.xbus_inputs)
+    mcu = chip_class(program, io, instruction_limit)
+    trace = []
+    for now in range(case.time_units):
+        for pin, values in case.simple_inputs.items():
+            io.simple_inputs[pin] = values[now] if now < len(values) else values[-1]
+        written = {pin: len(values) for pin, values in io.xbus_outputs.items()}
+        power = mcu.power
+        mcu.run(now)
+        if powers is not None:
+            powers.append(mcu.power - power)
+        # a pin that was never written reads the same as one that was written 0
+        simple = tuple(sorted((pin, value) for pin, value in io.simple_outputs.items() if value != 0))
+        xbus = tuple(sorted(
+            (pin, tuple(values[written.get(pin, 0):])) for pin, values in io.xbus_outputs.items()
+            if len(values) > written.get(pin, 0)
+        ))
+        trace.append((simple, xbus, mcu.blocked_on))
+    # a program that matches every time unit but sleeps on past the end wouldn't do the same in the next one
+    trace.append(max(0, mcu.wake_time - case.time_units))
+    return trace, mcu.power
+
+
+def specification_from_program(instructions: [Instruction], chip: ChipInfo, cases: [TestCase]) -> Specification:
+    """
+    :return: a specification asking for whatever the given program does in each test case
+    """
+    program = decode_program(instructions, chip)
+    expected = []
+    powers = [0]
+    for case in cases:
+        expected.append(run_case(program, case, powers=powers)[0])
+    return Specification(cases, expected, max(powers) * INSTRUCTION_LIMIT_FACTOR + INSTRUCTION_LIMIT_SLACK)
+
+
+def candidate_lines(instructions: [Instruction], chip: ChipInfo, mnemonics: typing.Iterable[str] = None) -> [tuple]:
+    """
+    the (mnemonic, args) of every line worth trying, jump targets are left as None to be filled in per candidate,
+    to keep the search small only the registers and literals the original program uses (and acc) are operands
+    :param mnemonics: the instructions to try, defaults to every instruction for a program of up to
+                      ALL_MNEMONICS_LINES lines and to those the original program uses for longer ones
+    """
+    used = set(arg for instruction in instructions if instruction.args for arg in instruction.args)
+    registers = [name for name in chip.registers if name == 'acc' or name in used]
+    literals = sorted(set(arg for arg in used if _is_literal(arg)) | {'0'}, key=int)
+    pins = [name for name in registers if chip.registers[name].type in (REG_TYPE_SIMPLE, REG_TYPE_XBUS)]
+    options = {
+        INST_ARG_TYPE_REG: registers,
+        INST_ARG_TYPE_INT: literals,
+        INST_ARG_TYPE_LBL: [None],
+        INST_ARG_TYPE_PIN: pins,
+        INST_ARG_TYPE_SIMPLE_PIN: [name for name in pins if chip.registers[name].type == REG_TYPE_SIMPLE],
+        INST_ARG_TYPE_XBUS_PIN: [name for name in pins if chip.registers[name].type == REG_TYPE_XBUS],
+    }
+
+    if mnemonics is None:
+        if sum(1 for instruction in instructions if instruction.mnemonic is not None) <= ALL_MNEMONICS_LINES:
+            mnemonics = sorted(INSTRUCTIONS)
+        else:
+            mnemonics = sorted(set(
+                instruction.mnemonic for instruction in instructions if instruction.mnemonic in INSTRUCTIONS
+            ))
+    else:
+        unknown = [mnemonic for mnemonic in mnemonics if mnemonic not in INSTRUCTIONS]
+        if unknown:
+            raise ValueError("unknown instructions: {}".format(", ".join(unknown)))
+    mnemonics = [mnemonic for mnemonic in mnemonics if mnemonic != CHIP_OP_NOP]
+
+    result = []
+    for mnemonic in mnemonics:
+        argtypes = INSTRUCTIONS[mnemonic].argtypes
+        if mnemonic == CHIP_OP_GEN:
+            # gen drives a simple pin
+            argtypes = [[INST_ARG_TYPE_SIMPLE_PIN]] + argtypes[1:]
+        choices = [
+            [value for argtype in allowed for value in options[argtype]]
+            for allowed in argtypes
+        ]
+        for args in itertools.product(*choices):
+            if _worth_trying(mnemonic, args, chip):
+                result.append((mnemonic, args))
+    return result
+
+
+def _is_literal(arg: str) -> bool:
+    try:
+        int(arg)
+        return True
+    except ValueError:
+        return False
+
+
+def _worth_trying(mnemonic: str, args: tuple, chip: ChipInfo) -> bool:
+    """filters out lines that can't do anything a different line couldn't"""
+    if mnemonic == CHIP_OP_MOV:
+        source, destination = args
+        if source == destination or _is_literal(destination):
+            return False
+        # writing to null only matters when it reads XBus
+        if destination == 'null':
+            return source in chip.registers and chip.registers[source].type == REG_TYPE_XBUS
+        return True
+    if mnemonic in TEST_MNEMONICS:
+        # the result of comparing literals, or a register with itself, is always the same
+        return args[0] != args[1] and not (_is_literal(args[0]) and _is_literal(args[1]))
+    return True
+
+
+def _build_candidate(lines: tuple) -> [Instruction]:
+    """turns a candidate's (condition, mnemonic, args) lines, with jump arguments as line indices, into instructions"""
+    targets = set(args[0] for _, mnemonic, args in lines if mnemonic == CHIP_OP_JMP)
+    return [
+        Instruction(
+            CANDIDATE_SOURCE,
+            "l{}:".format(index) if index in targets else None,
+            condition,
+            mnemonic,
+            ["l{}".format(args[0])] if mnemonic == CHIP_OP_JMP else list(args),
+        )
+        for index, (condition, mnemonic, args) in enumerate(lines)
+    ]
+
+
+def _line_variants(line: tuple, length: int) -> [tuple]:
+    """every way of filling in a line's jump target in a program of the given length"""
+    mnemonic, args = line
+    if mnemonic == CHIP_OP_JMP:
+        return [(mnemonic, (target,)) for target in range(length)]
+    return [line]
+
+
+def _extend(prefix: tuple, length: int, choices: [tuple], has_sleep: bool, has_test: bool,
+            needs_test: bool) -> typing.Iterator[tuple]:
+    """
+    yields every candidate starting with prefix, leaving out those whose shape rules them out before they are run:
+    ones that can't sleep, that use +/- without a test, or that jump to the line that would run next anyway
+    """
+    index = len(prefix)
+    if index == length:
+        yield prefix
+        return
+    last = index == length - 1
+    for choice in choices:
+        condition, mnemonic, args = choice
+        if mnemonic == CHIP_OP_JMP and (args[0] == (index + 1) % length or (condition is None and args[0] == index)):
+            continue
+        sleeps = has_sleep or mnemonic in SLEEP_MNEMONICS
+        tests = has_test or mnemonic in TEST_MNEMONICS
+        flagged = needs_test or condition in ('+', '-')
+        if last and (not sleeps or (flagged and not tests)):
+            continue
+        yield from _extend(prefix + (choice,), length, choices, sleeps, tests, flagged)
+
+
+def check_candidate(program: Program, specification: Specification) -> typing.Optional[int]:
+    """
+    :return: the power a program uses over every test case if it produces the expected outputs in all of them,
+             otherwise None
+    """
+    try:
+        # a short run of the first case rules out most candidates cheaply
+        probe = specification.cases[0].truncated(PROBE_TIME_UNITS)
+        trace, _ = run_case(program, probe, specification.instruction_limit)
+        if trace[:probe.time_units] != specification.expected[0][:probe.time_units]:
+            return None
+
+        power = 0
+        for case, expected in zip(specification.cases, specification.expected):
+            trace, case_power = run_case(program, case, specification.instruction_limit)
+            if trace != expected:
+                return None
+            power += case_power
+        return power
+    except SimulationError:
+        return None
+
+
+def _decode_choice(choice: tuple, chip: ChipInfo) -> tuple:
+    """
+    decodes a single candidate line into the simulator's operations once, rather than once per candidate using it,
+    jumps are decoded as jumps to operation 0 and given their real target when a candidate is put together
+    """
+    condition, mnemonic, args = choice
+    if mnemonic == CHIP_OP_JMP:
+        instruction = Instruction(CANDIDATE_SOURCE, "l0:", condition, mnemonic, ["l0"])
+    else:
+        instruction = Instruction(CANDIDATE_SOURCE, None, condition, mnemonic, list(args))
+    return tuple(decode_program([instruction], chip).ops)
+
+
+def _candidate_program(candidate: tuple, decoded: typing.Dict[tuple, tuple], chip: ChipInfo) -> Program:
+    """puts together a candidate's decoded lines, pointing jumps at the first operation of their target line"""
+    starts = []
+    count = 0
+    for choice in candidate:
+        starts.append(count)
+        count += len(decoded[choice])
+    ops = []
+    sources = []
+    for index, choice in enumerate(candidate):
+        for op in decoded[choice]:
+            if op[0] == OP_JMP:
+                op = op[:3] + (starts[choice[2][0]],) + op[4:]
+            ops.append(op)
+            sources.append(index)
+    return Program(ops, sources, chip)
+
+
+# the parts of a search that every worker process shares, set once per process by _start_worker
+_worker_search = None
+# the choices for each line of a candidate, by the length of the candidate
+_worker_choices = {}
+# the decoded operations of each choice of line
+_worker_decoded = {}
+
+
+def _start_worker(chip, specification, lines, conditions):
+    global _worker_search
+    _worker_search = (chip, specification, lines, conditions)
+    _worker_choices.clear()
+    _worker_decoded.clear()
+
+
+def _search_prefix(length: int, first: int, deadline: float, power_limit: int) -> (list, int, bool):
+    """
+    tries every candidate of the given length whose first line is the given choice, this runs in a worker process
+    :param first: index into the combined list of (condition, line) choices for the first line
+    :param power_limit: candidates have to use less power than this to be worth keeping
+    :return: tuple of the (power, lines) of the best candidate found (or None), how many candidates were run and
+             whether the deadline was reached
+    """
+    chip, specification, lines, conditions = _worker_search
+    choices = _worker_choices.get(length, None)
+    if choices is None:
+        choices = _worker_choices[length] = [
+            (condition,) + variant
+            for condition in conditions
+            for line in lines
+            for variant in _line_variants(line, length)
+        ]
+        for choice in choices:
+            if choice not in _worker_decoded:
+                _worker_decoded[choice] = _decode_choice(choice, chip)
+    best = None
+    examined = 0
+    condition, mnemonic, args = choices[first]
+    for candidate in _extend((choices[first],), length, choices, mnemonic in SLEEP_MNEMONICS,
+                             mnemonic in TEST_MNEMONICS, condition in ('+', '-')):
+        examined += 1
+        # checking the clock on every candidate would cost more than some candidates do
+        if examined % 256 == 0 and time.time() > deadline:
+            return best, examined, True
+        power = check_candidate(_candidate_program(candidate, _worker_decoded, chip), specification)
+        if power is not None and power < power_limit and (best is None or power < best[0]):
+            best = (power, candidate)
+    return best, examined, False
+
+
+def superoptimise(instructions: [Instruction], chip: ChipInfo, cases: [TestCase],
+                  objective: str = OBJECTIVE_LINES, time_budget: float = 60.0, processes: int = None,
+                  mnemonics: typing.Iterable[str] = None) -> SearchResult:
+    """
+    searches for a program that behaves the same as the given one in every test case, trying programs one line
+    longer at a time, equivalence is only as good as the test cases
+    :param instructions: the assembled program to improve on
+    :param chip: the chip the program runs on
+    :param cases: the inputs the program is tested with, what the original program outputs for them is the target
+    :param objective: OBJECTIVE_LINES stops at the shortest length with any equivalent program and picks the one
+                      using the least power, OBJECTIVE_POWER tries every length up to the original's and picks the
+                      program using the least power
+    :param time_budget: how long to search for, in seconds
+    :param processes: the size of the process pool, defaults to the number of CPUs, 1 searches in this process
+    :param mnemonics: the instructions to build candidates from, see candidate_lines() for the default, the
+                      search grows very quickly with the number of different lines so widening this costs a lot
+    :return: the best program found
+    """
+    deadline = time.time() + time_budget
+    specification = specification_from_program(instructions, chip, cases)
+    original = decode_program(instructions, chip)
+    original_power = sum(run_case(original, case)[1] for case in cases)
+    # labels on lines of their own aren't instructions, so they don't count towards the score
+    original_lines = sum(1 for instruction in instructions if instruction.mnemonic is not None)
+    lines = candidate_lines(instructions, chip, mnemonics)
+    # +/- are only any use with a test to set the flag, and @ is only tried if the original program uses it
+    used_conditions = set(instruction.condition for instruction in instructions)
+    has_tests = any(mnemonic in TEST_MNEMONICS for mnemonic, _ in lines)
+    conditions = tuple(
+        condition for condition in CONDITIONS
+        if condition is None or (condition == '@' and '@' in used_conditions) or (condition != '@' and has_tests)
+    )
+    log.verbose("superoptimiser trying {} different lines with conditions {}".format(len(lines), conditions))
+
+    max_length = original_lines if objective == OBJECTIVE_POWER else original_lines - 1
+    best = None
+    examined = 0
+    complete = True
+    processes = processes or os.cpu_count() or 1
+    shared = (chip, specification, lines, conditions)
+    pool = ProcessPoolExecutor(processes, initializer=_start_worker, initargs=shared) if processes > 1 else None
+    if pool is None:
+        _start_worker(*shared)
+    try:
+        for length in range(1, max_length + 1):
+            first_choices = len(conditions) * sum(len(_line_variants(line, length)) for line in lines)
+            # a shorter program is worth having whatever its power, otherwise it has to beat the best so far
+            if objective == OBJECTIVE_LINES:
+                power_limit = float('inf') if best is None else best[0]
+            else:
+                power_limit = original_power if best is None else best[0]
+            arguments = (
+                [length] * first_choices, range(first_choices), [deadline] * first_choices,
+                [power_limit] * first_choices
+            )
+            if pool is not None:
+                results = pool.map(_search_prefix, *arguments, timeout=max(0.0, deadline - time.time()) + 1.0)
+            else:
+                results = map(_search_prefix, *arguments)
+            try:
+                for found, count, timed_out in results:
+                    examined += count
+                    complete = complete and not timed_out
+                    if found is not None and (best is None or found[0] < best[0]):
+                        best = found
+            except FutureTimeoutError:
+                complete = False
+            log.verbose("superoptimiser finished length {}, {} candidates so far".format(length, examined))
+            if not complete or (objective == OBJECTIVE_LINES and best is not None):
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if best is None:
+        return SearchResult(None, original_lines, original_power, original_lines, original_power, examined, complete)
+    power, candidate = best
+    return SearchResult(
+        _build_candidate(candidate), len(candidate), power, original_lines, original_power, examined, complete
+    )
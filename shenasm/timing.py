@@ -0,0 +1,456 @@
+import heapq
+import typing
+
+
+from .instructions import CHIP_OP_SLP, CHIP_OP_SLX, CHIP_OP_GEN, VIRTUAL_INSTRUCTIONS
+from .intermediate import IntermediateGraph, IntermediateNode
+from .optimise import literal_value
+from .parse import Instruction
+from .source import SourcePosition
+from .errors import IssueLog
+from . import codes
+
+
+# the condition of instructions that only run the first time they are reached
+ONCE_CONDITIONAL = '@'
+
+
+def instruction_cost(instruction: Instruction) -> int:
+    """
+    :return: the power used each time the instruction is reached, the game charges one unit per instruction
+             executed, labels and virtual instructions cost nothing and @ instructions are only paid for once
+             so are left out of the steady state
+    """
+    if instruction.mnemonic is None or instruction.mnemonic in VIRTUAL_INSTRUCTIONS:
+        return 0
+    if instruction.condition == ONCE_CONDITIONAL:
+        return 0
+    return 1
+
+
+def is_sleep_point(instruction: Instruction, symbols: typing.Dict[str, str] = None) -> bool:
+    """
+    whether the chip stops executing for the rest of the time unit at this instruction, slx is counted even though
+    it carries on immediately if data is already waiting, gen sleeps unless both its durations are known to be zero
+    or less
+    :param instruction: the instruction, as written in the source
+    :param symbols: the value of each alias and const, so that a duration given by a const is seen as its value
+    """
+    if instruction.condition == ONCE_CONDITIONAL:
+        return False
+    if instruction.mnemonic in (CHIP_OP_SLP, CHIP_OP_SLX):
+        return True
+    if instruction.mnemonic == CHIP_OP_GEN:
+        symbols = symbols or {}
+        for arg in instruction.args[1:]:
+            duration = literal_value(symbols.get(arg, arg))
+            if duration is None or duration > 0:
+                return True
+    return False
+
+
+class RegionCost(object):
+    """what running one IR region costs, split around any sleeps in it"""
+
+    def __init__(self, region: IntermediateNode, symbols: typing.Dict[str, str] = None):
+        self._region = region
+        # the cost of each run of instructions between sleeps, the first run includes the sleep that ends it
+        runs = [0]
+        sleep_positions = []
+        for instruction in region.instructions:
+            runs[-1] += instruction_cost(instruction)
+            if is_sleep_point(instruction, symbols):
+                sleep_positions.append(instruction.source_pos)
+                runs.append(0)
+        self._runs = runs
+        self._sleep_positions = sleep_positions
+
+    @property
+    def region(self):
+        return self._region
+
+    @property
+    def instructions(self):
+        """how many instructions run, and so how much power is used, each time the region runs"""
+        return sum(self._runs)
+
+    @property
+    def sleeps(self):
+        return len(self._sleep_positions) > 0
+
+    @property
+    def sleep_positions(self) -> [SourcePosition]:
+        return self._sleep_positions
+
+    @property
+    def before_sleep(self):
+        """the cost up to and including the first sleep, or of the whole region if it doesn't sleep"""
+        return self._runs[0]
+
+    @property
+    def after_sleep(self):
+        """the cost of what runs after the last sleep, at the start of a later time unit"""
+        return self._runs[-1]
+
+    @property
+    def between_sleeps(self) -> [int]:
+        """the cost of each whole time unit spent between two sleeps of this region"""
+        return self._runs[1:-1]
+
+
+class TimeUnitEstimate(object):
+    """the instructions executed in a time unit that starts at a particular point in the program"""
+
+    def __init__(self, start: SourcePosition, region: IntermediateNode, minimum: typing.Optional[int],
+                 maximum: typing.Optional[int]):
+        self._start = start
+        self._region = region
+        self._minimum = minimum
+        self._maximum = maximum
+
+    @property
+    def start(self):
+        """the sleep that the time unit starts after, or the first instruction for the first time unit"""
+        return self._start
+
+    @property
+    def region(self):
+        return self._region
+
+    @property
+    def minimum(self):
+        """the fewest instructions that can run before the next sleep, None if no path reaches a sleep"""
+        return self._minimum
+
+    @property
+    def maximum(self):
+        """the most instructions that can run before the next sleep, None if a loop without a sleep makes it unbounded"""
+        return self._maximum
+
+
+class PowerEstimate(object):
+    """the static estimate of a program's power use, from estimate_power()"""
+
+    def __init__(self, regions: [RegionCost], time_units: [TimeUnitEstimate],
+                 unbounded_loops: [[IntermediateNode]], sleepless_loops: [[IntermediateNode]]):
+        self._regions = regions
+        self._time_units = time_units
+        self._unbounded_loops = unbounded_loops
+        self._sleepless_loops = sleepless_loops
+
+    @property
+    def regions(self) -> [RegionCost]:
+        """the cost of every reachable region"""
+        return self._regions
+
+    @property
+    def time_units(self) -> [TimeUnitEstimate]:
+        """the estimate for each point a time unit can start at: the program's start and after each sleep"""
+        return self._time_units
+
+    @property
+    def unbounded_loops(self) -> [[IntermediateNode]]:
+        """the regions of each loop that can run without sleeping and has no loop bound"""
+        return self._unbounded_loops
+
+    @property
+    def sleepless_loops(self) -> [[IntermediateNode]]:
+        """the regions of each loop that, once entered, can never reach a sleep again"""
+        return self._sleepless_loops
+
+    @property
+    def minimum_per_time_unit(self):
+        minimums = [unit.minimum for unit in self._time_units if unit.minimum is not None]
+        return min(minimums) if minimums else None
+
+    @property
+    def maximum_per_time_unit(self):
+        """the most power any time unit can use, None if that is unbounded"""
+        if any(unit.maximum is None for unit in self._time_units) or not self._time_units:
+            return None
+        return max(unit.maximum for unit in self._time_units)
+
+    def format_text(self) -> str:
+        def describe(value):
+            return "unbounded" if value is None else str(value)
+
+        lines = ["power per region:"]
+        for cost in self._regions:
+            instructions = cost.region.instructions
+            lines.append("  {:<40} {:>4} per run{}".format(
+                "{}-{}".format(instructions[0].source_pos, instructions[-1].source_pos.line),
+                cost.instructions,
+                ", sleeps" if cost.sleeps else ""
+            ))
+        lines.append("power per time unit:")
+        for unit in self._time_units:
+            lines.append("  from {:<40} min {:>9} max {:>9}".format(
+                str(unit.start), describe(unit.minimum), describe(unit.maximum)
+            ))
+        lines.append("program: {} to {} per time unit".format(
+            describe(self.minimum_per_time_unit), describe(self.maximum_per_time_unit)
+        ))
+        return "\n".join(lines)
+
+
+def region_label(region: IntermediateNode) -> typing.Optional[str]:
+    label = region.first_instruction.label
+    return label[:-1] if label is not None else None
+
+
+def estimate_power(ir_nodes: IntermediateGraph, loop_bounds: typing.Dict[str, int] = None) -> PowerEstimate:
+    """
+    estimates the instructions executed (and so power used) in each time unit, by following every path from each
+    point a time unit can start at (the start of the program and just after each sleep) to the next sleep,
+    both branches of every conditional are assumed possible
+    :param ir_nodes: the program's IR graph
+    :param loop_bounds: the most times each loop that doesn't sleep can go round, keyed by a label in the loop,
+                        bounds of loops nested inside one another multiply, loops without a bound make the
+                        maximum of any time unit that can enter them unbounded
+    :return: the estimate
+    """
+    loop_bounds = loop_bounds or {}
+    graph = _SleepFreeGraph(ir_nodes)
+    minimums = graph.shortest_to_sleep()
+    maximums, loops = graph.longest_to_sleep(loop_bounds)
+
+    time_units = []
+    for node, (start, region) in graph.starts:
+        time_units.append(TimeUnitEstimate(start, region, minimums[node], maximums[node]))
+        # a region that sleeps more than once spends whole time units between its sleeps
+        if node != graph.entry_node:
+            cost = graph.costs[region]
+            for position, run in zip(cost.sleep_positions, cost.between_sleeps):
+                time_units.append(TimeUnitEstimate(position, region, run, run))
+
+    return PowerEstimate(
+        [graph.costs[region] for region in ir_nodes if region in graph.costs],
+        time_units,
+        [graph.loop_regions(members) for members, bounded in loops if not bounded],
+        # every node of a loop can reach the same places, so checking one is enough
+        [graph.loop_regions(members) for members, _ in loops if minimums[members[0]] is None]
+    )
+
+
+class _SleepFreeGraph(object):
+    """
+    the paths a program can take within a time unit: every reachable region has a node for its instructions up to
+    its first sleep, and regions that sleep have a second node for what runs after their last sleep, nodes that end
+    in a sleep have no successors
+    """
+
+    def __init__(self, ir_nodes: IntermediateGraph):
+        # the entry comes first in reverse postorder
+        order = ir_nodes.reverse_postorder
+        self.costs = {region: RegionCost(region, ir_nodes.symbols) for region in order}
+        self.program_order = {region: number for number, region in enumerate(ir_nodes)}
+
+        # node numbers: region i's entry node is i, wake nodes for sleeping regions are numbered after them
+        index = {region: number for number, region in enumerate(order)}
+        self.node_cost = [self.costs[region].before_sleep for region in order]
+        self.node_region = list(order)
+        self.successors = [
+            [] if self.costs[region].sleeps else [index[successor] for successor in region.successors]
+            for region in order
+        ]
+        # whether following the node ends the time unit
+        self.ends_in_sleep = [self.costs[region].sleeps for region in order]
+
+        self.entry_node = 0 if order else None
+        self.starts = []
+        if order:
+            self.starts.append((0, (order[0].first_instruction.source_pos, order[0])))
+        # wake nodes are numbered in program order, so that time units are listed in the order they appear
+        for region in ir_nodes:
+            cost = self.costs.get(region, None)
+            if cost is not None and cost.sleeps:
+                node = len(self.node_cost)
+                self.node_cost.append(cost.after_sleep)
+                self.node_region.append(region)
+                self.successors.append([index[successor] for successor in region.successors])
+                self.ends_in_sleep.append(False)
+                self.starts.append((node, (cost.sleep_positions[-1], region)))
+
+        self.components, self.component_of = self._strongly_connected_components()
+        # a loop of regions with no instructions in them (a program of only const and alias lines, which wraps
+        # around onto itself) uses no power going round, so it is treated as idling rather than as a sleepless loop
+        self.idle = set()
+        for members in self.components:
+            if self._is_loop(members) and sum(self.node_cost[node] for node in members) == 0:
+                self.idle.update(members)
+
+    def _is_loop(self, members: [int]) -> bool:
+        return len(members) > 1 or members[0] in self.successors[members[0]]
+
+    def shortest_to_sleep(self) -> [typing.Optional[int]]:
+        """
+        :return: for every node, the fewest instructions from its start to the end of the time unit,
+                 None if it can't reach a sleep
+        """
+        predecessors = [[] for _ in self.node_cost]
+        for node, successors in enumerate(self.successors):
+            for successor in successors:
+                predecessors[successor].append(node)
+
+        # dijkstra backwards from every node that ends the time unit, a dead end (a jump to a label that doesn't
+        # exist) or an idle loop is treated as ending it too
+        distance = [None] * len(self.node_cost)
+        queue = [
+            (self.node_cost[node], node) for node in range(len(self.node_cost))
+            if self.ends_in_sleep[node] or not self.successors[node] or node in self.idle
+        ]
+        heapq.heapify(queue)
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if distance[node] is not None:
+                continue
+            distance[node] = cost
+            for predecessor in predecessors[node]:
+                if distance[predecessor] is None:
+                    heapq.heappush(queue, (cost + self.node_cost[predecessor], predecessor))
+        return distance
+
+    def loop_regions(self, members: [int]) -> [IntermediateNode]:
+        """:return: the regions of a loop's nodes in program order"""
+        return sorted({self.node_region[node] for node in members}, key=self.program_order.get)
+
+    def longest_to_sleep(self, loop_bounds) -> ([typing.Optional[int]], [([int], bool)]):
+        """
+        :return: for every node, the most instructions from its start to the end of the time unit (None if that
+                 is unbounded), along with the nodes of every loop that doesn't sleep and whether it was bounded
+        """
+        components, component_of = self.components, self.component_of
+        longest = [None] * len(components)
+        unbounded = [False] * len(components)
+        loops = []
+
+        # components come out of tarjan's algorithm with every component after those it leads to
+        for number, members in enumerate(components):
+            cost = sum(self.node_cost[node] for node in members)
+            is_loop = self._is_loop(members) and members[0] not in self.idle
+            is_unbounded = False
+            if is_loop:
+                iterations = 1
+                bounded = False
+                for node in members:
+                    bound = loop_bounds.get(region_label(self.node_region[node]), None)
+                    if bound is not None and node < len(self.costs):
+                        iterations *= bound
+                        bounded = True
+                if bounded:
+                    cost *= iterations
+                else:
+                    is_unbounded = True
+                loops.append((members, bounded))
+
+            after = 0
+            for node in members:
+                for successor in self.successors[node]:
+                    successor_component = component_of[successor]
+                    if successor_component == number:
+                        continue
+                    if unbounded[successor_component]:
+                        is_unbounded = True
+                    else:
+                        after = max(after, longest[successor_component])
+
+            unbounded[number] = is_unbounded
+            longest[number] = None if is_unbounded else cost + after
+
+        return [longest[component_of[node]] for node in range(len(self.node_cost))], loops
+
+    def _strongly_connected_components(self):
+        # iterative tarjan, so that large programs don't hit the recursion limit
+        count = len(self.node_cost)
+        index = [None] * count
+        lowlink = [0] * count
+        on_stack = [False] * count
+        stack = []
+        components = []
+        component_of = [None] * count
+        counter = 0
+
+        for root in range(count):
+            if index[root] is not None:
+                continue
+            work = [(root, iter(self.successors[root]))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            while work:
+                node, successors = work[-1]
+                for successor in successors:
+                    if index[successor] is None:
+                        index[successor] = lowlink[successor] = counter
+                        counter += 1
+                        stack.append(successor)
+                        on_stack[successor] = True
+                        work.append((successor, iter(self.successors[successor])))
+                        break
+                    elif on_stack[successor]:
+                        lowlink[node] = min(lowlink[node], index[successor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component_of[member] = len(components)
+                            members.append(member)
+                            if member == node:
+                                break
+                        components.append(members)
+        return components, component_of
+
+
+def verify_timing(issues: IssueLog, ir_nodes: IntermediateGraph, budget: int = None,
+                  loop_bounds: typing.Dict[str, int] = None) -> PowerEstimate:
+    """
+    warns about loops that never reach a sleep, and so use power every time unit, and about time units that
+    can run more instructions than the budget allows
+    :param issues: collection of issues generated during assembler execution
+    :param ir_nodes: the program's IR graph
+    :param budget: the most instructions a time unit should run, None to only check for loops that never sleep
+    :param loop_bounds: passed on to estimate_power()
+    :return: the estimate the checks were made against
+    """
+    estimate = estimate_power(ir_nodes, loop_bounds)
+
+    for loop in estimate.sleepless_loops:
+        issues.warning(
+            loop[0].first_instruction.source_pos,
+            "loop between lines {} and {} never reaches a slp, slx or gen, so it will use power every time unit "
+            "unless it blocks on XBus",
+            loop[0].first_instruction.source_pos.line,
+            loop[-1].last_instruction.source_pos.line,
+            code=codes.SLEEPLESS_LOOP
+        )
+
+    if budget is not None:
+        for unit in estimate.time_units:
+            # loops that never sleep have already been warned about
+            if unit.minimum is None:
+                continue
+            if unit.maximum is None:
+                issues.warning(
+                    unit.start,
+                    "the time unit starting here can go round a loop without sleeping any number of times, "
+                    "bound the loop to check it against the budget of {} instructions",
+                    budget,
+                    code=codes.UNBOUNDED_LOOP
+                )
+            elif unit.maximum > budget:
+                issues.warning(
+                    unit.start,
+                    "up to {} instructions can run in the time unit starting here, over the budget of {}",
+                    unit.maximum,
+                    budget,
+                    code=codes.OVER_TIME_BUDGET
+                )
+
+    return estimate
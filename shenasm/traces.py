@@ -0,0 +1,303 @@
+"""
+records the value on every pin of a chip or board, a row per time unit, into memory-mapped NumPy files
+
+this module needs numpy, which the rest of shenasm doesn't, so it isn't imported by the package itself:
+
+    import shenasm.traces
+"""
+
+import typing
+
+import numpy as np
+
+
+from .board import Board, NET_SIMPLE
+from .chips import ChipInfo, REG_TYPE_SIMPLE, REG_TYPE_XBUS
+from .sim import Chip
+
+
+# every value a pin can carry fits in 16 bits
+VALUE_DTYPE = np.int16
+
+# stored for an XBus pin in a time unit in which nothing was sent or received on it
+NO_VALUE = np.iinfo(VALUE_DTYPE).min
+
+# rows are gathered in memory and written out this many at a time, and traces are compared and exported
+# this many rows at a time, so that neither needs the whole trace in memory
+CHUNK_ROWS = 4096
+
+
+class PinTrace(object):
+    """
+    a recorded trace: a memory-mapped array with a row per time unit and a named int16 field per pin, a simple pin
+    holds the value on its wire at the end of the time unit, an XBus pin holds the last value sent or received on
+    it during the time unit, or NO_VALUE
+    """
+
+    def __init__(self, data: np.ndarray):
+        self._data = data
+
+    @classmethod
+    def open(cls, path: str) -> 'PinTrace':
+        """opens a trace written earlier, read only and without loading it"""
+        return cls(np.load(path, mmap_mode='r'))
+
+    @property
+    def data(self) -> np.ndarray:
+        """the structured array itself, slicing it only reads the rows sliced"""
+        return self._data
+
+    @property
+    def columns(self) -> [str]:
+        """the pins recorded, as 'pin' for a single chip or 'chip.pin' for a board"""
+        return list(self._data.dtype.names)
+
+    @property
+    def kinds(self) -> typing.Dict[str, str]:
+        """REG_TYPE_SIMPLE or REG_TYPE_XBUS for each column"""
+        return {name: self._data.dtype.fields[name][2].split(" ", 1)[0] for name in self._data.dtype.names}
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """the trace as a plain two dimensional int16 array, a view so nothing is copied"""
+        return self._data.view(VALUE_DTYPE).reshape(len(self._data), len(self._data.dtype.names))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, item):
+        return self._data[item]
+
+    def flush(self):
+        if isinstance(self._data, np.memmap):
+            self._data.flush()
+
+
+def _trace_dtype(columns: [(str, str)]) -> np.dtype:
+    # the pin's kind is kept in the field's title, so that it is saved along with the trace
+    return np.dtype([(("{} {}".format(kind, name), name), VALUE_DTYPE) for name, kind in columns])
+
+
+def _pin_columns(chip_info: ChipInfo, prefix: str = "") -> [(str, str, str)]:
+    """:return: the name, kind and register name of every pin on a chip"""
+    return [
+        (prefix + register.name, register.type, register.name)
+        for register in chip_info.registers.values()
+        if register.type in (REG_TYPE_SIMPLE, REG_TYPE_XBUS)
+    ]
+
+
+class _RecordingIO(object):
+    """
+    stands in for a chip's io while it is recorded, noting each XBus value that is sent or received, the chip's
+    own io does the rest and simple I/O goes to it directly
+    """
+
+    def __init__(self, io, row: list, indices: typing.Dict[str, int]):
+        self._io = io
+        self._row = row
+        self._indices = indices
+        self.read_simple = io.read_simple
+        self.write_simple = io.write_simple
+        self.xbus_ready = io.xbus_ready
+
+    def xbus_read(self, pin):
+        value = self._io.xbus_read(pin)
+        if value is not None and pin in self._indices:
+            self._row[self._indices[pin]] = value
+        return value
+
+    def xbus_write(self, pin, value):
+        written = self._io.xbus_write(pin, value)
+        if written and pin in self._indices:
+            self._row[self._indices[pin]] = value
+        return written
+
+
+class _Recorder(object):
+    """gathers rows and writes them out to the trace a chunk at a time"""
+
+    def __init__(self, path: str, columns: [(str, str)], time_units: int):
+        self._data = np.lib.format.open_memmap(path, mode='w+', dtype=_trace_dtype(columns), shape=(time_units,))
+        self._matrix = self._data.view(VALUE_DTYPE).reshape(time_units, len(columns))
+        self._xbus = [index for index, (_, kind) in enumerate(columns) if kind == REG_TYPE_XBUS]
+        self._rows = []
+        self._written = 0
+        # filled in as each time unit runs, the XBus columns are cleared again for the next
+        self.row = [NO_VALUE if kind == REG_TYPE_XBUS else 0 for _, kind in columns]
+
+    def end_row(self, simple_values: typing.Iterable[typing.Tuple[int, int]]):
+        """
+        finishes the current time unit
+        :param simple_values: the index and value of each simple pin column
+        """
+        row = self.row
+        for index, value in simple_values:
+            row[index] = value
+        self._rows.append(list(row))
+        for index in self._xbus:
+            row[index] = NO_VALUE
+        if len(self._rows) >= CHUNK_ROWS:
+            self._write()
+
+    def _write(self):
+        if self._rows:
+            self._matrix[self._written:self._written + len(self._rows)] = self._rows
+            self._written += len(self._rows)
+            self._rows = []
+
+    def finish(self) -> PinTrace:
+        self._write()
+        trace = PinTrace(self._data)
+        trace.flush()
+        return trace
+
+
+def record_chip(chip: Chip, path: str, time_units: int, start: int = 0) -> PinTrace:
+    """
+    runs a single chip for a number of time units, recording every pin
+    :param chip: the chip to run, a Chip or CompiledChip using a shenasm.sim.PinIO
+    :param path: the .npy file to write the trace to
+    :param time_units: how many time units to run and record
+    :param start: the time unit to start at
+    :return: the trace, still backed by the file
+    """
+    columns = _pin_columns(chip.program.chip)
+    recorder = _Recorder(path, [(name, kind) for name, kind, _ in columns], time_units)
+    io = chip.io
+    simple = [(index, pin) for index, (_, kind, pin) in enumerate(columns) if kind == REG_TYPE_SIMPLE]
+    inputs = io.simple_inputs
+    outputs = io.simple_outputs
+
+    chip.io = _RecordingIO(io, recorder.row, {pin: index for index, (_, kind, pin) in enumerate(columns)})
+    try:
+        for now in range(start, start + time_units):
+            chip.run(now)
+            # a lone chip's pin reads as the larger of what it drives and what is driven onto it
+            recorder.end_row((index, max(inputs.get(pin, 0), outputs.get(pin, 0))) for index, pin in simple)
+    finally:
+        chip.io = io
+    return recorder.finish()
+
+
+def record_board(board: Board, path: str, time_units: int) -> PinTrace:
+    """
+    runs a board for a number of time units from where it is, recording every pin of every chip
+    :param path: the .npy file to write the trace to
+    :return: the trace, still backed by the file
+    """
+    columns = []
+    simple = []
+    chips = []
+    for name, slot in board.slots.items():
+        pins = _pin_columns(slot.chip.program.chip, name + ".")
+        indices = {}
+        for name_and_pin, kind, pin in pins:
+            index = len(columns)
+            columns.append((name_and_pin, kind))
+            indices[pin] = index
+            net = slot.port.nets.get(pin, None)
+            if kind == REG_TYPE_SIMPLE and net is not None and net.kind == NET_SIMPLE:
+                simple.append((index, net.driven))
+        chips.append((slot.chip, indices))
+
+    recorder = _Recorder(path, columns, time_units)
+    replaced = []
+    try:
+        for chip, indices in chips:
+            replaced.append((chip, chip.io))
+            chip.io = _RecordingIO(chip.io, recorder.row, indices)
+        for _ in range(time_units):
+            board.run_until(board.now + 1)
+            # every terminal on a wire reads the largest value driven onto it, unconnected pins stay at 0
+            recorder.end_row((index, max(driven.values(), default=0)) for index, driven in simple)
+    finally:
+        for chip, io in replaced:
+            chip.io = io
+    return recorder.finish()
+
+
+def differences(first: PinTrace, second: PinTrace, limit: int = None) \
+        -> typing.Iterator[typing.Tuple[int, str, int, int]]:
+    """
+    compares two traces of the same pins a chunk at a time, over the rows they both have
+    :param limit: the most differences to report, or None for all of them
+    :return: the row, column and both values of each difference, in row order
+    """
+    if first.columns != second.columns:
+        raise ValueError("traces record different pins: {} and {}".format(first.columns, second.columns))
+    columns = first.columns
+    a = first.matrix
+    b = second.matrix
+    reported = 0
+    for start in range(0, min(len(a), len(b)), CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, len(a), len(b))
+        rows, cols = np.nonzero(a[start:end] != b[start:end])
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            yield start + row, columns[col], int(a[start + row, col]), int(b[start + row, col])
+            reported += 1
+            if limit is not None and reported >= limit:
+                return
+
+
+def _vcd_identifier(index: int) -> str:
+    # identifiers are made from the printable characters VCD allows
+    characters = []
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 94)
+        characters.append(chr(33 + remainder))
+    return "".join(characters)
+
+
+def _vcd_value(value: int, identifier: str) -> str:
+    if value == NO_VALUE:
+        return "bx {}".format(identifier)
+    return "b{:b} {}".format(value & 0xffff, identifier)
+
+
+def write_vcd(trace: PinTrace, handle: typing.TextIO, timescale: str = "1 ms"):
+    """
+    exports a trace as a value change dump for waveform viewers, a time unit per tick of the timescale, each chip
+    becomes a scope and each pin a 16 bit integer that is undefined while nothing is on an XBus pin
+    """
+    columns = trace.columns
+    kinds = trace.kinds
+    identifiers = [_vcd_identifier(index) for index in range(len(columns))]
+
+    handle.write("$timescale {} $end\n".format(timescale))
+    scopes = {}
+    for index, name in enumerate(columns):
+        scope, _, pin = name.rpartition(".")
+        scopes.setdefault(scope, []).append((pin, index))
+    for scope, pins in scopes.items():
+        if scope:
+            handle.write("$scope module {} $end\n".format(scope))
+        for pin, index in pins:
+            handle.write("$var {} 16 {} {} $end\n".format(
+                "wire" if kinds[columns[index]] == REG_TYPE_SIMPLE else "integer", identifiers[index], pin
+            ))
+        if scope:
+            handle.write("$upscope $end\n")
+    handle.write("$enddefinitions $end\n")
+
+    matrix = trace.matrix
+    if len(matrix) < 1:
+        return
+    previous = matrix[0]
+    handle.write("#0\n$dumpvars\n")
+    for index, value in enumerate(previous.tolist()):
+        handle.write(_vcd_value(value, identifiers[index]) + "\n")
+    handle.write("$end\n")
+
+    for start in range(1, len(matrix), CHUNK_ROWS):
+        chunk = matrix[start:start + CHUNK_ROWS]
+        # compare each row with the one before it, including the last row of the previous chunk
+        changed = chunk != np.concatenate(([previous], chunk[:-1]))
+        for row in np.flatnonzero(changed.any(axis=1)).tolist():
+            handle.write("#{}\n".format(start + row))
+            values = chunk[row]
+            for index in np.flatnonzero(changed[row]).tolist():
+                handle.write(_vcd_value(int(values[index]), identifiers[index]) + "\n")
+        previous = chunk[-1]
+    handle.write("#{}\n".format(len(matrix)))
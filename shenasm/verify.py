@@ -0,0 +1,314 @@
+import csv
+import json
+import typing
+
+
+from .board import Board, BoardSpec, NET_SIMPLE, assemble_board, build_board
+from .errors import IssueLog
+from .source import SourcePosition
+from .sim import SimulationError, DEFAULT_INSTRUCTION_LIMIT
+from . import codes
+from . import log
+
+
+FORMAT_CSV = 'csv'
+FORMAT_JSON = 'json'
+
+
+class TraceError(Exception):
+    """
+    a trace file that can't be replayed, code is the issue code to report it with and position, when known, is the
+    row it was found in
+    """
+
+    def __init__(self, message: str, code: str, position: SourcePosition = None):
+        super().__init__(message)
+        self.code = code
+        self.position = position
+
+
+class Mismatch(object):
+    """the first output that didn't match the trace"""
+
+    def __init__(self, position: SourcePosition, time: int, terminal: str, expected, actual):
+        self._position = position
+        self._time = time
+        self._terminal = terminal
+        self._expected = expected
+        self._actual = actual
+
+    @property
+    def position(self):
+        """where in the trace file the expected value came from"""
+        return self._position
+
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def terminal(self):
+        return self._terminal
+
+    @property
+    def expected(self):
+        """an integer for a simple output, or the list of values written during the time unit for XBus"""
+        return self._expected
+
+    @property
+    def actual(self):
+        return self._actual
+
+    def __str__(self):
+        return "time unit {}: {} should be {} but was {}".format(
+            self._time, self._terminal, _format_value(self._expected), _format_value(self._actual)
+        )
+
+
+class VerifyResult(object):
+    """the outcome of replaying a trace against a board, with the game's three scores for the solution"""
+
+    def __init__(self, path: str, time_units: int, mismatch: typing.Optional[Mismatch], lines: int, power: int,
+                 cost: int):
+        self._path = path
+        self._time_units = time_units
+        self._mismatch = mismatch
+        self._lines = lines
+        self._power = power
+        self._cost = cost
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def passed(self):
+        return self._mismatch is None
+
+    @property
+    def time_units(self):
+        """how many time units were simulated, up to and including one with a mismatch"""
+        return self._time_units
+
+    @property
+    def mismatch(self):
+        return self._mismatch
+
+    @property
+    def lines(self):
+        """lines of assembler output, over every chip"""
+        return self._lines
+
+    @property
+    def power(self):
+        """instructions executed over every chip"""
+        return self._power
+
+    @property
+    def cost(self):
+        """the price of every chip on the board"""
+        return self._cost
+
+    def format_text(self) -> str:
+        outcome = "passed" if self.passed else "failed at time unit {}".format(self._mismatch.time)
+        return "{}: {} after {} time units, cost {} power {} lines {}".format(
+            self._path, outcome, self._time_units, self._cost, self._power, self._lines
+        )
+
+
+def _format_value(value) -> str:
+    if isinstance(value, list):
+        return "[{}]".format(" ".join(str(item) for item in value))
+    return str(value)
+
+
+def trace_format(path: str) -> str:
+    return FORMAT_CSV if path.lower().endswith(".csv") else FORMAT_JSON
+
+
+def read_rows(path: str) -> typing.Iterator[typing.Tuple[SourcePosition, typing.Dict[str, typing.Any]]]:
+    """
+    reads a trace one time unit at a time, so that traces of any length can be replayed, from either:
+
+        a CSV file with a header naming the terminal in each column, then a row per time unit
+        a JSON file with an object per line, mapping terminal names to values, one line per time unit
+
+    a JSON file holding a single list of those objects is also accepted, but is read whole
+
+    :return: the position of each time unit's row in the file and the cells in it, by terminal name
+    """
+    with open(path, newline="") as handle:
+        if trace_format(path) == FORMAT_CSV:
+            reader = csv.reader(handle)
+            header = next(reader, None)
+            if header is None:
+                return
+            header = [name.strip() for name in header]
+            for row in reader:
+                if len(row) != len(header):
+                    raise TraceError("line {} has {} columns but the header names {}".format(
+                        reader.line_num, len(row), len(header)
+                    ), codes.TRACE_INVALID)
+                yield SourcePosition(path, reader.line_num), dict(zip(header, row))
+            return
+
+        first = handle.read(1)
+        while first.isspace():
+            first = handle.read(1)
+        if first == "[":
+            try:
+                document = json.loads(first + handle.read())
+            except ValueError as error:
+                raise TraceError("invalid JSON: {}".format(error), codes.TRACE_READ_ERROR)
+            for row in document:
+                yield SourcePosition(path, None), _json_row(row, None)
+            return
+
+        line = first + handle.readline()
+        number = 1
+        while line:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    raise TraceError("line {} is not valid JSON: {}".format(number, error), codes.TRACE_READ_ERROR)
+                yield SourcePosition(path, number), _json_row(row, number)
+            line = handle.readline()
+            number += 1
+
+
+def _json_row(row, number) -> typing.Dict[str, typing.Any]:
+    if not isinstance(row, dict):
+        raise TraceError("{} must be an object of terminal values".format(
+            "each time unit" if number is None else "line {}".format(number)
+        ), codes.TRACE_INVALID)
+    return row
+
+
+def _simple_value(cell) -> typing.Optional[int]:
+    """:return: the value of a simple I/O cell, or None if it is empty"""
+    if cell is None or cell == "":
+        return None
+    if isinstance(cell, int) and not isinstance(cell, bool):
+        return cell
+    try:
+        return int(cell)
+    except (TypeError, ValueError):
+        raise TraceError("'{}' is not an integer".format(cell), codes.TRACE_INVALID)
+
+
+def _xbus_values(cell) -> [int]:
+    """:return: the values in an XBus cell, which is a list, a single integer or integers separated by spaces"""
+    if cell is None:
+        return []
+    items = cell.split() if isinstance(cell, str) else (cell if isinstance(cell, list) else [cell])
+    values = [_simple_value(item) for item in items]
+    if None in values:
+        raise TraceError("XBus values can't be empty", codes.TRACE_INVALID)
+    return values
+
+
+def replay(board: Board, spec: BoardSpec, rows) -> (int, typing.Optional[Mismatch]):
+    """
+    simulates a board against a trace, a time unit per row, stopping at the first output that doesn't match
+
+    at the start of each time unit the row's simple inputs are driven (an empty cell leaves the input as it was) and
+    its XBus values are queued on their inputs, then once the time unit has been simulated the value on each simple
+    output and the values written to each XBus output during it are compared with the row's, an empty simple output
+    cell isn't checked and an empty XBus output cell expects nothing to be written
+
+    :param rows: the output of read_rows()
+    :return: the number of time units simulated and the mismatch that stopped it, if any
+    """
+    inputs = set(spec.inputs)
+    outputs = set(spec.outputs)
+    # each terminal's kind, looked up once rather than for every cell
+    kinds = {}
+    time = 0
+    for position, row in rows:
+        checks = []
+        try:
+            for terminal, cell in row.items():
+                simple = kinds.get(terminal, None)
+                if simple is None:
+                    if terminal not in inputs and terminal not in outputs:
+                        raise TraceError(
+                            "'{}' is not an input or output of the board".format(terminal), codes.TRACE_INVALID
+                        )
+                    simple = kinds[terminal] = board.terminals[terminal].kind == NET_SIMPLE
+
+                if terminal in outputs:
+                    checks.append((terminal, simple, _simple_value(cell) if simple else _xbus_values(cell)))
+                elif simple:
+                    value = _simple_value(cell)
+                    if value is not None:
+                        board.drive(terminal, value)
+                else:
+                    values = _xbus_values(cell)
+                    if values:
+                        board.send(terminal, values)
+        except TraceError as error:
+            error.position = position
+            raise
+
+        board.run_until(time + 1)
+
+        for terminal, simple, expected in checks:
+            if simple:
+                if expected is None:
+                    continue
+                actual = board.value(terminal)
+            else:
+                actual = [value for _, value in board.trace(terminal)]
+            if actual != expected:
+                return time + 1, Mismatch(position, time, terminal, expected, actual)
+
+        board.clear_traces()
+        time += 1
+
+    return time, None
+
+
+def verify(issues: IssueLog, spec: BoardSpec, trace_path: str, instruction_limit: int = DEFAULT_INSTRUCTION_LIMIT,
+           optimise: bool = False) -> typing.Optional[VerifyResult]:
+    """
+    assembles a board's chips and replays a recorded trace against them, a mismatch is reported as an error
+    :param issues: collection of issues generated during assembly and replay
+    :param spec: the board description, its inputs and outputs name the trace's columns
+    :param trace_path: the CSV or JSON trace, see read_rows()
+    :param instruction_limit: passed on to each simulated chip
+    :param optimise: whether to apply the -O passes to each chip before simulating it
+    :return: the result, or None if the board couldn't be assembled or the trace couldn't be replayed
+    """
+    programs = assemble_board(issues, spec, optimise)
+    if programs is None:
+        return None
+    board = build_board(issues, spec, instruction_limit, compiled=True, programs=programs)
+    if board is None:
+        return None
+
+    pos = SourcePosition(trace_path, None)
+    try:
+        time_units, mismatch = replay(board, spec, read_rows(trace_path))
+    except IOError as error:
+        issues.error(pos, "unable to read trace: {}", error, code=codes.TRACE_READ_ERROR)
+        return None
+    except TraceError as error:
+        issues.error(error.position or pos, "{}", error, code=error.code)
+        return None
+    except SimulationError as error:
+        issues.error(pos, "time unit {}: {}", board.now, error, code=codes.TRACE_SIMULATION_FAILED)
+        return None
+
+    if mismatch is not None:
+        issues.error(mismatch.position, "{}", mismatch, code=codes.TRACE_MISMATCH)
+    log.verbose("replayed {} time units of {}".format(time_units, trace_path))
+
+    return VerifyResult(
+        trace_path,
+        time_units,
+        mismatch,
+        sum(len(assembled) for assembled, _ in programs.values()),
+        board.power,
+        sum(chip_info.cost for _, chip_info in programs.values()),
+    )
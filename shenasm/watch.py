@@ -0,0 +1,237 @@
+import hashlib
+import os
+import typing
+
+
+from .errors import IssueLog, Issue, TooManyErrors
+from .source import SourcePosition, IncludeDirective, preprocess_lines, check_include
+from .parse import Instruction, Parser
+from .chips import ChipInfo
+from .intermediate import IntermediateGraph
+from .cache import ParseCache
+from .profiling import Profiler, NULL_PROFILER
+from . import assemble
+from . import codes
+from . import log
+
+
+class CachedFile(object):
+    """
+    a source file that has already been preprocessed and parsed: its instructions grouped into runs
+    between the includes it contains, and the issues found while processing it
+    """
+
+    def __init__(self, path, mtime, digest, items, issues):
+        self.path = path
+        self.mtime = mtime
+        self.digest = digest
+        self.items = items
+        self.issues = issues
+
+
+class BuildResult(object):
+    """the output of one assembly of a program and its includes"""
+
+    def __init__(self, issues: IssueLog, assembled: [Instruction], ir_nodes: IntermediateGraph, changed: bool):
+        self._issues = issues
+        self._assembled = assembled
+        self._ir_nodes = ir_nodes
+        self._changed = changed
+
+    @property
+    def issues(self):
+        return self._issues
+
+    @property
+    def assembled(self):
+        return self._assembled
+
+    @property
+    def ir_nodes(self):
+        return self._ir_nodes
+
+    @property
+    def changed(self):
+        """False if no file changed in a way that affects the output since the previous build"""
+        return self._changed
+
+
+def file_digest(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def parse_file_contents(path: str, data: bytes) -> ([typing.Union[typing.List[Instruction], IncludeDirective]], [object]):
+    """
+    preprocesses and parses a single file without following its includes
+    :param path: the absolute path of the file
+    :param data: the file's contents
+    :return: tuple of the file's items (lists of instructions separated by include directives) and its issues
+    """
+    issues = IssueLog()
+    parser = Parser(issues)
+    items = []
+    lines = []
+    for item in preprocess_lines(issues, data.decode().splitlines(), path):
+        if isinstance(item, IncludeDirective):
+            items.append(parser.parse_lines(lines))
+            items.append(item)
+            lines = []
+        else:
+            lines.append(item)
+    items.append(parser.parse_lines(lines))
+    return items, issues.issues
+
+
+class IncrementalAssembler(object):
+    """
+    assembles a program repeatedly, keeping every file's parsed instructions between builds so that only
+    files whose contents changed are parsed again, and the later passes only run when something changed
+    """
+
+    def __init__(self, chip: ChipInfo, cache: ParseCache = None, max_errors: int = None, optimise: bool = False):
+        """
+        :param chip: the chip being assembled for
+        :param cache: optional on-disk cache consulted before parsing any file this process hasn't seen
+        :param max_errors: if given, each build stops once it has found this many errors
+        :param optimise: whether each build's output is optimised, see shenasm.optimise
+        """
+        self._chip = chip
+        self._cache = cache
+        self._max_errors = max_errors
+        self._optimise = optimise
+        self._files = {}
+        # the (path, digest) of every file in the last build, in the order they were included
+        self._last_key = None
+        self._last_result = None
+        # includes of files that didn't exist during the last build, if they appear we have to rebuild
+        self._missing = set()
+
+    def stale(self) -> bool:
+        """
+        cheaply checks whether any file in the last build has been modified, removed or created
+        :return: True if build() might produce different output
+        """
+        if self._last_result is None:
+            return True
+        for path, _ in self._last_key:
+            cached = self._files.get(path, None)
+            try:
+                if cached is None or os.stat(path).st_mtime_ns != cached.mtime:
+                    return True
+            except OSError:
+                return True
+        return any(os.path.isfile(path) for path in self._missing)
+
+    def build(self, root_path: str, listener: typing.Callable[[Issue], None] = None,
+              profiler: Profiler = NULL_PROFILER) -> BuildResult:
+        """
+        assembles the program rooted at the given file, reusing whatever it can from previous builds
+        :param root_path: the file passed to the assembler
+        :param listener: called with each issue as it is found, issues aren't reported again for a reused build
+        :param profiler: optionally measures each phase of the build, reading and parsing files (or fetching
+            them from memory or the parse cache) is measured as a single load phase
+        :return: the assembled program, with changed set to False if it is the same as the previous build,
+            the program and IR graph are None if the build stopped at the error limit
+        """
+        root_path = os.path.abspath(root_path)
+        issues = IssueLog(self._max_errors, listener)
+        included_files = {
+            root_path: SourcePosition("<root file passed to assembler>", None)
+        }
+        versions = []
+        self._missing = set()
+        try:
+            with profiler.phase("load") as counts:
+                instructions = self._flatten(issues, root_path, None, included_files, versions)
+                counts["files"] = len(versions)
+                counts["instructions"] = len(instructions)
+        except TooManyErrors:
+            # only the files read before stopping are watched, one of them has to change to fix the errors anyway
+            return self._stopped(issues, versions)
+
+        key = tuple(versions)
+        if key == self._last_key:
+            log.verbose("no source changes, reusing previous build")
+            self._last_result = BuildResult(
+                self._last_result.issues, self._last_result.assembled, self._last_result.ir_nodes, False
+            )
+            return self._last_result
+
+        try:
+            assembled, ir_nodes = assemble.assemble_instructions(
+                issues, instructions, self._chip, profiler, self._optimise
+            )
+        except TooManyErrors:
+            return self._stopped(issues, versions)
+        self._last_key = key
+        self._last_result = BuildResult(issues, assembled, ir_nodes, True)
+        return self._last_result
+
+    def _stopped(self, issues, versions) -> BuildResult:
+        self._last_key = tuple(versions)
+        self._last_result = BuildResult(issues, None, None, True)
+        return self._last_result
+
+    def _flatten(self, issues, path, include_pos, included_files, versions) -> [Instruction]:
+        cached = self._load(issues, path, include_pos)
+        if cached is None:
+            self._missing.add(path)
+            return []
+        versions.append((path, cached.digest))
+        issues.extend(cached.issues)
+
+        result = []
+        for item in cached.items:
+            if isinstance(item, IncludeDirective):
+                if not os.path.isfile(item.path):
+                    self._missing.add(item.path)
+                if not check_include(issues, item, included_files):
+                    continue
+                included_files[item.path] = item.pos
+                result.extend(self._flatten(issues, item.path, item.pos, included_files, versions))
+            else:
+                result.extend(item)
+        return result
+
+    def _load(self, issues, path, include_pos) -> typing.Optional[CachedFile]:
+        """
+        fetches a file's parsed contents, only reading it if its modification time changed
+        and only parsing it if its contents changed
+        """
+        cached = self._files.get(path, None)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if cached is not None and cached.mtime == mtime:
+                return cached
+            with open(path, 'rb') as handle:
+                data = handle.read()
+        except (IOError, OSError) as io_error:
+            if include_pos is not None:
+                issues.error(
+                    include_pos, "error opening included file '{}': {}", path, io_error,
+                    code=codes.INCLUDE_OPEN_ERROR
+                )
+            else:
+                issues.error(
+                    SourcePosition(path, None), "error opening file: {}", io_error, code=codes.FILE_OPEN_ERROR
+                )
+            self._files.pop(path, None)
+            return None
+
+        digest = file_digest(data)
+        if cached is not None and cached.digest == digest:
+            log.verbose("{} was touched but its contents are unchanged".format(path))
+            cached.mtime = mtime
+            return cached
+
+        loaded = self._cache.load(path, digest) if self._cache is not None else None
+        if loaded is not None:
+            items, file_issues = loaded
+        else:
+            log.verbose("parsing {}".format(path))
+            items, file_issues = parse_file_contents(path, data)
+            if self._cache is not None:
+                self._cache.store(path, digest, items, file_issues)
+        cached = CachedFile(path, mtime, digest, items, file_issues)
+        self._files[path] = cached
+        return cached
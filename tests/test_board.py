@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.parse import Instruction
+
+
+def decode(lines, chip_type=shenasm.chips.CHIP_TYPE_MC6000):
+    """:return: a program from lines of (condition, mnemonic, args)"""
+    instructions = [Instruction(None, None, condition, mnemonic, args) for condition, mnemonic, args in lines]
+    return shenasm.sim.decode_program(instructions, shenasm.chips.lookup_by_name(chip_type))
+
+
+class BoardTest(unittest.TestCase):
+    """every board is simulated with both interpreted and compiled chips, which must agree"""
+
+    def boards(self, programs, wires, inputs=(), outputs=()):
+        for compiled in (False, True):
+            yield shenasm.board.Board(programs, wires, inputs, outputs, compiled=compiled)
+
+    def test_xbus_transfer_waits_for_writer(self):
+        programs = {
+            'tx': decode([(None, 'slp', ['3']), (None, 'mov', ['7', 'x0']), (None, 'slp', ['100'])]),
+            'rx': decode([(None, 'mov', ['x1', 'acc']), (None, 'mov', ['acc', 'p1']), (None, 'slp', ['1'])]),
+        }
+        for board in self.boards(programs, [['tx.x0', 'rx.x1'], ['rx.p1', 'out']], outputs=['out']):
+            board.run_for(10)
+            self.assertEqual(board.trace('out'), [(3, 7)])
+            # the reader uses no power while it is blocked
+            self.assertEqual({name: slot.chip.power for name, slot in board.slots.items()}, {'tx': 3, 'rx': 3})
+
+    def test_external_simple_input(self):
+        programs = {'c': decode([(None, 'mov', ['p0', 'p1']), (None, 'slp', ['1'])])}
+        wires = [['button', 'c.p0'], ['c.p1', 'speaker']]
+        for board in self.boards(programs, wires, inputs=['button'], outputs=['speaker']):
+            board.run_for(2)
+            board.drive('button', 50)
+            board.run_for(3)
+            self.assertEqual(board.trace('speaker'), [(0, 0), (2, 50)])
+            self.assertEqual(board.power, 10)
+
+    def test_external_xbus(self):
+        programs = {'c': decode([(None, 'mov', ['x0', 'acc']), (None, 'mul', ['2']), (None, 'mov', ['acc', 'x1'])])}
+        for board in self.boards(programs, [['in', 'c.x0'], ['c.x1', 'out']], inputs=['in'], outputs=['out']):
+            board.send('in', [1, 2, 3])
+            board.run_for(5)
+            self.assertEqual(board.trace('out'), [(0, 2), (0, 4), (0, 6)])
+
+    def test_simple_wire_reads_largest_value(self):
+        programs = {
+            'a': decode([(None, 'mov', ['30', 'p0']), (None, 'slp', ['1'])]),
+            'b': decode([(None, 'mov', ['80', 'p0']), (None, 'slp', ['1'])]),
+        }
+        for board in self.boards(programs, [['a.p0', 'b.p0', 'out']], outputs=['out']):
+            board.run_for(2)
+            self.assertEqual(board.value('out'), 80)
+
+    def test_sleeping_time_units_skipped(self):
+        programs = {'c': decode([(None, 'slp', ['500'])])}
+        for board in self.boards(programs, [['c.p0', 'out']], outputs=['out']):
+            board.run_for(1000000)
+            self.assertEqual(board.now, 1000000)
+            self.assertEqual(board.power, 2000)
+
+    def test_invalid_wiring(self):
+        programs = {'c': decode([(None, 'slp', ['1'])])}
+        with self.assertRaises(shenasm.sim.SimulationError):
+            shenasm.board.Board(programs, [['c.p0', 'c.x0']])
+        with self.assertRaises(shenasm.sim.SimulationError):
+            shenasm.board.Board(programs, [['c.p0', 'out'], ['c.p0', 'other']], outputs=['out', 'other'])
+        with self.assertRaises(shenasm.sim.SimulationError):
+            shenasm.board.Board(programs, [['d.p0', 'out']], outputs=['out'])
+
+
+class BoardFileTest(unittest.TestCase):
+    """boards read from JSON, with sources relative to the board file"""
+
+    def build(self, document, sources):
+        issues = shenasm.errors.IssueLog()
+        with tempfile.TemporaryDirectory() as directory:
+            for name, text in sources.items():
+                with open(os.path.join(directory, name), "w") as handle:
+                    handle.write(text)
+            path = os.path.join(directory, "board.json")
+            with open(path, "w") as handle:
+                json.dump(document, handle)
+            spec = shenasm.board.read_board(issues, path)
+            board = shenasm.board.build_board(issues, spec) if spec is not None else None
+        return issues, board
+
+    def test_build(self):
+        issues, board = self.build(
+            {
+                "chips": [{"name": "pulse", "type": "MC4000", "source": "pulse.asm"}],
+                "wires": [["pulse.p1", "speaker"]],
+                "outputs": ["speaker"],
+            },
+            {"pulse.asm": "  gen p1 1 1\n"}
+        )
+        self.assertEqual(issues.issues, [])
+        board.run_for(4)
+        self.assertEqual(board.trace('speaker'), [(0, 100), (1, 0), (2, 100), (3, 0)])
+
+    def test_unknown_chip_type(self):
+        issues, board = self.build(
+            {"chips": [{"name": "c", "type": "MC9999", "source": "c.asm"}]}, {"c.asm": "  slp 1\n"}
+        )
+        self.assertIsNone(board)
+        self.assertEqual([issue.code for issue in issues.issues], [shenasm.codes.BOARD_UNKNOWN_CHIP])
+
+    def test_bad_wiring_reported(self):
+        issues, board = self.build(
+            {"chips": [{"name": "c", "type": "MC6000", "source": "c.asm"}], "wires": [["c.p0", "c.x0"]]},
+            {"c.asm": "  slp 1\n"}
+        )
+        self.assertIsNone(board)
+        self.assertEqual([issue.code for issue in issues.issues], [shenasm.codes.BOARD_INVALID_WIRING])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.parse import Instruction
+from shenasm.source import LineOfSource, SourcePosition
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CHIP = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+
+# p0 is never 100 in the cases below, so the + line never runs
+SOURCE = (
+    "start:\n"
+    "  teq p0 100\n"
+    "+ mov 100 p1\n"
+    "- mov 0 p1\n"
+    "  slp 1\n"
+)
+
+
+class CoverageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "program.asm")
+        with open(self.path, "w") as handle:
+            handle.write(SOURCE)
+        issues = shenasm.errors.IssueLog()
+        lines = [LineOfSource(SourcePosition(self.path, number), line)
+                 for number, line in enumerate(SOURCE.splitlines(), 1)]
+        self.assembled, self.ir_nodes = shenasm.assemble.assemble(issues, lines, CHIP)
+        self.coverage = shenasm.coverage.Coverage(self.assembled, CHIP)
+        self.coverage.run_cases([shenasm.superopt.TestCase(3)])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hits(self):
+        # the label is assembled along with the teq after it, and line 1 holds no instruction of its own
+        self.assertEqual(self.coverage.hits, [3, 0, 3, 3])
+        self.assertEqual(self.coverage.power, 9)
+        self.assertEqual(list(self.coverage.by_line().items()), [
+            ((self.path, 2), 3), ((self.path, 3), 0), ((self.path, 4), 3), ((self.path, 5), 3),
+        ])
+
+    def test_listing(self):
+        self.assertEqual(self.coverage.format_listing().splitlines(), [
+            "3 of 4 instructions ran, using 9 power",
+            "        -:    0:Source:{}".format(self.path),
+            "        -:    1:start:",
+            "        3:    2:  teq p0 100",
+            "    #####:    3:+ mov 100 p1",
+            "        3:    4:- mov 0 p1",
+            "        3:    5:  slp 1",
+        ])
+
+    def test_regions(self):
+        regions = self.coverage.regions(self.ir_nodes)
+        self.assertEqual(
+            [([str(instruction) for instruction in region.instructions], covered.runs, covered.power)
+             for region, covered in regions.items()],
+            [(["start:", "  teq p0 100"], 3, 3), (["+ mov 100 p1"], 0, 0), (["- mov 0 p1"], 3, 3), (["  slp 1"], 3, 3)]
+        )
+        never_taken = self.coverage.never_taken(self.ir_nodes)
+        self.assertEqual([[str(instruction) for instruction in region.instructions] for region in never_taken],
+                         [["+ mov 100 p1"]])
+
+    def test_heat_coloured_dotfile(self):
+        path = os.path.join(self.directory, "graph.dot")
+        shenasm.intermediate.output_ir_dotfile(path, self.ir_nodes, self.coverage.regions(self.ir_nodes))
+        with open(path) as handle:
+            labels = re.findall(r'\[label="([^"]*)" color="([^"]*)" shape=rectangle', handle.read())
+        hottest = shenasm.intermediate.heat_colour(1)
+        self.assertEqual(labels, [
+            ("start:\\l  teq p0 100\\lran 3 times, 3 power\\l", hottest),
+            ("+ mov 100 p1\\lnever ran\\l", "#eeeeee"),
+            ("- mov 0 p1\\lran 3 times, 3 power\\l", hottest),
+            ("  slp 1\\lran 3 times, 3 power\\l", hottest),
+        ])
+
+    def test_heat_colour(self):
+        self.assertEqual(shenasm.intermediate.heat_colour(0), "#ffffcc")
+        self.assertEqual(shenasm.intermediate.heat_colour(1), "#e31a1c")
+
+
+class PowerTest(unittest.TestCase):
+
+    def test_counts_add_up_to_power(self):
+        # the second half of gen isn't counted, as it costs no power
+        program = [Instruction(None, None, None, 'gen', ['p1', '1', '2']), Instruction(None, None, None, 'add', ['1'])]
+        coverage = shenasm.coverage.Coverage(program, CHIP)
+        case = shenasm.superopt.TestCase(6)
+        coverage.run_cases([case])
+        _, power = shenasm.superopt.run_case(coverage.program, case)
+        self.assertEqual(coverage.power, power)
+        self.assertEqual(coverage.hits, [2, 1])
+
+
+class CommandLineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_shenasm(self, cases_path, *options):
+        source = os.path.join(self.directory, "program.asm")
+        with open(source, "w") as handle:
+            handle.write(SOURCE)
+        return subprocess.run(
+            [sys.executable, os.path.join(ROOT, "run_shenasm.py"), source, "-o", os.devnull,
+             "--coverage", cases_path, "--dotfile", os.path.join(self.directory, "graph.dot")] + list(options),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+        )
+
+    def test_listing_and_never_taken(self):
+        cases_path = os.path.join(self.directory, "cases.json")
+        with open(cases_path, "w") as handle:
+            json.dump([{"time_units": 3, "simple": {"p0": [0]}}], handle)
+        result = self.run_shenasm(cases_path)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertIn("    #####:    3:+ mov 100 p1", result.stdout.splitlines())
+        self.assertIn("program.asm:3: conditional code that never ran", result.stdout)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "graph.dot")))
+
+    def test_unreadable_cases(self):
+        result = self.run_shenasm(os.path.join(self.directory, "missing.json"), "--diagnostics-format", "json")
+        self.assertNotEqual(result.returncode, 0)
+        codes = [json.loads(line)["code"] for line in result.stdout.splitlines()]
+        self.assertEqual(codes, [shenasm.codes.COVERAGE_CASES_READ_ERROR])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.errors import Issue, ERROR, WARNING
+from shenasm.source import SourcePosition
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ISSUES = [
+    Issue(ERROR, SourcePosition("/tmp/a.asm", 3), "unknown instruction mneumonic: {}", ("foo",),
+          shenasm.codes.UNKNOWN_INSTRUCTION),
+    Issue(WARNING, SourcePosition("<whole program>", None), "program size exceeds chip memory ({} > {})", (15, 14),
+          shenasm.codes.PROGRAM_TOO_LONG),
+]
+
+
+def write(writer_class, issues):
+    stream = io.StringIO()
+    writer = writer_class(stream)
+    for issue in issues:
+        writer.write(issue)
+    writer.close()
+    return stream.getvalue()
+
+
+class CodesTest(unittest.TestCase):
+
+    def test_codes_are_unique_and_well_formed(self):
+        values = {name: value for name, value in vars(shenasm.codes).items() if name.isupper()}
+        self.assertEqual(len(set(values.values())), len(values))
+        for value in values.values():
+            self.assertRegex(value, r"^SH\d{3}$")
+
+    def test_readme_lists_every_code(self):
+        with open(os.path.join(ROOT, "README.md")) as handle:
+            listed = set(re.findall(r"\| (SH\d{3}) \|", handle.read()))
+        codes = set(value for name, value in vars(shenasm.codes).items() if name.isupper())
+        self.assertEqual(listed, codes)
+
+
+class JsonLinesTest(unittest.TestCase):
+
+    def test_one_object_per_line(self):
+        lines = write(shenasm.diagnostics.JsonLinesWriter, ISSUES).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {"file": "/tmp/a.asm", "line": 3, "level": "error", "code": "SH302",
+             "message": "unknown instruction mneumonic: foo"},
+            {"file": "<whole program>", "line": None, "level": "warning", "code": "SH301",
+             "message": "program size exceeds chip memory (15 > 14)"},
+        ])
+
+
+class SarifTest(unittest.TestCase):
+
+    def test_results(self):
+        document = json.loads(write(shenasm.diagnostics.SarifWriter, ISSUES))
+        self.assertEqual(document["version"], shenasm.diagnostics.SARIF_VERSION)
+        run, = document["runs"]
+        self.assertEqual(run["tool"]["driver"]["name"], "shenasm")
+        first, second = run["results"]
+        self.assertEqual(first["ruleId"], "SH302")
+        self.assertEqual(first["locations"], [{"physicalLocation": {
+            "artifactLocation": {"uri": "file:///tmp/a.asm"}, "region": {"startLine": 3}
+        }}])
+        # positions that aren't in a file have no location
+        self.assertNotIn("locations", second)
+        self.assertEqual(second["message"]["text"], "program size exceeds chip memory (15 > 14)")
+
+    def test_no_issues(self):
+        document = json.loads(write(shenasm.diagnostics.SarifWriter, []))
+        self.assertEqual(document["runs"][0]["results"], [])
+
+
+class CommandLineTest(unittest.TestCase):
+    """with a machine readable format, stdout holds only the diagnostics"""
+
+    def run_shenasm(self, diagnostics_format):
+        return subprocess.run(
+            [sys.executable, os.path.join(ROOT, "run_shenasm.py"), os.path.join(ROOT, "examples", "error_test.asm"),
+             "-o", os.devnull, "--diagnostics-format", diagnostics_format],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+        )
+
+    def test_json(self):
+        result = self.run_shenasm("json")
+        self.assertNotEqual(result.returncode, 0)
+        issues = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertGreater(len(issues), 0)
+        self.assertTrue(all(issue["code"] is not None for issue in issues))
+
+    def test_sarif(self):
+        result = self.run_shenasm("sarif")
+        document = json.loads(result.stdout)
+        self.assertGreater(len(document["runs"][0]["results"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.source import LineOfSource, SourcePosition
+
+
+def assemble(text):
+    """:return: the issues from assembling some source text, and the first argument of each instruction"""
+    issues = shenasm.errors.IssueLog()
+    lines = [LineOfSource(SourcePosition("<test>", number), line) for number, line in enumerate(text.splitlines(), 1)]
+    chip = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+    assembled, _ = shenasm.assemble.assemble(issues, lines, chip)
+    return issues, [instruction.args[0] for instruction in assembled if instruction.args]
+
+
+class ConstantValueTest(unittest.TestCase):
+    """const takes an expression, evaluated when the program is assembled"""
+
+    def value(self, expression):
+        issues, args = assemble("const x {}\n  mov x acc\n".format(expression))
+        self.assertEqual([str(issue) for issue in issues.issues], [])
+        return args[-1]
+
+    def test_literal(self):
+        self.assertEqual(self.value("5"), "5")
+        self.assertEqual(self.value("-5"), "-5")
+
+    def test_precedence(self):
+        self.assertEqual(self.value("2 + 3 * 4"), "14")
+        self.assertEqual(self.value("(2 + 3) * 4"), "20")
+        self.assertEqual(self.value("2 - 3 - 4"), "-5")
+        self.assertEqual(self.value("--3"), "3")
+
+    def test_division_rounds_towards_zero(self):
+        self.assertEqual(self.value("7 / 2"), "3")
+        self.assertEqual(self.value("-7 / 2"), "-3")
+        self.assertEqual(self.value("7 % 3"), "1")
+        self.assertEqual(self.value("-7 % 3"), "-1")
+
+    def test_functions(self):
+        self.assertEqual(self.value("dgt(567, 1)"), "6")
+        self.assertEqual(self.value("dst(567, 0, 9)"), "569")
+        self.assertEqual(self.value("clamp(500 * 3)"), "999")
+
+    def test_refers_to_later_constant(self):
+        issues, args = assemble("const x y * 2\nconst y 1 + 2\n  mov x acc\n")
+        self.assertEqual(len(issues.issues), 0)
+        self.assertEqual(args, ["6"])
+
+
+class ConstantErrorTest(unittest.TestCase):
+    """each kind of bad expression is reported with its own code, once"""
+
+    def codes(self, text):
+        issues, _ = assemble(text)
+        return [issue.code for issue in issues.issues]
+
+    def test_invalid(self):
+        self.assertEqual(self.codes("const x 1 +\n"), [shenasm.codes.INVALID_EXPRESSION])
+        self.assertEqual(self.codes("const x 1 / 0\n"), [shenasm.codes.INVALID_EXPRESSION])
+        self.assertEqual(self.codes("const x dgt(1)\n"), [shenasm.codes.INVALID_EXPRESSION])
+        self.assertEqual(self.codes("const x foo(1)\n"), [shenasm.codes.INVALID_EXPRESSION])
+
+    def test_out_of_range(self):
+        self.assertEqual(self.codes("const x 500 * 2\n"), [shenasm.codes.CONSTANT_OUT_OF_RANGE])
+
+    def test_unknown(self):
+        self.assertEqual(self.codes("const x y + 1\n"), [shenasm.codes.UNKNOWN_CONSTANT])
+
+    def test_circular(self):
+        self.assertEqual(self.codes("const x y\nconst y x\n"), [shenasm.codes.CIRCULAR_CONSTANTS])
+
+    def test_dependency_reported_once(self):
+        # y fails, and x that depends on it isn't reported again
+        self.assertEqual(self.codes("const x y + 1\nconst y 1 / 0\n"), [shenasm.codes.INVALID_EXPRESSION])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.source import LineOfSource, SourcePosition
+
+
+def graph(text):
+    """:return: the issues found and the IR graph of some source text"""
+    issues = shenasm.errors.IssueLog()
+    lines = [LineOfSource(SourcePosition("<test>", number), line) for number, line in enumerate(text.splitlines(), 1)]
+    instructions = shenasm.parse.Parser(issues).parse_lines(lines)
+    return issues, shenasm.intermediate.build_ir_graph(issues, instructions)
+
+
+class WrapAroundTest(unittest.TestCase):
+    """a chip that runs off the end of its program carries on from the top, the graph has an edge for that"""
+
+    def test_test_at_end_reaches_both_branches_at_top(self):
+        # the - region can only run after the tgt at the bottom, once execution has wrapped around
+        issues, ir_nodes = graph(
+            "+ mov 100 p1\n"
+            "- mov 0 p1\n"
+            "  slp 1\n"
+            "  tgt p0 50\n"
+        )
+        positive, negative, last = ir_nodes
+        self.assertTrue(ir_nodes.is_reachable(negative))
+        self.assertEqual(
+            last.exits,
+            {shenasm.intermediate.TRUE_CONDITIONAL: positive, shenasm.intermediate.FALSE_CONDITIONAL: negative}
+        )
+        shenasm.intermediate.warn_unused_code(issues, ir_nodes)
+        self.assertEqual(len(issues.warnings), 0)
+
+    def test_whole_program_is_a_loop(self):
+        issues, ir_nodes = graph(
+            "  mov 100 p1\n"
+            "  slp 1\n"
+            "start:\n"
+            "  mov 0 p1\n"
+            "  slp 1\n"
+        )
+        first, last = ir_nodes
+        self.assertEqual(last.successors, [first])
+        self.assertEqual(len(ir_nodes.loops), 1)
+        self.assertEqual(ir_nodes.loops[0].header, first)
+
+    def test_jump_at_end_does_not_wrap(self):
+        issues, ir_nodes = graph(
+            "  mov 100 p1\n"
+            "loop:\n"
+            "  slp 1\n"
+            "  jmp loop\n"
+        )
+        first, loop = ir_nodes
+        self.assertEqual(loop.successors, [loop])
+        self.assertEqual(first.incoming, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
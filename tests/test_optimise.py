@@ -0,0 +1,163 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.source import LineOfSource, SourcePosition
+
+
+CHIP = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+
+
+def assemble(text, optimise):
+    issues = shenasm.errors.IssueLog()
+    lines = [LineOfSource(SourcePosition("<test>", number), line) for number, line in enumerate(text.splitlines(), 1)]
+    assembled, _ = shenasm.assemble.assemble(issues, lines, CHIP, optimise=optimise)
+    return assembled
+
+
+def outputs(program, p0, time_units=4):
+    """:return: what a program drives p1 to in each time unit with p0 held at a value"""
+    chip = shenasm.sim.Chip(shenasm.sim.decode_program(program, CHIP), shenasm.sim.PinIO({'p0': p0}))
+    history = []
+    for now in range(time_units):
+        chip.run(now)
+        history.append(chip.io.simple_outputs.get('p1', 0))
+    return history
+
+
+class OptimiseTestCase(unittest.TestCase):
+
+    def assertOptimisesTo(self, text, expected):
+        """checks the optimised program is the expected one, and that it drives p1 the same as the original"""
+        original = assemble(text, False)
+        optimised = assemble(text, True)
+        self.assertEqual([str(instruction) for instruction in optimised], expected)
+        for p0 in (0, 50, 100):
+            self.assertEqual(outputs(optimised, p0), outputs(original, p0))
+
+
+class DeadCodeTest(OptimiseTestCase):
+    """-O removes code that can never run, tests nothing looks at and jumps that go where execution goes anyway"""
+
+    def test_unreachable(self):
+        # the jmp at the end goes back to the top, which running off the end would do anyway
+        self.assertOptimisesTo(
+            "start:\n"
+            "  mov 100 p1\n"
+            "  slp 1\n"
+            "  jmp start\n"
+            "  mov 0 p1\n",
+            ["  mov 100 p1", "  slp 1"]
+        )
+
+    def test_condition_never_holds(self):
+        self.assertOptimisesTo(
+            "  teq 1 1\n"
+            "- mov 0 p1\n"
+            "+ mov 1 p1\n"
+            "  slp 1\n",
+            ["  mov 1 p1", "  slp 1"]
+        )
+
+    def test_unused_test(self):
+        self.assertOptimisesTo(
+            "  teq p0 0\n"
+            "  mov 1 p1\n"
+            "  slp 1\n",
+            ["  mov 1 p1", "  slp 1"]
+        )
+
+    def test_repeated_test(self):
+        self.assertOptimisesTo(
+            "  mov p0 acc\n"
+            "  teq acc 0\n"
+            "+ mov 100 p1\n"
+            "  teq acc 0\n"
+            "- mov 0 p1\n"
+            "  slp 1\n",
+            ["  mov p0 acc", "  teq acc 0", "+ mov 100 p1", "- mov 0 p1", "  slp 1"]
+        )
+
+    def test_jump_to_next(self):
+        self.assertOptimisesTo(
+            "  jmp next\n"
+            "next:\n"
+            "  mov 1 p1\n"
+            "  slp 1\n",
+            ["  mov 1 p1", "  slp 1"]
+        )
+
+    def test_used_test_kept(self):
+        text = (
+            "  tgt p0 50\n"
+            "+ mov 100 p1\n"
+            "- mov 0 p1\n"
+            "  slp 1\n"
+        )
+        self.assertOptimisesTo(text, ["  tgt p0 50", "+ mov 100 p1", "- mov 0 p1", "  slp 1"])
+
+
+class ConstantTest(OptimiseTestCase):
+    """-O replaces reads of acc and dat whose value is always the same, and drops writes nothing reads"""
+
+    def test_arithmetic_folded(self):
+        self.assertOptimisesTo(
+            "  mov 5 acc\n"
+            "  add 1\n"
+            "  mov acc p1\n"
+            "  slp 1\n",
+            ["  mov 6 p1", "  slp 1"]
+        )
+
+    def test_overwritten_write(self):
+        self.assertOptimisesTo(
+            "  mov 3 dat\n"
+            "  mov 4 dat\n"
+            "  mov dat p1\n"
+            "  slp 1\n",
+            ["  mov 4 p1", "  slp 1"]
+        )
+
+    def test_known_test(self):
+        self.assertOptimisesTo(
+            "  mov 2 acc\n"
+            "  mul 3\n"
+            "  teq acc 6\n"
+            "+ mov 100 p1\n"
+            "  slp 1\n",
+            ["  mov 100 p1", "  slp 1"]
+        )
+
+    def test_unread_write(self):
+        self.assertOptimisesTo(
+            "  mov 7 dat\n"
+            "  mov p0 acc\n"
+            "  mov acc p1\n"
+            "  slp 1\n",
+            ["  mov p0 acc", "  mov acc p1", "  slp 1"]
+        )
+
+    def test_input_not_known(self):
+        text = (
+            "  mov p0 acc\n"
+            "  add 1\n"
+            "  mov acc p1\n"
+            "  slp 1\n"
+        )
+        self.assertOptimisesTo(text, ["  mov p0 acc", "  add 1", "  mov acc p1", "  slp 1"])
+
+    def test_value_changes_each_time_round(self):
+        # acc starts at zero but goes up by one every time unit, so it can't be replaced by a literal
+        self.assertOptimisesTo(
+            "  add 1\n"
+            "  mov acc p1\n"
+            "  slp 1\n",
+            ["  add 1", "  mov acc p1", "  slp 1"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import collections
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.parse import Instruction
+
+
+def decode(lines, chip_type=shenasm.chips.CHIP_TYPE_MC4000):
+    instructions = [
+        Instruction(None, None, condition, mnemonic, args) for condition, mnemonic, args in lines
+    ]
+    return shenasm.sim.decode_program(instructions, shenasm.chips.lookup_by_name(chip_type))
+
+
+def run(chip, time_units):
+    """:return: the value on p1 and the power used in each time unit"""
+    history = []
+    for now in range(time_units):
+        power = chip.power
+        chip.run(now)
+        history.append((chip.io.simple_outputs.get('p1', 0), chip.power - power))
+    return history
+
+
+class SkippedGenTest(unittest.TestCase):
+    """a gen whose condition isn't met skips both halves, it neither drives the pin, sleeps nor uses power"""
+
+    def chips(self, program):
+        yield shenasm.sim.Chip(program, shenasm.sim.PinIO())
+        yield shenasm.compiled.CompiledChip(program, shenasm.sim.PinIO())
+
+    def test_plus(self):
+        program = decode([
+            (None, 'mov', ['100', 'p1']), (None, 'teq', ['0', '1']), ('+', 'gen', ['p1', '1', '1']), (None, 'slp', ['1'])
+        ])
+        for chip in self.chips(program):
+            self.assertEqual(run(chip, 4), [(100, 3)] * 4)
+
+    def test_minus(self):
+        program = decode([
+            (None, 'mov', ['100', 'p1']), (None, 'teq', ['0', '0']), ('-', 'gen', ['p1', '1', '1']), (None, 'slp', ['1'])
+        ])
+        for chip in self.chips(program):
+            self.assertEqual(run(chip, 4), [(100, 3)] * 4)
+
+    def test_once(self):
+        program = decode([
+            (None, 'mov', ['50', 'p1']), ('@', 'gen', ['p1', '1', '1']), (None, 'slp', ['1'])
+        ])
+        for chip in self.chips(program):
+            # the first pass pulses p1, every later pass skips the gen entirely
+            self.assertEqual(run(chip, 5), [(100, 2), (0, 0), (0, 1), (50, 2), (50, 2)])
+
+
+def both(program, io_factory=shenasm.sim.PinIO):
+    """:return: an interpreted and a compiled chip running the same program, each with its own io"""
+    return [shenasm.sim.Chip(program, io_factory()), shenasm.compiled.CompiledChip(program, io_factory())]
+
+
+class ArithmeticTest(unittest.TestCase):
+    """acc is clamped to -999..999 after every operation, and dgt/dst work on its decimal digits"""
+
+    def acc_after(self, lines):
+        program = decode(lines + [(None, 'slp', ['1'])], shenasm.chips.CHIP_TYPE_MC6000)
+        values = []
+        for chip in both(program):
+            chip.run(0)
+            values.append(chip.acc)
+        self.assertEqual(values[0], values[1])
+        return values[0]
+
+    def test_clamp_high(self):
+        self.assertEqual(self.acc_after([(None, 'mov', ['900', 'acc']), (None, 'add', ['200'])]), 999)
+        self.assertEqual(self.acc_after([(None, 'mov', ['500', 'acc']), (None, 'mul', ['3'])]), 999)
+        self.assertEqual(self.acc_after([(None, 'mov', ['500', 'acc']), (None, 'sub', ['-600'])]), 999)
+
+    def test_clamp_low(self):
+        self.assertEqual(self.acc_after([(None, 'mov', ['-900', 'acc']), (None, 'sub', ['200'])]), -999)
+        self.assertEqual(self.acc_after([(None, 'mov', ['500', 'acc']), (None, 'mul', ['-3'])]), -999)
+        self.assertEqual(self.acc_after([(None, 'mov', ['-900', 'acc']), (None, 'add', ['acc'])]), -999)
+
+    def test_dgt(self):
+        self.assertEqual(self.acc_after([(None, 'mov', ['567', 'acc']), (None, 'dgt', ['0'])]), 7)
+        self.assertEqual(self.acc_after([(None, 'mov', ['567', 'acc']), (None, 'dgt', ['2'])]), 5)
+        self.assertEqual(self.acc_after([(None, 'mov', ['-567', 'acc']), (None, 'dgt', ['1'])]), -6)
+
+    def test_dst(self):
+        self.assertEqual(self.acc_after([(None, 'mov', ['567', 'acc']), (None, 'dst', ['1', '9'])]), 597)
+        self.assertEqual(self.acc_after([(None, 'mov', ['7', 'acc']), (None, 'dst', ['2', '3'])]), 307)
+        # the result takes the sign of the digit written, or keeps its own when that is zero
+        self.assertEqual(self.acc_after([(None, 'mov', ['-567', 'acc']), (None, 'dst', ['0', '1'])]), 561)
+        self.assertEqual(self.acc_after([(None, 'mov', ['567', 'acc']), (None, 'dst', ['0', '-1'])]), -561)
+        self.assertEqual(self.acc_after([(None, 'mov', ['-567', 'acc']), (None, 'dst', ['0', '0'])]), -560)
+
+
+class TcpTest(unittest.TestCase):
+    """tcp of two equal values sets neither flag, so both + and - instructions are skipped"""
+
+    def test_equal(self):
+        program = decode([
+            (None, 'mov', ['5', 'acc']), (None, 'tcp', ['acc', '5']), ('+', 'mov', ['1', 'acc']),
+            ('-', 'mov', ['2', 'acc']), (None, 'slp', ['1'])
+        ])
+        for chip in both(program):
+            chip.run(0)
+            self.assertEqual(chip.acc, 5)
+            self.assertEqual(chip.power, 3)
+
+    def test_greater_and_less(self):
+        for value, expected in ((6, 1), (4, 2)):
+            program = decode([
+                (None, 'mov', [str(value), 'acc']), (None, 'tcp', ['acc', '5']), ('+', 'mov', ['1', 'acc']),
+                ('-', 'mov', ['2', 'acc']), (None, 'slp', ['1'])
+            ])
+            for chip in both(program):
+                chip.run(0)
+                self.assertEqual(chip.acc, expected)
+                self.assertEqual(chip.power, 4)
+
+
+class FullIO(shenasm.sim.PinIO):
+    """io whose XBus writes block until it is told to accept them"""
+
+    def __init__(self):
+        super().__init__()
+        self.accepting = False
+
+    def xbus_write(self, pin, value):
+        if not self.accepting:
+            return False
+        return super().xbus_write(pin, value)
+
+
+class BlockingTest(unittest.TestCase):
+    """a chip blocked on XBus stays on the same instruction, using no power, until the transfer can happen"""
+
+    def test_read(self):
+        program = decode([(None, 'mov', ['x0', 'acc']), (None, 'slp', ['1'])])
+        for chip in both(program):
+            self.assertEqual(chip.run(0), shenasm.sim.STATUS_BLOCKED_READ)
+            self.assertEqual((chip.pc, chip.power, chip.blocked_on), (0, 0, 'x0'))
+            chip.io.xbus_inputs['x0'] = collections.deque([42])
+            self.assertEqual(chip.run(1), shenasm.sim.STATUS_SLEEP)
+            self.assertEqual((chip.acc, chip.power, chip.blocked_on), (42, 2, None))
+
+    def test_write_keeps_value_read(self):
+        # the value read from x0 is held while the write to x1 blocks, so it isn't read a second time
+        program = decode([(None, 'mov', ['x0', 'x1']), (None, 'slp', ['1'])])
+        for chip in both(program, FullIO):
+            chip.io.xbus_inputs['x0'] = collections.deque([7, 8])
+            self.assertEqual(chip.run(0), shenasm.sim.STATUS_BLOCKED_WRITE)
+            self.assertEqual((chip.pc, chip.power, chip.blocked_on), (0, 0, 'x1'))
+            chip.io.accepting = True
+            self.assertEqual(chip.run(1), shenasm.sim.STATUS_SLEEP)
+            self.assertEqual(chip.io.xbus_outputs, {'x1': [7]})
+            self.assertEqual(list(chip.io.xbus_inputs['x0']), [8])
+
+    def test_slx(self):
+        program = decode([(None, 'slx', ['x0']), (None, 'mov', ['x0', 'acc']), (None, 'slp', ['1'])])
+        for chip in both(program):
+            self.assertEqual(chip.run(0), shenasm.sim.STATUS_SLX)
+            self.assertEqual((chip.pc, chip.power), (0, 0))
+            chip.io.xbus_inputs['x0'] = collections.deque([3])
+            chip.run(1)
+            self.assertEqual((chip.acc, chip.power), (3, 3))
+
+
+class SkippedGenBatchTest(unittest.TestCase):
+
+    def test_plus(self):
+        try:
+            import shenasm.batch
+        except ImportError:
+            self.skipTest("numpy is not installed")
+        program = decode([
+            (None, 'mov', ['100', 'p1']), (None, 'teq', ['0', '1']), ('+', 'gen', ['p1', '1', '1']), (None, 'slp', ['1'])
+        ])
+        batch = shenasm.batch.BatchChip(program, 2)
+        batch.run_for(4)
+        self.assertEqual(batch.power.tolist(), [12, 12])
+        self.assertEqual(batch.history('p1').tolist(), [[100, 100]] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
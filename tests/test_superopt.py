@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.parse import Instruction
+
+
+def instructions(lines):
+    return [Instruction(None, None, condition, mnemonic, args) for condition, mnemonic, args in lines]
+
+
+class SleepPastEndTest(unittest.TestCase):
+    """a candidate that matches every time unit of a case but is still asleep at the end of it isn't equivalent"""
+
+    def test_long_sleep_rejected(self):
+        chip = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC4000)
+        original = instructions([
+            (None, 'mov', ['100', 'p1']), (None, 'slp', ['1']), (None, 'mov', ['100', 'p1']), (None, 'slp', ['1'])
+        ])
+        specification = shenasm.superopt.specification_from_program(
+            original, chip, [shenasm.superopt.TestCase(6)]
+        )
+        long_sleep = shenasm.sim.decode_program(
+            instructions([(None, 'mov', ['100', 'p1']), (None, 'slp', ['100'])]), chip
+        )
+        short_sleep = shenasm.sim.decode_program(
+            instructions([(None, 'mov', ['100', 'p1']), (None, 'slp', ['2'])]), chip
+        )
+        self.assertIsNone(shenasm.superopt.check_candidate(long_sleep, specification))
+        self.assertEqual(shenasm.superopt.check_candidate(short_sleep, specification), 6)
+
+
+class MnemonicsTest(unittest.TestCase):
+    """short programs are searched with every instruction, so a replacement can use ones the original doesn't"""
+
+    def setUp(self):
+        self.chip = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC4000)
+        self.original = instructions([
+            (None, 'mov', ['100', 'p1']), (None, 'slp', ['2']), (None, 'mov', ['0', 'p1']), (None, 'slp', ['4'])
+        ])
+
+    def search(self, mnemonics=None):
+        return shenasm.superopt.superoptimise(
+            self.original, self.chip, [shenasm.superopt.TestCase(12)], time_budget=30.0, processes=1,
+            mnemonics=mnemonics
+        )
+
+    def test_finds_gen(self):
+        result = self.search()
+        self.assertTrue(result.complete)
+        self.assertEqual([str(instruction) for instruction in result.program], ["  gen p1 2 4"])
+
+    def test_given_mnemonics(self):
+        # with only the instructions the original uses there is nothing shorter
+        result = self.search(['mov', 'slp'])
+        self.assertTrue(result.complete)
+        self.assertIsNone(result.program)
+
+    def test_unknown_mnemonic(self):
+        with self.assertRaises(ValueError):
+            shenasm.superopt.candidate_lines(self.original, self.chip, ['mov', 'foo'])
+
+
+if __name__ == "__main__":
+    unittest.main()
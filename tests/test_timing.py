@@ -0,0 +1,102 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.source import LineOfSource, SourcePosition
+
+
+def check(text, budget=None):
+    """:return: the issues from assembling some source text and checking its timing, and the power estimate"""
+    issues = shenasm.errors.IssueLog()
+    lines = [LineOfSource(SourcePosition("<test>", number), line) for number, line in enumerate(text.splitlines(), 1)]
+    chip = shenasm.chips.lookup_by_name(shenasm.chips.CHIP_TYPE_MC6000)
+    _, ir_nodes = shenasm.assemble.assemble(issues, lines, chip)
+    estimate = shenasm.timing.verify_timing(issues, ir_nodes, budget)
+    return issues, estimate
+
+
+def codes_of(issues):
+    return [issue.code for issue in issues.issues]
+
+
+class IdleProgramTest(unittest.TestCase):
+    """a program with nothing but alias and const lines wraps around onto itself without running anything"""
+
+    def test_no_instructions(self):
+        issues, estimate = check(
+            "alias key_input x1\n"
+            "const no_cheese 0\n"
+            "const extra_mustard 2\n",
+            budget=10
+        )
+        self.assertEqual(codes_of(issues), [])
+        self.assertEqual((estimate.minimum_per_time_unit, estimate.maximum_per_time_unit), (0, 0))
+        self.assertEqual(estimate.sleepless_loops, [])
+
+    def test_loop_of_instructions_is_still_reported(self):
+        issues, _ = check(
+            "const step 1\n"
+            "  add step\n"
+        )
+        self.assertEqual(codes_of(issues), [shenasm.codes.SLEEPLESS_LOOP])
+
+
+class GenDurationTest(unittest.TestCase):
+    """whether a gen sleeps depends on the values of its durations, including those given by a const"""
+
+    def test_const_zero_does_not_sleep(self):
+        issues, _ = check(
+            "const off 0\n"
+            "loop:\n"
+            "  gen p1 off off\n"
+            "  jmp loop\n"
+        )
+        self.assertEqual(codes_of(issues), [shenasm.codes.SLEEPLESS_LOOP])
+
+    def test_const_one_sleeps(self):
+        issues, estimate = check(
+            "const on 1\n"
+            "loop:\n"
+            "  gen p1 on 0\n"
+            "  jmp loop\n"
+        )
+        self.assertEqual(codes_of(issues), [])
+        self.assertEqual(estimate.maximum_per_time_unit, 2)
+
+    def test_register_duration_sleeps(self):
+        issues, _ = check(
+            "alias duration acc\n"
+            "loop:\n"
+            "  gen p1 0 duration\n"
+            "  jmp loop\n"
+        )
+        self.assertEqual(codes_of(issues), [])
+
+
+class BatchTimingTest(unittest.TestCase):
+    """batch builds check timing the same way as assembling a single file"""
+
+    def run_job(self, text):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "program.asm")
+            with open(source, "w") as handle:
+                handle.write(text)
+            job = shenasm.build.BuildJob(source, shenasm.chips.CHIP_TYPE_MC6000, os.path.join(directory, "program.out.asm"))
+            return shenasm.build.run_job(job, check_timing=True)
+
+    def test_no_instructions(self):
+        result = self.run_job("const no_cheese 0\nconst extra_mustard 2\n")
+        self.assertEqual([issue.code for issue in result.issues], [])
+        self.assertTrue(result.written)
+
+    def test_sleepless_loop(self):
+        result = self.run_job("loop:\n  add 1\n  jmp loop\n")
+        self.assertEqual([issue.code for issue in result.issues], [shenasm.codes.SLEEPLESS_LOOP])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+from shenasm.parse import Instruction
+
+
+def decode(lines, chip_type=shenasm.chips.CHIP_TYPE_MC4000):
+    """:return: a program from lines of (condition, mnemonic, args)"""
+    instructions = [Instruction(None, None, condition, mnemonic, args) for condition, mnemonic, args in lines]
+    return shenasm.sim.decode_program(instructions, shenasm.chips.lookup_by_name(chip_type))
+
+
+# copies each value read from x0 onto p1, a time unit each
+COPIER = [(None, 'mov', ['x0', 'acc']), (None, 'mov', ['acc', 'p1']), (None, 'slp', ['1'])]
+
+
+class TraceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import shenasm.traces
+        except ImportError:
+            self.skipTest("numpy is not installed")
+        self.traces = shenasm.traces
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record_copier(self, name, values, time_units=4):
+        chip = shenasm.sim.Chip(decode(COPIER), shenasm.sim.PinIO({'p0': 20}, {'x0': values}))
+        return self.traces.record_chip(chip, os.path.join(self.directory, name), time_units)
+
+
+class RecordTest(TraceTestCase):
+
+    def test_chip(self):
+        trace = self.record_copier("copier.npy", [5, 9])
+        no_value = self.traces.NO_VALUE
+        self.assertEqual(trace.columns, ['p0', 'p1', 'x0', 'x1'])
+        self.assertEqual(trace.kinds['p0'], shenasm.chips.REG_TYPE_SIMPLE)
+        self.assertEqual(trace.kinds['x0'], shenasm.chips.REG_TYPE_XBUS)
+        # x0 holds a value only in the time units it was read, and nothing is ever sent on x1
+        self.assertEqual(trace.matrix.tolist(), [
+            [20, 5, 5, no_value],
+            [20, 9, 9, no_value],
+            [20, 9, no_value, no_value],
+            [20, 9, no_value, no_value],
+        ])
+
+    def test_reopened(self):
+        recorded = self.record_copier("copier.npy", [5, 9])
+        trace = self.traces.PinTrace.open(os.path.join(self.directory, "copier.npy"))
+        self.assertEqual(len(trace), 4)
+        self.assertEqual(trace.columns, recorded.columns)
+        self.assertEqual(trace.kinds, recorded.kinds)
+        self.assertEqual(trace.matrix.tolist(), recorded.matrix.tolist())
+        self.assertEqual(int(trace[1]['p1']), 9)
+
+    def test_board(self):
+        programs = {
+            'tx': decode([(None, 'mov', ['7', 'x0']), (None, 'mov', ['60', 'p0']), (None, 'slp', ['1'])]),
+            'rx': decode([(None, 'mov', ['x1', 'p1'])]),
+        }
+        board = shenasm.board.Board(programs, [['tx.x0', 'rx.x1'], ['tx.p0', 'rx.p0'], ['rx.p1', 'out']],
+                                    outputs=['out'])
+        trace = self.traces.record_board(board, os.path.join(self.directory, "board.npy"), 2)
+        self.assertEqual(board.now, 2)
+        self.assertEqual(trace.columns, ['tx.p0', 'tx.p1', 'tx.x0', 'tx.x1', 'rx.p0', 'rx.p1', 'rx.x0', 'rx.x1'])
+        for row in trace:
+            # both ends of a wire see the same value
+            self.assertEqual(int(row['tx.p0']), 60)
+            self.assertEqual(int(row['rx.p0']), 60)
+            self.assertEqual(int(row['rx.p1']), 7)
+            self.assertEqual(int(row['tx.x0']), 7)
+            self.assertEqual(int(row['rx.x1']), 7)
+            self.assertEqual(int(row['rx.x0']), self.traces.NO_VALUE)
+
+
+class DifferencesTest(TraceTestCase):
+
+    def test_differences(self):
+        first = self.record_copier("first.npy", [5, 9])
+        second = self.record_copier("second.npy", [5, 8])
+        self.assertEqual(list(self.traces.differences(first, first)), [])
+        self.assertEqual(list(self.traces.differences(first, second)), [
+            (1, 'p1', 9, 8), (1, 'x0', 9, 8), (2, 'p1', 9, 8), (3, 'p1', 9, 8),
+        ])
+        self.assertEqual(list(self.traces.differences(first, second, limit=2)), [(1, 'p1', 9, 8), (1, 'x0', 9, 8)])
+
+    def test_rows_both_have(self):
+        first = self.record_copier("first.npy", [5, 9])
+        second = self.record_copier("second.npy", [5, 8], time_units=1)
+        self.assertEqual(list(self.traces.differences(first, second)), [])
+
+    def test_different_pins(self):
+        first = self.record_copier("first.npy", [5])
+        chip = shenasm.sim.Chip(decode([(None, 'slp', ['1'])], shenasm.chips.CHIP_TYPE_MC6000), shenasm.sim.PinIO())
+        second = self.traces.record_chip(chip, os.path.join(self.directory, "second.npy"), 4)
+        with self.assertRaises(ValueError):
+            list(self.traces.differences(first, second))
+
+
+class VcdTest(TraceTestCase):
+
+    def test_write(self):
+        stream = io.StringIO()
+        self.traces.write_vcd(self.record_copier("copier.npy", [5, 9]), stream)
+        self.assertEqual(stream.getvalue().splitlines(), [
+            "$timescale 1 ms $end",
+            "$var wire 16 ! p0 $end",
+            "$var wire 16 \" p1 $end",
+            "$var integer 16 # x0 $end",
+            "$var integer 16 $ x1 $end",
+            "$enddefinitions $end",
+            "#0",
+            "$dumpvars",
+            "b10100 !",
+            "b101 \"",
+            "b101 #",
+            "bx $",
+            "$end",
+            # only what changes is written, and an XBus pin with nothing on it is undefined
+            "#1",
+            "b1001 \"",
+            "b1001 #",
+            "#2",
+            "bx #",
+            "#4",
+        ])
+
+    def test_board_scopes(self):
+        programs = {'c': decode([(None, 'mov', ['50', 'p1']), (None, 'slp', ['1'])])}
+        board = shenasm.board.Board(programs, [['c.p1', 'out']], outputs=['out'])
+        stream = io.StringIO()
+        self.traces.write_vcd(self.traces.record_board(board, os.path.join(self.directory, "board.npy"), 1), stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[1], "$scope module c $end")
+        self.assertEqual(lines[6], "$upscope $end")
+        self.assertIn("b110010 \"", lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
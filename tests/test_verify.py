@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import shenasm
+
+
+# doubles each value read from "in" onto "out", and copies the level on "level" onto "copy"
+BOARD = {
+    "chips": [
+        {"name": "doubler", "type": "MC6000", "source": "doubler.asm"},
+        {"name": "copier", "type": "MC4000", "source": "copier.asm"},
+    ],
+    "wires": [["in", "doubler.x0"], ["doubler.x1", "out"], ["level", "copier.p0"], ["copier.p1", "copy"]],
+    "inputs": ["in", "level"],
+    "outputs": ["out", "copy"],
+}
+
+SOURCES = {
+    "doubler.asm": "  mov x0 acc\n  mul 2\n  mov acc x1\n",
+    "copier.asm": "  mov p0 p1\n  slp 1\n",
+}
+
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name, text in SOURCES.items():
+            self.write(name, text)
+        self.write("board.json", json.dumps(BOARD))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as handle:
+            handle.write(text)
+        return path
+
+    def verify(self, name, text):
+        issues = shenasm.errors.IssueLog()
+        spec = shenasm.board.read_board(issues, os.path.join(self.directory, "board.json"))
+        result = shenasm.verify.verify(issues, spec, self.write(name, text))
+        return issues, result
+
+    def test_csv_passes(self):
+        issues, result = self.verify(
+            "trace.csv",
+            "in,level,out,copy\n"
+            "1 2,50,2 4,50\n"
+            ",,,50\n"
+            "3,0,6,0\n"
+        )
+        self.assertEqual(issues.issues, [])
+        self.assertTrue(result.passed)
+        self.assertEqual(result.time_units, 3)
+        # 3 and 2 lines, an MC6000 and an MC4000, and every instruction run
+        self.assertEqual((result.lines, result.cost), (5, 8))
+        self.assertEqual(result.power, 9 + 6)
+
+    def test_json_lines_and_list(self):
+        rows = [{"in": [1], "level": 20, "out": [2], "copy": 20}, {"in": 5, "out": "10"}]
+        for name, text in (
+            ("trace.json", "\n".join(json.dumps(row) for row in rows)),
+            ("list.json", json.dumps(rows)),
+        ):
+            issues, result = self.verify(name, text)
+            self.assertEqual(issues.issues, [])
+            self.assertTrue(result.passed)
+            self.assertEqual(result.time_units, 2)
+
+    def test_mismatch_stops_replay(self):
+        issues, result = self.verify(
+            "trace.csv",
+            "in,level,out,copy\n"
+            "1,50,2,50\n"
+            "2,50,5,50\n"
+            "3,50,6,50\n"
+        )
+        self.assertFalse(result.passed)
+        self.assertEqual(result.time_units, 2)
+        self.assertEqual((result.mismatch.time, result.mismatch.terminal), (1, "out"))
+        self.assertEqual((result.mismatch.expected, result.mismatch.actual), ([5], [4]))
+        self.assertEqual([issue.code for issue in issues.issues], [shenasm.codes.TRACE_MISMATCH])
+        self.assertEqual(issues.issues[0].source_pos.line, 3)
+
+    def test_unknown_terminal(self):
+        issues, result = self.verify("trace.csv", "in,speaker\n1,0\n")
+        self.assertIsNone(result)
+        self.assertEqual([issue.code for issue in issues.issues], [shenasm.codes.TRACE_INVALID])
+
+    def test_bad_value(self):
+        issues, result = self.verify("trace.json", '{"level": "high"}\n')
+        self.assertIsNone(result)
+        self.assertEqual([issue.code for issue in issues.issues], [shenasm.codes.TRACE_INVALID])
+
+    def test_invalid_json(self):
+        issues, result = self.verify("trace.json", '{"level": 1}\n{"level"\n')
+        self.assertIsNone(result)
+        self.assertEqual([issue.code for issue in issues.issues], [shenasm.codes.TRACE_READ_ERROR])
+
+
+if __name__ == "__main__":
+    unittest.main()